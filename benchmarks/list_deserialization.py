@@ -0,0 +1,126 @@
+"""
+Benchmark: typed client models vs. the raw-JSON fast path for list calls.
+
+Builds a synthetic PodList shaped like a real cluster response (containers,
+env, volumes, managedFields, conditions) and measures the time to turn the
+response body into the summaries returned by ``get_all_pods_with_usage``.
+
+Usage:
+    python -m benchmarks.list_deserialization --pods 5000 --repeat 5
+"""
+import argparse
+import json
+import time
+
+from kubernetes import client
+
+from src import k8s_json
+from src.k8s_utils import _pod_summary
+
+
+class _Response:
+    """The minimal response object accepted by ApiClient.deserialize."""
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+
+def synthetic_pod(i: int) -> dict:
+    name = f"web-{i:05d}"
+    return {
+        "metadata": {
+            "name": name,
+            "namespace": f"team-{i % 20}",
+            "uid": f"00000000-0000-0000-0000-{i:012d}",
+            "resourceVersion": str(100000 + i),
+            "creationTimestamp": "2024-01-01T00:00:00Z",
+            "labels": {"app": "web", "pod-template-hash": "5d8f7c9b6d", "tier": "frontend"},
+            "annotations": {"prometheus.io/scrape": "true", "prometheus.io/port": "9090"},
+            "ownerReferences": [{"apiVersion": "apps/v1", "kind": "ReplicaSet", "name": "web-5d8f7c9b6d",
+                                 "uid": "11111111-1111-1111-1111-111111111111", "controller": True}],
+            "managedFields": [{"manager": "kube-controller-manager", "operation": "Update", "apiVersion": "v1",
+                               "time": "2024-01-01T00:00:00Z", "fieldsType": "FieldsV1",
+                               "fieldsV1": {"f:metadata": {"f:labels": {".": {}, "f:app": {}}}}}],
+        },
+        "spec": {
+            "nodeName": f"node-{i % 50}",
+            "serviceAccountName": "default",
+            "containers": [{
+                "name": c,
+                "image": f"registry.example.com/{c}:1.2.3",
+                "ports": [{"containerPort": 8080, "protocol": "TCP"}],
+                "env": [{"name": f"VAR_{k}", "value": str(k)} for k in range(10)],
+                "resources": {"requests": {"cpu": "100m", "memory": "128Mi"},
+                              "limits": {"cpu": "500m", "memory": "512Mi"}},
+                "volumeMounts": [{"name": "config", "mountPath": "/etc/config", "readOnly": True}],
+                "livenessProbe": {"httpGet": {"path": "/healthz", "port": 8080}, "periodSeconds": 10},
+            } for c in ("app", "sidecar")],
+            "volumes": [{"name": "config", "configMap": {"name": "web-config"}}],
+            "tolerations": [{"key": "node.kubernetes.io/not-ready", "operator": "Exists",
+                             "effect": "NoExecute", "tolerationSeconds": 300}],
+        },
+        "status": {
+            "phase": "Running",
+            "podIP": f"10.0.{i // 256 % 256}.{i % 256}",
+            "startTime": "2024-01-01T00:00:00Z",
+            "conditions": [{"type": t, "status": "True", "lastTransitionTime": "2024-01-01T00:00:00Z"}
+                           for t in ("Initialized", "Ready", "ContainersReady", "PodScheduled")],
+            "containerStatuses": [{"name": c, "ready": True, "restartCount": 0, "image": f"{c}:1.2.3",
+                                   "imageID": "sha256:" + "0" * 64, "containerID": "containerd://" + "0" * 64,
+                                   "state": {"running": {"startedAt": "2024-01-01T00:00:00Z"}}}
+                                  for c in ("app", "sidecar")],
+        },
+    }
+
+
+def model_path(body: bytes, api_client) -> list:
+    """What the typed client does: build V1Pod models, then copy fields out."""
+    pods = api_client.deserialize(_Response(body), "V1PodList").items
+    return [
+        {
+            "name": pod.metadata.name,
+            "namespace": pod.metadata.namespace,
+            "status": pod.status.phase if pod.status else "Unknown",
+            "node": pod.spec.node_name if pod.spec else "Unknown",
+            "cpu": "N/A",
+            "memory": "N/A",
+        }
+        for pod in pods
+    ]
+
+
+def fast_path(body: bytes) -> list:
+    return [_pod_summary(pod, {}) for pod in k8s_json.loads(body).get("items") or []]
+
+
+def best_of(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pods", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    body = json.dumps({"kind": "PodList", "apiVersion": "v1", "metadata": {},
+                       "items": [synthetic_pod(i) for i in range(args.pods)]}).encode("utf-8")
+    api_client = client.ApiClient()
+
+    assert model_path(body, api_client) == fast_path(body)
+
+    model = best_of(lambda: model_path(body, api_client), args.repeat)
+    fast = best_of(lambda: fast_path(body), args.repeat)
+    parser_name = "orjson" if k8s_json.orjson is not None else "json"
+    print(f"{args.pods} pods, {len(body) / 1e6:.1f} MB body, best of {args.repeat}")
+    print(f"  typed models        {model * 1000:9.1f} ms")
+    print(f"  raw JSON ({parser_name:6}) {fast * 1000:9.1f} ms   ({model / fast:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
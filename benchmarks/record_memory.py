@@ -0,0 +1,81 @@
+"""
+Benchmark: memory footprint of cached pods per representation.
+
+Builds synthetic pods spread over ReplicaSets, nodes and namespaces (see
+``list_deserialization.synthetic_pod``) and measures, with tracemalloc, the
+memory held by keeping them as:
+
+- typed client models (``V1Pod``), optional because building them is slow;
+- the parsed JSON dicts;
+- the projected field dicts used before records (``record.to_dict()``);
+- the ``k8s_records`` slotted records kept by the informers.
+
+Usage:
+    python -m benchmarks.record_memory --pods 10000 [--models]
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+
+from kubernetes import client
+
+from benchmarks.list_deserialization import _Response, synthetic_pod
+from src import k8s_json
+from src.resource_graph import slim_pod
+
+
+def realistic_pod(i: int) -> dict:
+    pod = synthetic_pod(i)
+    # 200 ReplicaSets of 50 pods each
+    replica_set = i % 200
+    pod["metadata"]["labels"]["pod-template-hash"] = f"{replica_set:010x}"
+    pod["metadata"]["labels"]["app"] = f"app-{replica_set}"
+    owner = pod["metadata"]["ownerReferences"][0]
+    owner["name"] = f"app-{replica_set}-{replica_set:010x}"
+    owner["uid"] = f"11111111-1111-1111-1111-{replica_set:012d}"
+    return pod
+
+
+def footprint(build) -> float:
+    """Returns the bytes still allocated by ``build()``'s result."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    result = build()
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del result
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pods", type=int, default=10000)
+    parser.add_argument("--models", action="store_true", help="also measure V1Pod models (slow)")
+    args = parser.parse_args()
+
+    body = json.dumps({"kind": "PodList", "apiVersion": "v1", "metadata": {},
+                       "items": [realistic_pod(i) for i in range(args.pods)]}).encode("utf-8")
+
+    results = []
+    if args.models:
+        api_client = client.ApiClient()
+        results.append(("V1Pod models", footprint(
+            lambda: api_client.deserialize(_Response(body), "V1PodList").items)))
+    # Each representation is built from the body, so the strings it keeps alive are counted
+    results.append(("parsed JSON dicts", footprint(lambda: k8s_json.loads(body)["items"])))
+    results.append(("projected dicts", footprint(
+        lambda: [slim_pod(pod).to_dict() for pod in k8s_json.loads(body)["items"]])))
+    results.append(("slotted records", footprint(lambda: [slim_pod(pod) for pod in k8s_json.loads(body)["items"]])))
+
+    per_10k = 10000 / args.pods
+    print(f"{args.pods} pods; memory held per 10k pods")
+    for name, size in results:
+        print(f"  {name:18} {size * per_10k / 2 ** 20:9.1f} MiB   {size / args.pods:8.0f} B/pod")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Cooperative cancellation and time budgets of agent runs.
+
+Each WebSocket or REST query runs under a ``CancellationToken``, made current
+in its worker thread with ``cancellable``. Once the token is cancelled
+(client disconnect, "cancel <id>", "exit"):
+
+- the agent loop stops before its next LLM or tool call (``CancellationHandler``);
+- LLM calls waiting for admission leave the scheduler queue, and streamed LLM
+  responses are closed between chunks;
+- Kubernetes requests are refused before they are sent, and response bodies
+  being read are aborted.
+
+Python cannot interrupt a thread, so work between these checks finishes
+first, but the run's LLM and API server capacity is freed at the next one.
+``cancellation_stats`` reports the runs in progress and what was cut short.
+
+A run may also have a ``budget``: a deadline and a number of agent
+iterations. The deadline bounds the same checkpoints: every LLM call, every
+Kubernetes request (as its ``_request_timeout``) and every wait for an LLM
+slot. Past it they raise ``DeadlineExceeded``, and the agent answers with
+what it found so far.
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+_current = contextvars.ContextVar("kubesage_cancellation", default=None)
+# (monotonic deadline, agent iterations) of the run in progress
+_budget = contextvars.ContextVar("kubesage_budget", default=None)
+_stats = Counter()
+_stats_lock = threading.Lock()
+_active = set()
+_kubernetes_checked = False
+
+
+class RunCancelled(Exception):
+    """Raised inside a run whose token was cancelled."""
+
+
+class DeadlineExceeded(Exception):
+    """Raised inside a run whose time budget ran out."""
+
+
+def count(event: str, n: int = 1) -> None:
+    """Adds to a cancellation counter reported by ``cancellation_stats``."""
+    with _stats_lock:
+        _stats[event] += n
+
+
+class CancellationToken:
+    """Cancellation state of one run, shared by the threads working for it."""
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.reason = None
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        """Cancels the run and aborts the operations registered with ``on_cancel``."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"⚠️ Could not abort an operation of {self.label or 'a run'}: {e}")
+
+    def check(self) -> None:
+        """Raises ``RunCancelled`` if the run was cancelled."""
+        if self._event.is_set():
+            raise RunCancelled(f"🛑 Query cancelled: {self.reason}")
+
+    @contextmanager
+    def on_cancel(self, callback):
+        """Calls ``callback`` if the run is cancelled while the block runs (at once if it already is)."""
+        with self._lock:
+            registered = not self._event.is_set()
+            if registered:
+                self._callbacks.append(callback)
+        if not registered:
+            callback()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+    def guard(self, iterator, event: str = "llm_streams_closed"):
+        """Yields from ``iterator`` until the run is cancelled, then closes it (and the response behind it)."""
+        try:
+            for item in iterator:
+                if self._event.is_set():
+                    count(event)
+                    self.check()
+                check_deadline()
+                yield item
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+
+def current_token():
+    """Returns the token of the run in progress in this context, or None."""
+    return _current.get()
+
+
+def check_cancelled() -> None:
+    """Raises ``RunCancelled`` if the current run was cancelled."""
+    token = _current.get()
+    if token is not None:
+        token.check()
+
+
+@contextmanager
+def cancellable(token: CancellationToken):
+    """Makes ``token`` current for the block, which is counted as one run."""
+    reset = _current.set(token)
+    with _stats_lock:
+        _active.add(token)
+        _stats["runs"] += 1
+    try:
+        yield token
+    finally:
+        _current.reset(reset)
+        with _stats_lock:
+            _active.discard(token)
+            if token.cancelled:
+                _stats["runs_cancelled"] += 1
+
+
+def run_cancellable(token: CancellationToken, func, *args, **kwargs):
+    """Calls ``func`` with ``token`` current; for use with ``asyncio.to_thread``."""
+    with cancellable(token):
+        return func(*args, **kwargs)
+
+
+def aborting(abort, event: str):
+    """
+    Calls ``abort`` if the current run is cancelled while the block runs.
+
+    Errors caused by the abort are raised as ``RunCancelled``. Outside a run
+    this does nothing.
+    """
+    token = _current.get()
+    if token is None:
+        return nullcontext()
+    return _aborting(token, abort, event)
+
+
+@contextmanager
+def _aborting(token: CancellationToken, abort, event: str):
+    token.check()
+    try:
+        with token.on_cancel(abort):
+            yield
+    except Exception as e:
+        if token.cancelled:
+            count(event)
+            raise RunCancelled(f"🛑 Query cancelled: {token.reason}") from e
+        raise
+
+
+class CancellationHandler(BaseCallbackHandler):
+    """Stops the agent at its next step once the current run is cancelled."""
+
+    # Errors of other handlers are only logged; this one must stop the run
+    raise_error = True
+
+    def _check(self) -> None:
+        token = _current.get()
+        if token is not None and token.cancelled:
+            count("agent_steps_skipped")
+            token.check()
+        check_deadline()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._check()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._check()
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self._check()
+
+
+def query_timeout() -> float:
+    """Default time budget of a query in seconds (``KUBESAGE_QUERY_TIMEOUT_SECONDS``)."""
+    return float(os.getenv("KUBESAGE_QUERY_TIMEOUT_SECONDS", "120"))
+
+
+def max_iterations() -> int:
+    """Default number of agent iterations of a query (``KUBESAGE_MAX_ITERATIONS``)."""
+    return int(os.getenv("KUBESAGE_MAX_ITERATIONS", "15"))
+
+
+@contextmanager
+def budget(seconds: float = None, iterations: int = None):
+    """
+    Gives the block a deadline and an agent-iteration budget.
+
+    A budget inside another one can only shorten it. Limits left as None keep
+    the enclosing budget's, or the defaults outside one.
+
+    Args:
+        seconds: Time budget from now
+        iterations: Maximum number of agent iterations (LLM calls of the agent loop)
+    """
+    outer = _budget.get()
+    if seconds is not None:
+        deadline = time.monotonic() + seconds
+        if outer is not None:
+            deadline = min(deadline, outer[0])
+    else:
+        deadline = outer[0] if outer is not None else time.monotonic() + query_timeout()
+    if iterations is not None:
+        iterations = min(iterations, outer[1]) if outer is not None else iterations
+    else:
+        iterations = outer[1] if outer is not None else max_iterations()
+    reset = _budget.set((deadline, iterations))
+    try:
+        yield
+    finally:
+        _budget.reset(reset)
+
+
+def time_left():
+    """Returns the seconds left in the current budget, or None outside one."""
+    current = _budget.get()
+    if current is None:
+        return None
+    return max(0.0, current[0] - time.monotonic())
+
+
+def iteration_budget():
+    """Returns the agent iterations of the current budget, or None outside one."""
+    current = _budget.get()
+    return current[1] if current is not None else None
+
+
+def check_deadline() -> None:
+    """Raises ``DeadlineExceeded`` if the current budget has run out."""
+    if time_left() == 0:
+        raise DeadlineExceeded("⏱️ The query ran out of time")
+
+
+def bounded_request_timeout(timeout, remaining: float):
+    """
+    Clips a Kubernetes ``_request_timeout`` to the seconds left in the run.
+
+    The timeout is None, a number of seconds, or a (connect, read) tuple whose
+    elements are clipped separately.
+    """
+    if timeout is None:
+        return remaining
+    if isinstance(timeout, (tuple, list)):
+        return tuple(remaining if part is None else min(part, remaining) for part in timeout)
+    return min(timeout, remaining)
+
+
+def install_kubernetes_checks() -> None:
+    """Makes the Kubernetes REST client refuse requests of cancelled runs and bound them by the run's deadline."""
+    global _kubernetes_checked
+    with _stats_lock:
+        if _kubernetes_checked:
+            return
+        _kubernetes_checked = True
+
+    from kubernetes.client import rest
+
+    original_request = rest.RESTClientObject.request
+
+    def checked_request(self, method, url, *args, **kwargs):
+        token = _current.get()
+        if token is not None and token.cancelled:
+            count("k8s_requests_refused")
+            token.check()
+        remaining = time_left()
+        if remaining is not None:
+            check_deadline()
+            # Requests of a run never outlive its deadline
+            kwargs["_request_timeout"] = bounded_request_timeout(kwargs.get("_request_timeout"), remaining)
+        return original_request(self, method, url, *args, **kwargs)
+
+    rest.RESTClientObject.request = checked_request
+
+
+def cancellation_stats() -> dict:
+    """Returns the runs in progress and counters of cancelled work since the server started."""
+    with _stats_lock:
+        return {"active_runs": len(_active), "cancelling": sum(t.cancelled for t in _active), **_stats}
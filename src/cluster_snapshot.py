@@ -0,0 +1,320 @@
+"""
+Cluster snapshots shared by the worker processes of one server.
+
+Informers are per process, so ``uvicorn --workers N`` would list and watch
+every collection N times. With ``KUBESAGE_SNAPSHOT_DIR`` set, one process —
+the first to take the collector lock in that directory — runs the informers
+and records the cluster history. It publishes each collection to a file
+whenever it changes (checked every ``KUBESAGE_SNAPSHOT_INTERVAL_SECONDS``).
+The other workers read collections from those files through a
+``SnapshotSource``, which has the reading interface of an ``Informer``.
+
+A snapshot file is written once and replaced atomically. It is JSON in which
+records (see ``k8s_records``) and tuples are tagged, so reading one never runs
+code: only record classes are instantiated, and repeated strings and tuples
+are shared again as they are decoded. Each worker only decodes a collection
+again after it has changed. The collector only applies the transforms in
+``ALLOWED_TRANSFORMS``. The directory is created private to the user, and
+sharing refuses to start if other users can write to it.
+
+When the collector exits, its lock is released and another worker takes over.
+"""
+import fcntl
+import functools
+import hashlib
+import importlib
+import json
+import os
+import stat
+import threading
+import time
+
+from kubernetes import client
+
+from src.k8s_informer import get_informer
+from src.k8s_records import Record, intern, shared
+from src.k8s_utils import load_kube_config
+
+LOCK_FILE = "collector.lock"
+STATUS_FILE = "collector.json"
+
+# Transforms a worker may ask the collector to apply; requests naming any other function are refused
+ALLOWED_TRANSFORMS = frozenset({
+    "src.resource_graph:slim_pod",
+    "src.resource_graph:slim_service",
+    "src.resource_graph:slim_endpoints",
+    "src.resource_graph:slim_workload",
+    "src.resource_graph:slim_claim",
+    "src.resource_graph:slim_volume",
+    "src.rbac_index:slim_rbac_object",
+})
+
+# Classes a snapshot may contain; reading one instantiates nothing else
+RECORD_TYPES = {cls.__name__: cls for cls in Record.__subclasses__() if cls.__module__ == Record.__module__}
+
+# Tags of records, tuples and (escaped) dicts in snapshot files
+_TAGS = ("$r", "$t", "$d")
+
+
+def snapshot_dir():
+    """Returns the directory shared with the other workers, or None when snapshots are not shared."""
+    return os.getenv("KUBESAGE_SNAPSHOT_DIR") or None
+
+
+def _interval() -> float:
+    return float(os.getenv("KUBESAGE_SNAPSHOT_INTERVAL_SECONDS", "1"))
+
+
+def _file(directory: str, host: str, path: str, suffix: str) -> str:
+    digest = hashlib.sha256(f"{host}{path}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(directory, f"{digest}.{suffix}")
+
+
+def _write_atomically(file: str, data: bytes) -> None:
+    temporary = f"{file}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(data)
+    os.replace(temporary, file)
+
+
+def transform_name(transform) -> str:
+    """Returns an importable ``module:qualname`` reference to a transform function."""
+    return f"{transform.__module__}:{transform.__qualname__}" if transform else None
+
+
+def resolve_transform(name: str):
+    """
+    Imports the transform named by ``transform_name``.
+
+    Raises:
+        ValueError: If the transform is not in ``ALLOWED_TRANSFORMS``.
+    """
+    if not name:
+        return None
+    if name not in ALLOWED_TRANSFORMS:
+        raise ValueError(f"transform {name} is not allowed")
+    module, _, qualname = name.partition(":")
+    return functools.reduce(getattr, qualname.split("."), importlib.import_module(module))
+
+
+def _encode(value):
+    if isinstance(value, Record):
+        return {"$r": type(value).__name__, "v": [_encode(getattr(value, slot)) for slot in value.__slots__]}
+    if isinstance(value, tuple):
+        return {"$t": [_encode(item) for item in value]}
+    if isinstance(value, dict):
+        if any(tag in value for tag in _TAGS):
+            return {"$d": [[key, _encode(item)] for key, item in value.items()]}
+        return {key: _encode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _decode(obj: dict):
+    if "$r" in obj:
+        record_type = RECORD_TYPES.get(obj["$r"])
+        if record_type is None:
+            raise ValueError(f"unknown record type {obj['$r']}")
+        return record_type(*(intern(value) for value in obj["v"]))
+    if "$t" in obj:
+        values = tuple(intern(value) for value in obj["$t"])
+        try:
+            return shared(values)
+        except TypeError:
+            return values  # holds unhashable values
+    if "$d" in obj:
+        return dict(obj["$d"])
+    return obj
+
+
+def publish(informer, file: str) -> int:
+    """Writes the informer's objects to a snapshot file; returns the version written."""
+    version, store = informer.snapshot()
+    document = [[list(key), _encode(obj)] for key, obj in store.items()]
+    _write_atomically(file, json.dumps(document, separators=(",", ":")).encode("utf-8"))
+    return version
+
+
+def read_snapshot(file: str) -> tuple:
+    """
+    Returns the file's version (inode and modification time) and the objects it holds.
+
+    Raises:
+        ValueError: If the file is not a snapshot or names an unknown record type.
+    """
+    with open(file, "rb") as f:
+        file_stat = os.fstat(f.fileno())
+        document = json.loads(f.read(), object_hook=_decode)
+    return (file_stat.st_ino, file_stat.st_mtime_ns), {tuple(key): obj for key, obj in document}
+
+
+def ensure_private_dir(directory: str) -> None:
+    """
+    Creates the shared directory readable and writable by the current user only.
+
+    Raises:
+        PermissionError: If the directory belongs to another user, or other users can write to it.
+    """
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if info.st_uid != os.getuid():
+        raise PermissionError(f"{directory} belongs to another user; refusing to share cluster snapshots")
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"{directory} is writable by other users; refusing to share cluster snapshots "
+                              f"(run chmod 700 {directory})")
+
+
+class SnapshotSource:
+    """Reads a collection from the snapshot published by the collector process."""
+
+    def __init__(self, file: str, path: str, api_client):
+        self.file = file
+        self.path = path
+        self.api_client = api_client
+        self._loaded = None
+        self._store = {}
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+        try:
+            stat = os.stat(self.file)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def _current(self) -> dict:
+        version = self.version
+        if version is not None and version != self._loaded:
+            with self._lock:
+                if version != self._loaded:
+                    self._loaded, self._store = read_snapshot(self.file)
+        return self._store
+
+    def items(self) -> list:
+        return list(self._current().values())
+
+    def get(self, namespace: str, name: str):
+        return self._current().get((namespace or "", name))
+
+    def wait_synced(self, timeout: float = None) -> bool:
+        """Waits for the collector's first snapshot; returns False if it is not published in time."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not os.path.exists(self.file):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.1)
+        return True
+
+
+_sources = {}
+_sources_lock = threading.Lock()
+_collecting = threading.Event()
+_collector_thread = None
+
+
+def get_source(path: str, transform=None, api_client=None):
+    """
+    Returns a reader of a collection.
+
+    Without ``KUBESAGE_SNAPSHOT_DIR``, or in the collector process, this is the
+    collection's informer. In the other workers it is a ``SnapshotSource``, and
+    the collector is asked to publish the collection.
+    """
+    directory = snapshot_dir()
+    if directory is None or _collecting.is_set():
+        return get_informer(path, transform, api_client)
+    if api_client is None:
+        load_kube_config()
+        api_client = client.ApiClient()
+    start_snapshot_sharing()
+    host = api_client.configuration.host
+    key = (host, path)
+    with _sources_lock:
+        if key not in _sources:
+            request = {"host": host, "path": path, "transform": transform_name(transform)}
+            _write_atomically(_file(directory, host, path, "request"), json.dumps(request).encode("utf-8"))
+            _sources[key] = SnapshotSource(_file(directory, host, path, "snapshot"), path, api_client)
+        return _sources[key]
+
+
+def collector_status(directory: str = None):
+    """Returns what the collector last reported, or None if no collector is running."""
+    directory = directory or snapshot_dir()
+    if directory is None:
+        return None
+    try:
+        with open(os.path.join(directory, STATUS_FILE), encoding="utf-8") as f:
+            status = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # A collector reports every interval; an old report means it is gone
+    return status if time.time() - status.get("updated", 0) < 3 * _interval() + 10 else None
+
+
+def collect_once(directory: str, api_client, published: dict) -> None:
+    """Publishes every requested collection of the collector's cluster that changed since ``published``."""
+    host = api_client.configuration.host
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".request"):
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                request = json.load(f)
+            if request["host"] != host:
+                continue  # Workers only share snapshots of the cluster the collector watches
+            informer = get_informer(request["path"], resolve_transform(request["transform"]), api_client)
+            file = _file(directory, host, request["path"], "snapshot")
+            if informer.wait_synced(0) and published.get(file) != informer.version:
+                published[file] = publish(informer, file)
+        except Exception as e:
+            print(f"⚠️ Could not publish snapshot for {name}: {e}")
+
+
+def _collect(directory: str) -> None:
+    with open(os.path.join(directory, LOCK_FILE), "a") as lock:
+        # Blocks until no other process collects, so a worker takes over when the collector exits
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        print(f"📡 Collecting cluster snapshots for all workers (pid {os.getpid()})")
+        _collecting.set()
+        load_kube_config()
+        api_client = client.ApiClient()
+        recording = False
+        try:
+            from src.history_store import start_history_recording
+            recording = start_history_recording() is not None
+        except Exception as e:
+            print(f"⚠️ Cluster history is not recorded: {e}")
+        published = {}
+        while True:
+            collect_once(directory, api_client, published)
+            status = {"pid": os.getpid(), "host": api_client.configuration.host,
+                      "history": recording, "updated": time.time()}
+            try:
+                _write_atomically(os.path.join(directory, STATUS_FILE), json.dumps(status).encode("utf-8"))
+            except OSError as e:
+                print(f"⚠️ Could not write snapshot collector status: {e}")
+            time.sleep(_interval())
+
+
+def start_snapshot_sharing() -> bool:
+    """
+    Joins the election of the collector process, once per process.
+
+    Returns False when ``KUBESAGE_SNAPSHOT_DIR`` is not set.
+
+    Raises:
+        PermissionError: If other users can write to the directory (see ``ensure_private_dir``).
+    """
+    global _collector_thread
+    directory = snapshot_dir()
+    if directory is None:
+        return False
+    with _sources_lock:
+        if _collector_thread is None:
+            ensure_private_dir(directory)
+            _collector_thread = threading.Thread(target=_collect, args=(directory,),
+                                                 name="kubesage-snapshot-collector", daemon=True)
+            _collector_thread.start()
+    return True
@@ -0,0 +1,126 @@
+"""
+Token-bounded conversation memory for the troubleshooting agent.
+
+Recent turns are kept verbatim. Once the buffer exceeds the token budget
+(``KUBESAGE_MEMORY_MAX_TOKENS``), the oldest turns are folded into a rolling
+summary, so the history sent with each step stays roughly constant in size no
+matter how long the session runs. If a summary cannot be written, the turns
+stay in the buffer and are summarized by a later save. Large fenced dumps are dropped before a turn
+is stored: the agent can fetch fresh data when needed. Short fenced blocks,
+such as a suggested fix, are kept so follow-up questions can refer to them.
+"""
+import os
+import re
+
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+DEFAULT_MAX_TOKENS = 2000
+
+# Fenced blocks in answers; those longer than MAX_KEPT_BLOCK_CHARS are dumps pasted from tool output
+_FENCED_PATTERN = re.compile(r"```[\w-]*\n.*?```", re.DOTALL)
+MAX_KEPT_BLOCK_CHARS = 1000
+
+_MESSAGE_TYPES = {"human": HumanMessage, "ai": AIMessage, "system": SystemMessage}
+
+OMITTED = "[tool output omitted]"
+
+
+def strip_tool_output(text: str) -> str:
+    """Removes fenced blocks longer than ``MAX_KEPT_BLOCK_CHARS`` (pasted resource dumps) from agent text."""
+    return _FENCED_PATTERN.sub(
+        lambda block: OMITTED if len(block.group(0)) > MAX_KEPT_BLOCK_CHARS else block.group(0), text
+    )
+
+
+def _estimate_tokens(text: str) -> int:
+    """Rough token estimate (about four characters per token)."""
+    return len(text) // 4 + 1
+
+
+class BoundedSummaryMemory(ConversationSummaryBufferMemory):
+    """Summary buffer memory with a token budget that does not store large tool output dumps."""
+
+    def save_context(self, inputs: dict, outputs: dict) -> None:
+        super().save_context(inputs, self._strip(outputs))
+
+    async def asave_context(self, inputs: dict, outputs: dict) -> None:
+        await super().asave_context(inputs, self._strip(outputs))
+
+    @staticmethod
+    def _strip(outputs: dict) -> dict:
+        return {k: strip_tool_output(v) if isinstance(v, str) else v for k, v in outputs.items()}
+
+    def count_tokens(self, message) -> int:
+        """Counts the tokens of one message, falling back to an estimate offline."""
+        text = str(message.content)
+        try:
+            return self.llm.get_num_tokens(text)
+        except Exception:
+            # The tokenizer may be unavailable (unknown model, no network to fetch encodings)
+            return _estimate_tokens(text)
+
+    def _pop_over_budget(self) -> list:
+        """Removes the oldest messages until the buffer fits the token budget."""
+        buffer = self.chat_memory.messages
+        counts = [self.count_tokens(m) for m in buffer]
+        total = sum(counts)
+        pruned = []
+        while buffer and total > self.max_token_limit:
+            total -= counts.pop(0)
+            pruned.append(buffer.pop(0))
+        return pruned
+
+    def _keep_unsummarized(self, pruned: list, error: Exception) -> None:
+        """Puts messages back at the start of the buffer when summarizing them failed."""
+        # Summarizing is housekeeping: the next save tries again, and the answer is not lost
+        print(f"⚠️ Could not summarize older turns, keeping them for now: {error}")
+        self.chat_memory.messages[:0] = pruned
+
+    def prune(self) -> None:
+        pruned = self._pop_over_budget()
+        if pruned:
+            try:
+                self.moving_summary_buffer = self.predict_new_summary(pruned, self.moving_summary_buffer)
+            except Exception as e:
+                self._keep_unsummarized(pruned, e)
+
+    async def aprune(self) -> None:
+        pruned = self._pop_over_budget()
+        if pruned:
+            try:
+                self.moving_summary_buffer = await self.apredict_new_summary(pruned, self.moving_summary_buffer)
+            except Exception as e:
+                self._keep_unsummarized(pruned, e)
+
+
+def create_memory(llm, max_tokens: int = None) -> BoundedSummaryMemory:
+    """Creates the agent's conversation memory using ``llm`` for summaries."""
+    if max_tokens is None:
+        max_tokens = int(os.getenv("KUBESAGE_MEMORY_MAX_TOKENS", str(DEFAULT_MAX_TOKENS)))
+    return BoundedSummaryMemory(
+        llm=llm,
+        max_token_limit=max_tokens,
+        memory_key="chat_history",
+        input_key="input",
+        output_key="output",
+        return_messages=True,
+    )
+
+
+def memory_state(memory: BoundedSummaryMemory) -> dict:
+    """Returns the summary and messages of a memory as compact, JSON-serializable state."""
+    return {
+        "summary": memory.moving_summary_buffer,
+        "messages": [[message.type, message.content] for message in memory.chat_memory.messages],
+    }
+
+
+def restore_memory(llm, state: dict = None, max_tokens: int = None) -> BoundedSummaryMemory:
+    """Creates a memory holding ``state`` as returned by ``memory_state`` (empty when None)."""
+    memory = create_memory(llm, max_tokens)
+    if state:
+        memory.moving_summary_buffer = state.get("summary") or ""
+        memory.chat_memory.messages = [_MESSAGE_TYPES[kind](content=content)
+                                       for kind, content in state.get("messages") or []]
+    return memory
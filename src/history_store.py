@@ -0,0 +1,389 @@
+"""
+Local history of cluster changes and resource usage, for "what changed" questions.
+
+Recording is opt-in (``KUBESAGE_HISTORY_ENABLED=true``). While recording,
+every change the informers see to pods, services, endpoints, workloads, volumes
+and nodes is stored as a field-level diff, and node and pod CPU/memory usage
+from metrics-server is sampled every ``KUBESAGE_HISTORY_SAMPLE_SECONDS``. Both
+go to an SQLite database per cluster (``KUBESAGE_HISTORY_DIR``), indexed on
+kind, namespace and time so a window of history is read without scanning the
+whole table.
+
+Rows are written in batches by a background thread. Usage samples older than
+``KUBESAGE_HISTORY_COMPACT_AFTER_HOURS`` are averaged into 10-minute buckets,
+and everything older than ``KUBESAGE_HISTORY_RETENTION_HOURS`` is deleted.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from datetime import datetime, timezone
+
+from kubernetes import client
+
+from src import k8s_json
+from src.cluster_snapshot import collector_status
+from src.k8s_informer import get_informer
+from src.k8s_records import NodeRecord, ObjectMeta, intern, pairs, shared, to_plain
+from src.k8s_utils import list_items, load_kube_config, parse_quantity
+from src.resource_graph import SOURCES
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS changes (
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    namespace TEXT NOT NULL,
+    name TEXT NOT NULL,
+    event TEXT NOT NULL,
+    diff TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_kind_namespace_ts ON changes (kind, namespace, ts);
+CREATE INDEX IF NOT EXISTS changes_ts ON changes (ts);
+CREATE TABLE IF NOT EXISTS samples (
+    ts REAL NOT NULL,
+    resolution INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    namespace TEXT NOT NULL,
+    name TEXT NOT NULL,
+    cpu REAL,
+    memory REAL
+);
+CREATE INDEX IF NOT EXISTS samples_kind_namespace_ts ON samples (kind, namespace, ts);
+CREATE INDEX IF NOT EXISTS samples_resolution_ts ON samples (resolution, ts);
+"""
+
+# Resolution of compacted usage samples, in seconds
+COMPACTED_RESOLUTION = 600
+
+# Fields that identify an object rather than describe its state
+IGNORED_FIELDS = ("metadata.uid", "metadata.owners")
+
+
+def slim_node(obj: dict) -> NodeRecord:
+    spec, status = obj.get("spec") or {}, obj.get("status") or {}
+    return NodeRecord(
+        ObjectMeta.from_json(obj),
+        bool(spec.get("unschedulable")),
+        shared(tuple(sorted(intern(f"{t.get('key')}:{t.get('effect')}") for t in spec.get("taints") or []))),
+        pairs({c.get("type"): c.get("status") for c in status.get("conditions") or []}),
+        intern((status.get("nodeInfo") or {}).get("kubeletVersion")),
+    )
+
+
+def diff_objects(old, new) -> dict:
+    """Returns ``{field path: [old value, new value]}`` for every field that differs; records are compared as dicts."""
+    changes = {}
+
+    def walk(path, a, b):
+        if path in IGNORED_FIELDS:
+            return
+        if isinstance(a, dict) and isinstance(b, dict):
+            for key in sorted(a.keys() | b.keys()):
+                walk(f"{path}.{key}" if path else key, a.get(key), b.get(key))
+        elif a != b:
+            changes[path] = [a, b]
+
+    walk("", to_plain(old) or {}, to_plain(new) or {})
+    return changes
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="seconds")
+
+
+class HistoryStore:
+    """SQLite store of object diffs and usage samples."""
+
+    def __init__(self, path: str, retention_hours: float = None, compact_after_hours: float = None):
+        self.path = path
+        self.retention = 3600 * (retention_hours if retention_hours is not None else float(
+            os.getenv("KUBESAGE_HISTORY_RETENTION_HOURS", "72")))
+        self.compact_after = 3600 * (compact_after_hours if compact_after_hours is not None else float(
+            os.getenv("KUBESAGE_HISTORY_COMPACT_AFTER_HOURS", "6")))
+        self._pending_changes = []
+        self._pending_samples = []
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    def _reader(self) -> sqlite3.Connection:
+        # With WAL, readers on their own connection never wait for the writer
+        return sqlite3.connect(self.path)
+
+    # ------------------------------
+    # Writing
+    # ------------------------------
+
+    def record_change(self, kind: str, event_type: str, old, new, ts: float = None) -> None:
+        """Queues the diff of one object change; the signature matches informer listeners after ``kind``."""
+        metadata = to_plain(new or old)["metadata"]
+        diff = diff_objects(old, new)
+        if not diff and event_type == "MODIFIED":
+            return
+        with self._pending_lock:
+            self._pending_changes.append((ts or time.time(), kind, metadata.get("namespace") or "",
+                                          metadata["name"], event_type, k8s_json.dumps(diff)))
+
+    def record_samples(self, kind: str, samples: list, ts: float = None) -> None:
+        """Queues usage samples as ``(namespace, name, cpu cores, memory bytes)`` tuples."""
+        ts = ts or time.time()
+        with self._pending_lock:
+            self._pending_samples.extend((ts, 0, kind, namespace or "", name, cpu, memory)
+                                         for namespace, name, cpu, memory in samples)
+
+    def flush(self) -> int:
+        """Writes queued rows in one transaction; returns the number of rows written."""
+        with self._pending_lock:
+            changes, self._pending_changes = self._pending_changes, []
+            samples, self._pending_samples = self._pending_samples, []
+        if not changes and not samples:
+            return 0
+        with self._write_lock, self._db:
+            self._db.executemany("INSERT INTO changes VALUES (?, ?, ?, ?, ?, ?)", changes)
+            self._db.executemany("INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?)", samples)
+        return len(changes) + len(samples)
+
+    def maintain(self, now: float = None) -> None:
+        """Deletes rows past retention and averages old usage samples into 10-minute buckets."""
+        now = now or time.time()
+        with self._write_lock:
+            with self._db:
+                self._db.execute("DELETE FROM changes WHERE ts < ?", (now - self.retention,))
+                self._db.execute("DELETE FROM samples WHERE ts < ?", (now - self.retention,))
+                cutoff = now - self.compact_after
+                # Only whole buckets, so a bucket is never compacted twice
+                cutoff -= cutoff % COMPACTED_RESOLUTION
+                self._db.execute(
+                    "INSERT INTO samples SELECT CAST(ts / ? AS INTEGER) * ?, ?, kind, namespace, name, "
+                    "AVG(cpu), AVG(memory) FROM samples WHERE resolution < ? AND ts < ? "
+                    "GROUP BY CAST(ts / ? AS INTEGER), kind, namespace, name",
+                    (COMPACTED_RESOLUTION, COMPACTED_RESOLUTION, COMPACTED_RESOLUTION,
+                     COMPACTED_RESOLUTION, cutoff, COMPACTED_RESOLUTION),
+                )
+                self._db.execute("DELETE FROM samples WHERE resolution < ? AND ts < ?",
+                                 (COMPACTED_RESOLUTION, cutoff))
+            self._db.execute("PRAGMA incremental_vacuum")
+
+    # ------------------------------
+    # Reading
+    # ------------------------------
+
+    def changes(self, since: float, until: float = None, kind: str = None, namespace: str = None,
+                name: str = None, limit: int = 100) -> dict:
+        """Returns the changes in a time window, newest first, with counts per kind and event."""
+        conditions, params = ["ts >= ?", "ts <= ?"], [since, until or time.time()]
+        for column, value in (("kind", kind), ("namespace", namespace), ("name", name)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        where = " AND ".join(conditions)
+        with closing(self._reader()) as db:
+            counts = db.execute(f"SELECT kind, event, COUNT(*) FROM changes WHERE {where} GROUP BY kind, event",
+                                params).fetchall()
+            rows = db.execute(f"SELECT ts, kind, namespace, name, event, diff FROM changes WHERE {where} "
+                              "ORDER BY ts DESC LIMIT ?", params + [limit]).fetchall()
+        summary = {}
+        for row_kind, event, count in counts:
+            summary.setdefault(row_kind, {})[event] = count
+        return {
+            "summary": summary,
+            "total": sum(count for _, _, count in counts),
+            "changes": [
+                {"time": _iso(ts), "kind": row_kind, "namespace": row_namespace or None, "name": row_name,
+                 "event": event, "fields": k8s_json.loads(diff)}
+                for ts, row_kind, row_namespace, row_name, event, diff in rows
+            ],
+        }
+
+    def trends(self, kind: str, since: float, until: float = None, namespace: str = None,
+               name: str = None, sort_by: str = "memory", top: int = 10) -> list:
+        """
+        Summarizes usage per object over a time window.
+
+        Returns the ``top`` objects with the largest growth (last minus first
+        sample) of ``sort_by`` ("cpu" or "memory"), with min, average and max.
+        """
+        conditions, params = ["kind = ?", "ts >= ?", "ts <= ?"], [kind, since, until or time.time()]
+        for column, value in (("namespace", namespace), ("name", name)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        where = " AND ".join(conditions)
+        query = f"""
+            WITH span AS (SELECT * FROM samples WHERE {where}),
+            totals AS (
+                SELECT namespace, name, COUNT(*) AS samples, MIN(ts) AS first_ts, MAX(ts) AS last_ts,
+                       MIN(cpu) AS min_cpu, AVG(cpu) AS avg_cpu, MAX(cpu) AS max_cpu,
+                       MIN(memory) AS min_memory, AVG(memory) AS avg_memory, MAX(memory) AS max_memory
+                FROM span GROUP BY namespace, name
+            )
+            SELECT totals.*, first.cpu, first.memory, last.cpu, last.memory FROM totals
+            JOIN span AS first ON first.namespace = totals.namespace AND first.name = totals.name
+                AND first.ts = totals.first_ts
+            JOIN span AS last ON last.namespace = totals.namespace AND last.name = totals.name
+                AND last.ts = totals.last_ts
+            GROUP BY totals.namespace, totals.name
+        """
+        with closing(self._reader()) as db:
+            rows = db.execute(query, params).fetchall()
+
+        results = []
+        for (row_namespace, row_name, samples, first_ts, last_ts, min_cpu, avg_cpu, max_cpu,
+             min_memory, avg_memory, max_memory, first_cpu, first_memory, last_cpu, last_memory) in rows:
+            results.append({
+                "namespace": row_namespace or None,
+                "name": row_name,
+                "samples": samples,
+                "from": _iso(first_ts),
+                "to": _iso(last_ts),
+                "cpu_m": {"first": _millicores(first_cpu), "last": _millicores(last_cpu), "min": _millicores(min_cpu),
+                          "avg": _millicores(avg_cpu), "max": _millicores(max_cpu)},
+                "memory_mi": {"first": _mebibytes(first_memory), "last": _mebibytes(last_memory),
+                              "min": _mebibytes(min_memory), "avg": _mebibytes(avg_memory),
+                              "max": _mebibytes(max_memory)},
+            })
+        field = "memory_mi" if sort_by == "memory" else "cpu_m"
+        results.sort(key=lambda r: (r[field]["last"] or 0) - (r[field]["first"] or 0), reverse=True)
+        return results[:max(0, top)]
+
+
+def _millicores(cores):
+    return round(cores * 1000) if cores is not None else None
+
+
+def _mebibytes(size):
+    return round(size / 2 ** 20, 1) if size is not None else None
+
+
+class HistoryRecorder:
+    """Feeds a history store from informers and periodic metrics samples."""
+
+    def __init__(self, store: HistoryStore, api_client, sample_interval: float = None):
+        self.store = store
+        self.api_client = api_client
+        self.sample_interval = sample_interval or float(os.getenv("KUBESAGE_HISTORY_SAMPLE_SECONDS", "60"))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "HistoryRecorder":
+        sources = {kind: (path, transform) for kind, (path, transform) in SOURCES.items()}
+        sources["Node"] = ("/api/v1/nodes", slim_node)
+        for kind, (path, transform) in sources.items():
+            listener = lambda event_type, old, new, kind=kind: self.store.record_change(kind, event_type, old, new)
+            get_informer(path, transform, self.api_client).add_listener(listener)
+        self._thread = threading.Thread(target=self._run, name="kubesage-history", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def sample(self) -> None:
+        """Records the current node and pod usage reported by metrics-server."""
+        nodes = list_items("/apis/metrics.k8s.io/v1beta1/nodes", self.api_client)
+        self.store.record_samples("Node", [
+            (None, n["metadata"]["name"], _usage(n.get("usage"), "cpu"), _usage(n.get("usage"), "memory"))
+            for n in nodes
+        ])
+        pods = list_items("/apis/metrics.k8s.io/v1beta1/pods", self.api_client)
+        self.store.record_samples("Pod", [
+            (p["metadata"].get("namespace"), p["metadata"]["name"],
+             sum(_usage(c.get("usage"), "cpu") or 0.0 for c in p.get("containers") or []),
+             sum(_usage(c.get("usage"), "memory") or 0.0 for c in p.get("containers") or []))
+            for p in pods
+        ])
+
+    def _run(self) -> None:
+        next_sample = next_maintenance = 0.0
+        while not self._stop.wait(1.0):
+            now = time.time()
+            if now >= next_sample:
+                next_sample = now + self.sample_interval
+                try:
+                    self.sample()
+                except Exception as e:
+                    print(f"⚠️ Could not sample resource usage: {e}")
+            try:
+                self.store.flush()
+                if now >= next_maintenance:
+                    next_maintenance = now + 3600
+                    self.store.maintain(now)
+            except Exception as e:
+                print(f"⚠️ Could not write cluster history: {e}")
+
+
+def _usage(usage, resource: str):
+    value = (usage or {}).get(resource)
+    return parse_quantity(value) if value is not None else None
+
+
+def _default_history_path(host: str) -> str:
+    directory = os.getenv("KUBESAGE_HISTORY_DIR", os.path.expanduser("~/.kube/cache/kubesage"))
+    digest = hashlib.sha256(host.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(directory, f"history-{digest}.db")
+
+
+_stores = {}
+_recorders = {}
+_stores_lock = threading.Lock()
+
+
+def get_history_store(api_client) -> HistoryStore:
+    """Returns the history store of the cluster behind ``api_client``."""
+    host = api_client.configuration.host
+    with _stores_lock:
+        if host not in _stores:
+            _stores[host] = HistoryStore(_default_history_path(host))
+        return _stores[host]
+
+
+def is_recording(api_client) -> bool:
+    """Whether this process, or the snapshot collector of its workers, records the cluster's history."""
+    host = api_client.configuration.host
+    with _stores_lock:
+        if host in _recorders:
+            return True
+    status = collector_status()
+    return bool(status and status["host"] == host and status["history"])
+
+
+def history_enabled() -> bool:
+    """Whether ``KUBESAGE_HISTORY_ENABLED`` turns history recording on."""
+    return os.getenv("KUBESAGE_HISTORY_ENABLED", "false").lower() in ("true", "1", "yes")
+
+
+def history_available() -> bool:
+    """Whether history is recorded, or set to be recorded, by this process or the snapshot collector."""
+    if history_enabled():
+        return True
+    with _stores_lock:
+        if _recorders:
+            return True
+    status = collector_status()
+    return bool(status and status["history"])
+
+
+def start_history_recording():
+    """
+    Starts recording the current cluster's history if ``KUBESAGE_HISTORY_ENABLED`` is true.
+
+    Recording is off by default: it watches every pod, workload and node and
+    writes their changes to disk. Returns the recorder, or None when recording
+    is disabled.
+    """
+    if not history_enabled():
+        return None
+    load_kube_config()
+    api_client = client.ApiClient()
+    store = get_history_store(api_client)
+    with _stores_lock:
+        host = api_client.configuration.host
+        if host not in _recorders:
+            _recorders[host] = HistoryRecorder(store, api_client).start()
+        return _recorders[host]
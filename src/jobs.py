@@ -0,0 +1,205 @@
+"""
+Background jobs for long-running investigations.
+
+A job is submitted, runs on a bounded pool of worker threads
+(``KUBESAGE_JOB_WORKERS``) and keeps its result in memory for
+``KUBESAGE_JOB_TTL_SECONDS`` after it finishes. At most
+``KUBESAGE_JOB_MAX_PENDING`` jobs may wait or run at once; further submissions
+are refused. Every job records a list of progress events (state changes, LLM
+calls, tool calls) that clients can follow as Server-Sent Events.
+
+Jobs are for long investigations, so their default budget is larger than an
+interactive query's: ``KUBESAGE_JOB_TIMEOUT_SECONDS`` (1800) and
+``KUBESAGE_JOB_MAX_ITERATIONS`` (50).
+"""
+import asyncio
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+FINISHED = (SUCCEEDED, FAILED)
+
+
+def job_timeout() -> float:
+    """Default time budget of a job in seconds (``KUBESAGE_JOB_TIMEOUT_SECONDS``)."""
+    return float(os.getenv("KUBESAGE_JOB_TIMEOUT_SECONDS", "1800"))
+
+
+def job_max_iterations() -> int:
+    """Default number of agent iterations of a job (``KUBESAGE_JOB_MAX_ITERATIONS``)."""
+    return int(os.getenv("KUBESAGE_JOB_MAX_ITERATIONS", "50"))
+
+
+class JobQueueFull(Exception):
+    """Raised when no more jobs can be accepted."""
+
+
+class Job:
+    """State, result and progress events of one background job."""
+
+    def __init__(self, description: str = ""):
+        self.id = uuid.uuid4().hex
+        self.description = description
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.events = []
+        self._changed = threading.Condition()
+        self._waiters = []
+
+    def add_event(self, event_type: str, **data) -> None:
+        with self._changed:
+            self.events.append({"type": event_type, "time": time.time(), **data})
+            self._changed.notify_all()
+            for loop, arrived in self._waiters:
+                try:
+                    loop.call_soon_threadsafe(arrived.set)
+                except RuntimeError:
+                    pass  # the waiter's event loop has closed
+
+    def wait_for_events(self, cursor: int, timeout: float) -> list:
+        """Returns the events after ``cursor``, waiting up to ``timeout`` seconds for new ones."""
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.events) > cursor, timeout)
+            return self.events[cursor:]
+
+    async def next_events(self, cursor: int, timeout: float) -> list:
+        """Like ``wait_for_events``, but waits on the event loop instead of holding a thread."""
+        arrived = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), arrived)
+        with self._changed:
+            if len(self.events) > cursor:
+                return self.events[cursor:]
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(arrived.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._changed:
+                self._waiters.remove(waiter)
+        with self._changed:
+            return self.events[cursor:]
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "description": self.description,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "events": len(self.events),
+            "error": self.error,
+        }
+
+
+class JobProgressHandler(BaseCallbackHandler):
+    """Records the LLM and tool calls of an agent run as job progress events."""
+
+    run_inline = True
+
+    def __init__(self, job: Job):
+        self.job = job
+        self._tools = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.job.add_event("llm_start")
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.job.add_event("llm_start")
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = (serialized or {}).get("name") or kwargs.get("name", "tool")
+        self._tools[run_id] = name
+        self.job.add_event("tool_start", tool=name)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self.job.add_event("tool_end", tool=self._tools.pop(run_id, "tool"))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self.job.add_event("tool_error", tool=self._tools.pop(run_id, "tool"), error=str(error))
+
+
+class JobManager:
+    """Runs jobs on a bounded worker pool and keeps finished jobs until their TTL expires."""
+
+    def __init__(self, workers: int = None, max_pending: int = None, ttl: float = None):
+        self.workers = workers or int(os.getenv("KUBESAGE_JOB_WORKERS", "2"))
+        self.max_pending = max_pending or int(os.getenv("KUBESAGE_JOB_MAX_PENDING", "20"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("KUBESAGE_JOB_TTL_SECONDS", "3600"))
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="kubesage-job")
+
+    def submit(self, func, description: str = "") -> Job:
+        """
+        Queues ``func(job)``; its return value becomes the job result.
+
+        Raises:
+            JobQueueFull: If ``max_pending`` jobs are already queued or running.
+        """
+        job = Job(description)
+        with self._lock:
+            self._evict_expired()
+            pending = sum(1 for j in self._jobs.values() if j.status not in FINISHED)
+            if pending >= self.max_pending:
+                raise JobQueueFull(f"{pending} jobs are already queued or running")
+            self._jobs[job.id] = job
+        job.add_event(QUEUED)
+        self._pool.submit(self._run, job, func)
+        return job
+
+    def get(self, job_id: str):
+        """Returns the job, or None if it is unknown or has expired."""
+        with self._lock:
+            self._evict_expired()
+            return self._jobs.get(job_id)
+
+    def _run(self, job: Job, func) -> None:
+        job.started_at = time.time()
+        job.status = RUNNING
+        job.add_event(RUNNING)
+        try:
+            job.result = func(job)
+            job.status = SUCCEEDED
+        except Exception as e:
+            job.error = str(e)
+            job.status = FAILED
+        job.finished_at = time.time()
+        if job.error:
+            job.add_event(job.status, error=job.error)
+        else:
+            job.add_event(job.status)
+
+    def _evict_expired(self) -> None:
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> JobManager:
+    """Returns the process-wide job manager, created on first use."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager()
+        return _manager
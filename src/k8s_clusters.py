@@ -0,0 +1,121 @@
+"""
+Multi-cluster access across kubeconfig contexts.
+
+``KUBESAGE_CLUSTERS`` names the kubeconfig contexts KubeSage may query, as a
+comma-separated list, or ``all`` for every context in the kubeconfig. When it is
+not set, only the current context is used. Each context gets its own API client
+(and, through ``k8s_discovery``, its own discovery cache), created on first use
+and reused afterwards.
+
+``fan_out`` runs one function against several clusters at once, so the total
+latency is that of the slowest cluster rather than the sum of all of them.
+"""
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from kubernetes import client, config
+
+from src.cancellation import time_left
+
+IN_CLUSTER = "in-cluster"
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def configured_clusters() -> list:
+    """Returns the names of the clusters KubeSage is configured to query."""
+    if "KUBERNETES_SERVICE_HOST" in os.environ and not os.getenv("KUBESAGE_CLUSTERS"):
+        return [IN_CLUSTER]
+    try:
+        contexts, current = config.list_kube_config_contexts()
+    except Exception:
+        return []
+
+    names = [context["name"] for context in contexts]
+    selection = os.getenv("KUBESAGE_CLUSTERS", "").strip()
+    if not selection:
+        return [current["name"]] if current else []
+    if selection.lower() == "all":
+        return names
+    return [name.strip() for name in selection.split(",") if name.strip()]
+
+
+def resolve_clusters(selection) -> list:
+    """
+    Turns a cluster selection into a list of configured cluster names.
+
+    Args:
+        selection: "all", a comma-separated string or a list of names
+
+    Raises:
+        ValueError: If a selected cluster is not configured.
+    """
+    available = configured_clusters()
+    if isinstance(selection, str):
+        if selection.strip().lower() == "all":
+            return available
+        selection = selection.split(",")
+    names = [name.strip() for name in selection if name.strip()]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown cluster(s): {', '.join(unknown)}. Available: {', '.join(available) or 'none'}")
+    return names
+
+
+def get_api_client(cluster: str) -> client.ApiClient:
+    """Returns the cached API client for a kubeconfig context."""
+    with _clients_lock:
+        if cluster not in _clients:
+            if cluster == IN_CLUSTER:
+                configuration = client.Configuration()
+                config.load_incluster_config(client_configuration=configuration)
+                _clients[cluster] = client.ApiClient(configuration)
+            else:
+                _clients[cluster] = config.new_client_from_config(context=cluster)
+        return _clients[cluster]
+
+
+def fan_out(func, clusters: list, timeout: float = None):
+    """
+    Calls ``func(api_client)`` for every cluster concurrently.
+
+    Args:
+        func: Function receiving a cluster's ``ApiClient``
+        clusters: Names of the clusters to query
+        timeout: Seconds to wait for the slowest cluster
+            (default: ``KUBESAGE_CLUSTER_TIMEOUT_SECONDS``, 30), never past the run's deadline
+
+    Returns:
+        tuple: Results by cluster name, and error messages by cluster name
+    """
+    if timeout is None:
+        timeout = float(os.getenv("KUBESAGE_CLUSTER_TIMEOUT_SECONDS", "30"))
+    remaining = time_left()
+    if remaining is not None:
+        timeout = min(timeout, remaining)
+
+    def call(cluster):
+        return func(get_api_client(cluster))
+
+    results, errors = {}, {}
+    pool = ThreadPoolExecutor(max_workers=max(1, min(len(clusters), 32)), thread_name_prefix="kubesage-cluster")
+    try:
+        # Each call runs in a copy of the caller's context so its Kubernetes spans join the current trace
+        futures = {pool.submit(contextvars.copy_context().run, call, cluster): cluster for cluster in clusters}
+        done, not_done = wait(futures, timeout=timeout)
+        for future in done:
+            cluster = futures[future]
+            try:
+                results[cluster] = future.result()
+            except Exception as e:
+                errors[cluster] = str(e)
+        for future in not_done:
+            errors[futures[future]] = f"timed out after {timeout:g}s"
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    # Keep the order in which the clusters were requested
+    return {c: results[c] for c in clusters if c in results}, {c: errors[c] for c in clusters if c in errors}
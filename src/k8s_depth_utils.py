@@ -1,6 +1,24 @@
 import os
+import threading
+import time
+from collections import OrderedDict
+
+import yaml
 from kubernetes import client, config
 
+from src import k8s_json
+from src.cancellation import install_kubernetes_checks
+from src.k8s_discovery import get_discovery
+from src.history_store import get_history_store, history_enabled, is_recording
+from src.rbac_index import effective_subjects, get_rbac_index
+from src.resource_graph import get_resource_graph, normalize_kind
+
+# Requests made for an agent run are refused once it is cancelled and bounded by its deadline
+install_kubernetes_checks()
+
+# libyaml's C emitter is several times faster than the pure-Python one
+YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
 def load_kube_config():
     """Load Kubernetes configuration (In-Cluster or Local)."""
     if "KUBERNETES_SERVICE_HOST" in os.environ:
@@ -143,6 +161,157 @@ def get_rbac_events_and_role_bindings():
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+def _rbac_resource(api_client, resource: str):
+    """Resolves a resource name to its RBAC plural and API group; the group is None if unknown."""
+    base, _, subresource = resource.strip().lower().partition("/")
+    info = get_discovery(api_client).resolve(base) if base != "*" else None
+    if info is None:
+        return resource.strip().lower(), None
+    plural = f"{info.plural}/{subresource}" if subresource else info.plural
+    return plural, info.group
+
+
+def check_rbac_access(subject_kind: str, subject_name: str, verb: str, resource: str,
+                      namespace: str = None, subject_namespace: str = None):
+    """
+    Checks whether a user, group or service account may perform a verb on a resource.
+
+    Args:
+        subject_kind: User, Group or ServiceAccount
+        subject_name: Name of the subject
+        verb: API verb, e.g. get, list, create, delete
+        resource: Resource name, e.g. secrets, pods/log, deploy
+        namespace: Namespace of the request; None for cluster-scoped or all-namespace requests
+        subject_namespace: Namespace of a ServiceAccount subject (default: "default")
+    """
+    try:
+        load_kube_config()
+        api_client = client.ApiClient()
+        plural, api_group = _rbac_resource(api_client, resource)
+        subjects = effective_subjects(subject_kind, subject_name, subject_namespace)
+        grants = get_rbac_index(api_client).can(subjects, verb.lower(), plural, namespace, api_group)
+        unconditional = [grant for grant in grants if not grant.rule.get("resourceNames")]
+        return {
+            "status": "success",
+            "allowed": bool(unconditional),
+            # Grants limited to resourceNames only allow the request for those objects
+            "allowed_for_some_names": bool(grants) and not unconditional,
+            "request": {"verb": verb.lower(), "resource": plural, "api_group": api_group,
+                        "namespace": namespace or "cluster-wide"},
+            "grants": [grant.to_dict() for grant in grants],
+        }
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+def who_can_access(verb: str, resource: str, namespace: str = None):
+    """
+    Lists the subjects that may perform a verb on a resource.
+
+    Args:
+        verb: API verb, e.g. get, list, create, delete
+        resource: Resource name, e.g. secrets, pods/exec, deploy
+        namespace: Only include grants that apply in this namespace; None for all
+    """
+    try:
+        load_kube_config()
+        api_client = client.ApiClient()
+        plural, api_group = _rbac_resource(api_client, resource)
+        subjects = {}
+        for grant in get_rbac_index(api_client).who_can(verb.lower(), plural, namespace, api_group):
+            entry = grant.to_dict()
+            subjects.setdefault(entry.pop("subject"), []).append(entry)
+        return {
+            "status": "success",
+            "request": {"verb": verb.lower(), "resource": plural, "api_group": api_group,
+                        "namespace": namespace or "all namespaces"},
+            "subjects": [{"subject": subject, "grants": grants} for subject, grants in sorted(subjects.items())],
+        }
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+def get_resource_dependencies(kind: str, name: str, namespace: str = "default"):
+    """
+    Returns the dependency chain around a workload, pod, service or volume in one step.
+
+    Args:
+        kind: Service, Deployment, ReplicaSet, StatefulSet, DaemonSet, Job, CronJob, Pod,
+            PersistentVolumeClaim or PersistentVolume (short names such as svc or pvc work too)
+        name: Name of the object
+        namespace: Namespace of the object; ignored for PersistentVolumes
+    """
+    graph_kind = normalize_kind(kind)
+    if graph_kind is None:
+        return {"status": "error", "message": f"Unsupported kind: {kind}. Use a workload, pod, service, pvc or pv."}
+    try:
+        load_kube_config()
+        return {"status": "success", **get_resource_graph(client.ApiClient()).query(graph_kind, namespace, name)}
+    except KeyError as e:
+        return {"status": "error", "message": e.args[0]}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+def _history_kind(kind: str):
+    if kind is None:
+        return None
+    return "Node" if kind.strip().lower() in ("node", "nodes", "no") else normalize_kind(kind)
+
+HISTORY_DISABLED = ("Cluster history is not recorded, so past changes and usage are unknown "
+                    "(set KUBESAGE_HISTORY_ENABLED=true to record it).")
+
+def get_recent_changes(minutes: int = 60, kind: str = None, namespace: str = None, name: str = None,
+                       ending_minutes_ago: int = 0, limit: int = 100):
+    """
+    Lists the recorded changes to cluster objects in a time window, newest first.
+
+    Args:
+        minutes: Length of the window
+        kind: Only changes to this kind (pod, deployment, service, node, ...)
+        namespace: Only changes in this namespace
+        name: Only changes to objects with this name
+        ending_minutes_ago: End the window this many minutes before now, e.g. at the start of an outage
+        limit: Maximum number of changes to return; the summary always counts all of them
+    """
+    try:
+        graph_kind = _history_kind(kind)
+        if kind is not None and graph_kind is None:
+            return {"status": "error", "message": f"No history is recorded for kind: {kind}"}
+        load_kube_config()
+        api_client = client.ApiClient()
+        if not (history_enabled() or is_recording(api_client)):
+            return {"status": "error", "message": HISTORY_DISABLED}
+        until = time.time() - 60 * ending_minutes_ago
+        history = get_history_store(api_client).changes(until - 60 * minutes, until, graph_kind, namespace, name, limit)
+        return {"status": "success", "recording": is_recording(api_client), **history}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+def get_usage_trends(kind: str = "pod", minutes: int = 60, namespace: str = None, name: str = None,
+                     sort_by: str = "memory", top: int = 10):
+    """
+    Summarizes recorded CPU and memory usage of pods or nodes over a time window.
+
+    Args:
+        kind: pod or node
+        minutes: Length of the window, ending now
+        namespace: Only pods in this namespace
+        name: Only the pod or node with this name
+        sort_by: "memory" or "cpu": objects whose usage grew most come first
+        top: Number of objects to return
+    """
+    try:
+        graph_kind = _history_kind(kind)
+        if graph_kind not in ("Pod", "Node"):
+            return {"status": "error", "message": "Usage trends are recorded for pods and nodes only."}
+        load_kube_config()
+        api_client = client.ApiClient()
+        if not (history_enabled() or is_recording(api_client)):
+            return {"status": "error", "message": HISTORY_DISABLED}
+        trends = get_history_store(api_client).trends(graph_kind, time.time() - 60 * minutes, None,
+                                                      namespace, name, sort_by, top)
+        return {"status": "success", "recording": is_recording(api_client), "objects": trends}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
 def get_persistent_volumes_and_claims():
     """Fetches all Persistent Volumes (PVs) and Persistent Volume Claims (PVCs)."""
     try:
@@ -279,14 +448,70 @@ def check_pod_affinity(namespace: str, pod_name: str):
         return {"status": "error", "message": str(e)}
 
 
-def get_kubernetes_object_yaml(resource_type: str, name: str, namespace: str = "default") -> dict:
+# Fields that are rarely useful for troubleshooting but can dominate an object's size
+NOISE_ANNOTATIONS = ("kubectl.kubernetes.io/last-applied-configuration",)
+
+_object_cache = OrderedDict()
+_object_cache_lock = threading.Lock()
+OBJECT_CACHE_SIZE = int(os.getenv("KUBESAGE_OBJECT_CACHE_SIZE", "256"))
+
+
+def strip_noise_fields(obj: dict) -> dict:
+    """Removes managedFields and last-applied-configuration annotations in place."""
+    metadata = obj.get("metadata") or {}
+    metadata.pop("managedFields", None)
+    annotations = metadata.get("annotations")
+    if annotations:
+        for key in NOISE_ANNOTATIONS:
+            annotations.pop(key, None)
+        if not annotations:
+            metadata.pop("annotations")
+    return obj
+
+
+def serialize_object(obj: dict, output_format: str = "yaml") -> str:
+    """Serializes an object as YAML (using the C emitter when available) or compact JSON."""
+    if output_format == "json":
+        return k8s_json.dumps(obj)
+    return yaml.dump(obj, Dumper=YamlDumper, default_flow_style=False, allow_unicode=True, sort_keys=False)
+
+
+def _cached_serialization(key: tuple, obj: dict, output_format: str, strip_noise: bool) -> str:
+    """Returns the serialized object, reusing earlier output for the same resourceVersion."""
+    if key is None:
+        if strip_noise:
+            strip_noise_fields(obj)
+        return serialize_object(obj, output_format)
+
+    with _object_cache_lock:
+        content = _object_cache.get(key)
+        if content is not None:
+            _object_cache.move_to_end(key)
+            return content
+
+    if strip_noise:
+        strip_noise_fields(obj)
+    content = serialize_object(obj, output_format)
+
+    with _object_cache_lock:
+        _object_cache[key] = content
+        while len(_object_cache) > OBJECT_CACHE_SIZE:
+            _object_cache.popitem(last=False)
+    return content
+
+
+def get_kubernetes_object_yaml(resource_type: str, name: str, namespace: str = "default",
+                               output_format: str = "yaml", strip_noise: bool = True) -> dict:
     """
-    Fetches the YAML representation of any Kubernetes object.
+    Fetches the YAML representation of any Kubernetes object, including custom resources.
     
     Args:
-        resource_type: Type of resource (pod, deployment, service, configmap, etc.)
+        resource_type: Kind, plural or short name of the resource (pod, deploy, svc,
+            rollouts.argoproj.io, etc.)
         name: Name of the resource
         namespace: Namespace of the resource (default: "default")
+        output_format: "yaml" (default) or "json" for compact JSON
+        strip_noise: Remove managedFields and last-applied-configuration (default: True)
     
     Returns:
         dict: Status and YAML content of the Kubernetes object
@@ -294,63 +519,37 @@ def get_kubernetes_object_yaml(resource_type: str, name: str, namespace: str = "
     try:
         load_kube_config()
         
-        # Map resource types to their API clients and methods
-        resource_map = {
-            'pod': {'client': client.CoreV1Api(), 'method': 'read_namespaced_pod'},
-            'service': {'client': client.CoreV1Api(), 'method': 'read_namespaced_service'},
-            'configmap': {'client': client.CoreV1Api(), 'method': 'read_namespaced_config_map'},
-            'secret': {'client': client.CoreV1Api(), 'method': 'read_namespaced_secret'},
-            'persistentvolume': {'client': client.CoreV1Api(), 'method': 'read_persistent_volume'},
-            'persistentvolumeclaim': {'client': client.CoreV1Api(), 'method': 'read_namespaced_persistent_volume_claim'},
-            'deployment': {'client': client.AppsV1Api(), 'method': 'read_namespaced_deployment'},
-            'replicaset': {'client': client.AppsV1Api(), 'method': 'read_namespaced_replica_set'},
-            'daemonset': {'client': client.AppsV1Api(), 'method': 'read_namespaced_daemon_set'},
-            'statefulset': {'client': client.AppsV1Api(), 'method': 'read_namespaced_stateful_set'},
-            'job': {'client': client.BatchV1Api(), 'method': 'read_namespaced_job'},
-            'cronjob': {'client': client.BatchV1Api(), 'method': 'read_namespaced_cron_job'},
-            'ingress': {'client': client.NetworkingV1Api(), 'method': 'read_namespaced_ingress'},
-            'networkpolicy': {'client': client.NetworkingV1Api(), 'method': 'read_namespaced_network_policy'},
-            'role': {'client': client.RbacAuthorizationV1Api(), 'method': 'read_namespaced_role'},
-            'rolebinding': {'client': client.RbacAuthorizationV1Api(), 'method': 'read_namespaced_role_binding'},
-            'clusterrole': {'client': client.RbacAuthorizationV1Api(), 'method': 'read_cluster_role'},
-            'clusterrolebinding': {'client': client.RbacAuthorizationV1Api(), 'method': 'read_cluster_role_binding'},
-            'serviceaccount': {'client': client.CoreV1Api(), 'method': 'read_namespaced_service_account'},
-            'node': {'client': client.CoreV1Api(), 'method': 'read_node'},
-        }
+        api_client = client.ApiClient()
+        output_format = output_format.lower()
         
-        resource_type_lower = resource_type.lower()
-        
-        if resource_type_lower not in resource_map:
+        if output_format not in ("yaml", "json"):
+            return {"status": "error", "message": f"Unsupported output format: {output_format}. Use yaml or json."}
+
+        # Resolve any kind, plural or short name (including CRDs) from cached discovery
+        info = get_discovery(api_client).resolve(resource_type)
+        if info is None:
             return {
                 "status": "error", 
-                "message": f"Unsupported resource type: {resource_type}. Supported types: {', '.join(resource_map.keys())}"
+                "message": f"Unsupported resource type: {resource_type}. The cluster serves no resource with that kind or name."
             }
         
-        api_client = resource_map[resource_type_lower]['client']
-        method_name = resource_map[resource_type_lower]['method']
-        method = getattr(api_client, method_name)
+        # Read the raw JSON body instead of building and re-serializing client model objects
+        cluster_scoped = not info.namespaced
+        obj = k8s_json.get_json(api_client, info.object_path(name, None if cluster_scoped else namespace))
         
-        # Call the appropriate method based on resource type
-        if resource_type_lower in ['persistentvolume', 'node', 'clusterrole', 'clusterrolebinding']:
-            # Cluster-scoped resources don't need namespace
-            obj = method(name)
-        else:
-            # Namespaced resources
-            obj = method(name, namespace)
+        resource_version = (obj.get("metadata") or {}).get("resourceVersion")
+        cache_key = (info.group, info.kind, None if cluster_scoped else namespace, name,
+                     resource_version, output_format, strip_noise) if resource_version else None
+        content = _cached_serialization(cache_key, obj, output_format, strip_noise)
         
-        # Convert to YAML
-        import yaml
-        yaml_content = yaml.dump(api_client.api_client.sanitize_for_serialization(obj), 
-                                default_flow_style=False, 
-                                allow_unicode=True)
-        
-        return {
+        result = {
             "status": "success",
             "resource_type": resource_type,
             "name": name,
-            "namespace": namespace if resource_type_lower not in ['persistentvolume', 'node', 'clusterrole', 'clusterrolebinding'] else "cluster-scoped",
-            "yaml_content": yaml_content
+            "namespace": namespace if not cluster_scoped else "cluster-scoped",
         }
+        result["json_content" if output_format == "json" else "yaml_content"] = content
+        return result
         
     except client.exceptions.ApiException as e:
         if e.status == 404:
@@ -0,0 +1,263 @@
+"""
+Cached API discovery for resolving any resource kind, including CRDs.
+
+The discovery document maps every kind, plural, singular and short name served
+by the cluster to its API path. It is kept in memory, persisted to disk so new
+processes start warm, and refreshed in the background every
+``KUBESAGE_DISCOVERY_REFRESH_SECONDS``. Lookups never go to the API server,
+except for a single rate-limited refresh when a name is not found (e.g. a CRD
+installed since the last refresh).
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src import k8s_json
+
+AGGREGATED_DISCOVERY = (
+    "application/json;g=apidiscovery.k8s.io;v=v2;as=APIGroupDiscoveryList,"
+    "application/json;g=apidiscovery.k8s.io;v=v2beta1;as=APIGroupDiscoveryList,"
+    "application/json"
+)
+
+# Minimum time between refreshes triggered by unknown names
+MISS_REFRESH_INTERVAL = 30
+
+
+class ResourceInfo:
+    """How to reach one resource type of the API."""
+
+    __slots__ = ("group", "version", "kind", "plural", "singular", "short_names", "namespaced")
+
+    def __init__(self, group: str, version: str, kind: str, plural: str, singular: str = "",
+                 short_names: list = None, namespaced: bool = True):
+        self.group = group
+        self.version = version
+        self.kind = kind
+        self.plural = plural
+        self.singular = singular or kind.lower()
+        self.short_names = list(short_names or [])
+        self.namespaced = namespaced
+
+    @property
+    def group_version(self) -> str:
+        return f"{self.group}/{self.version}" if self.group else self.version
+
+    def collection_path(self, namespace: str = None) -> str:
+        """Returns the list path, across all namespaces when ``namespace`` is None."""
+        prefix = f"/apis/{self.group_version}" if self.group else f"/api/{self.version}"
+        if self.namespaced and namespace:
+            return f"{prefix}/namespaces/{namespace}/{self.plural}"
+        return f"{prefix}/{self.plural}"
+
+    def object_path(self, name: str, namespace: str = None) -> str:
+        return f"{self.collection_path(namespace)}/{name}"
+
+    def names(self) -> list:
+        names = [self.kind.lower(), self.plural, self.singular, *self.short_names]
+        qualified = [f"{n}.{self.group}" for n in (self.plural, self.singular, self.kind.lower())] if self.group else []
+        return names + qualified
+
+    def to_dict(self) -> dict:
+        return {s: getattr(self, s) for s in self.__slots__}
+
+
+class DiscoveryCache:
+    """Resolves resource names to API paths from a cached discovery document."""
+
+    def __init__(self, api_client, cache_path: str = None, refresh_interval: float = None):
+        self.api_client = api_client
+        self.cache_path = cache_path or _default_cache_path(api_client.configuration.host)
+        self.refresh_interval = refresh_interval if refresh_interval is not None else float(
+            os.getenv("KUBESAGE_DISCOVERY_REFRESH_SECONDS", "600"))
+        self._index = {}
+        self._resources = []
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    # ------------------------------
+    # Lookups
+    # ------------------------------
+
+    def resolve(self, resource_type: str):
+        """
+        Returns the ResourceInfo for a kind, plural, singular or short name.
+
+        Names may be qualified with the API group ("rollouts.argoproj.io").
+        Returns None when the cluster does not serve such a resource.
+        """
+        self._ensure_loaded()
+        key = resource_type.strip().lower()
+        info = self._index.get(key)
+        if info is None and time.time() - self._refreshed_at > MISS_REFRESH_INTERVAL:
+            self.refresh()
+            info = self._index.get(key)
+        return info
+
+    def resources(self) -> list:
+        self._ensure_loaded()
+        return list(self._resources)
+
+    # ------------------------------
+    # Loading and refreshing
+    # ------------------------------
+
+    def _ensure_loaded(self) -> None:
+        if self._refreshed_at:
+            return
+        with self._refresh_lock:
+            if self._refreshed_at:
+                return
+            if not self._load_from_disk():
+                self._refresh_locked()
+        self.start_background_refresh()
+
+    def _load_from_disk(self) -> bool:
+        """Loads the persisted document. Stale documents are used until the next refresh."""
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                document = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self._install([ResourceInfo(**r) for r in document.get("resources", [])], document.get("refreshed_at", 0.0))
+        if 0 < self.refresh_interval < time.time() - self._refreshed_at:
+            threading.Thread(target=self._refresh_quietly, name="kubesage-discovery-warmup", daemon=True).start()
+        return bool(self._resources)
+
+    def refresh(self) -> None:
+        """Fetches the discovery document from the API server."""
+        with self._refresh_lock:
+            self._refresh_locked()
+
+    def _refresh_locked(self) -> None:
+        resources = self._fetch_aggregated()
+        if resources is None:
+            resources = self._fetch_legacy()
+        self._install(resources, time.time())
+        self._save_to_disk()
+
+    def _install(self, resources: list, refreshed_at: float) -> None:
+        index = {}
+        # Earlier entries win: the core group first, then groups in server priority order
+        for info in resources:
+            for name in info.names():
+                index.setdefault(name.lower(), info)
+        with self._lock:
+            self._resources = resources
+            self._index = index
+            self._refreshed_at = refreshed_at or time.time()
+
+    def _save_to_disk(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"refreshed_at": self._refreshed_at, "resources": [r.to_dict() for r in self._resources]}, f)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            print(f"⚠️ Could not persist discovery cache to {self.cache_path}: {e}")
+
+    def start_background_refresh(self) -> None:
+        if self._thread is not None or self.refresh_interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._refresh_loop, name="kubesage-discovery", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _refresh_loop(self) -> None:
+        while not self._stop.wait(self.refresh_interval):
+            self._refresh_quietly()
+
+    def _refresh_quietly(self) -> None:
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"⚠️ Discovery refresh failed, keeping cached document: {e}")
+
+    # ------------------------------
+    # Discovery requests
+    # ------------------------------
+
+    def _fetch_aggregated(self):
+        """Fetches all groups in two requests using aggregated discovery (Kubernetes 1.26+)."""
+        try:
+            core = k8s_json.get_json(self.api_client, "/api", accept=AGGREGATED_DISCOVERY)
+            groups = k8s_json.get_json(self.api_client, "/apis", accept=AGGREGATED_DISCOVERY)
+        except Exception:
+            return None
+        if core.get("kind") != "APIGroupDiscoveryList" or groups.get("kind") != "APIGroupDiscoveryList":
+            return None
+
+        resources = []
+        for group in core.get("items", []) + groups.get("items", []):
+            versions = group.get("versions") or []
+            if not versions:
+                continue
+            # Versions are listed in preference order
+            preferred = versions[0]
+            group_name = (group.get("metadata") or {}).get("name", "")
+            for r in preferred.get("resources") or []:
+                if "get" not in (r.get("verbs") or []):
+                    continue
+                kind = (r.get("responseKind") or {}).get("kind", "")
+                resources.append(ResourceInfo(
+                    group_name, preferred["version"], kind, r["resource"], r.get("singularResource", ""),
+                    r.get("shortNames"), r.get("scope") == "Namespaced",
+                ))
+        return resources
+
+    def _fetch_legacy(self) -> list:
+        """Fetches the preferred version of every group, one request per group."""
+        group_versions = [("", v) for v in k8s_json.get_json(self.api_client, "/api").get("versions", [])[:1]]
+        for group in k8s_json.get_json(self.api_client, "/apis").get("groups", []):
+            preferred = group.get("preferredVersion") or (group.get("versions") or [{}])[0]
+            if preferred.get("version"):
+                group_versions.append((group["name"], preferred["version"]))
+
+        def fetch(group_version):
+            group, version = group_version
+            path = f"/apis/{group}/{version}" if group else f"/api/{version}"
+            try:
+                return group, version, k8s_json.get_json(self.api_client, path).get("resources", [])
+            except Exception as e:
+                print(f"⚠️ Discovery of {path} failed: {e}")
+                return group, version, []
+
+        resources = []
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            for group, version, items in pool.map(fetch, group_versions):
+                for r in items:
+                    if "/" in r["name"] or "get" not in (r.get("verbs") or []):
+                        continue
+                    resources.append(ResourceInfo(
+                        group, version, r["kind"], r["name"], r.get("singularName", ""),
+                        r.get("shortNames"), r.get("namespaced", True),
+                    ))
+        return resources
+
+
+def _default_cache_path(host: str) -> str:
+    directory = os.getenv("KUBESAGE_DISCOVERY_CACHE_DIR", os.path.expanduser("~/.kube/cache/kubesage"))
+    digest = hashlib.sha256(host.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(directory, f"discovery-{digest}.json")
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_discovery(api_client) -> DiscoveryCache:
+    """Returns the process-wide discovery cache for the cluster behind ``api_client``."""
+    host = api_client.configuration.host
+    with _caches_lock:
+        if host not in _caches:
+            _caches[host] = DiscoveryCache(api_client)
+        return _caches[host]
@@ -0,0 +1,219 @@
+"""
+List-and-watch caches of Kubernetes collections.
+
+An ``Informer`` lists a collection once, then follows a watch from the list's
+resourceVersion and applies every change to an in-memory store, so readers
+get current objects without calling the API server. Watches that expire are
+resumed from the last seen resourceVersion; when that version is too old
+(410 Gone) the collection is listed again.
+
+Bodies are read as raw JSON (see ``k8s_json``), and an optional ``transform``
+keeps only the fields the consumer needs, which bounds memory on large
+clusters. Listeners are told about every change to the transformed objects,
+including the differences found when a collection is listed again.
+"""
+import os
+import threading
+
+from kubernetes import client
+
+from src import k8s_json
+from src.k8s_utils import load_kube_config
+
+WATCH_TIMEOUT_SECONDS = 300
+
+
+class Informer:
+    """Keeps the objects of one collection current by list and watch."""
+
+    def __init__(self, api_client, path: str, transform=None, retry_interval: float = 5.0):
+        self.api_client = api_client
+        self.path = path
+        self.transform = transform
+        self.retry_interval = retry_interval
+        # Incremented on every change, so consumers can rebuild derived indexes lazily
+        self.version = 0
+        self._store = {}
+        self._resource_version = None
+        self._lock = threading.Lock()
+        self._synced = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners = []
+
+    # ------------------------------
+    # Reading
+    # ------------------------------
+
+    def items(self) -> list:
+        with self._lock:
+            return list(self._store.values())
+
+    def get(self, namespace: str, name: str):
+        with self._lock:
+            return self._store.get((namespace or "", name))
+
+    def snapshot(self) -> tuple:
+        """Returns the version and a copy of the store, keyed by (namespace, name)."""
+        with self._lock:
+            return self.version, dict(self._store)
+
+    def wait_synced(self, timeout: float = None) -> bool:
+        """Waits for the initial list; returns False if it did not complete in time."""
+        return self._synced.wait(timeout)
+
+    def add_listener(self, listener) -> None:
+        """
+        Calls ``listener(event_type, old, new)`` after every change.
+
+        ``event_type`` is ADDED, MODIFIED or DELETED; ``old`` is None for
+        additions and ``new`` is None for deletions. Listeners run on the watch
+        thread and must not block.
+        """
+        self._listeners.append(listener)
+
+    # ------------------------------
+    # Running
+    # ------------------------------
+
+    def start(self) -> "Informer":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"kubesage-informer{self.path}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self._resource_version is None:
+                    self._list()
+                self._watch()
+            except Exception as e:
+                print(f"⚠️ Watch of {self.path} failed, retrying in {self.retry_interval:g}s: {e}")
+                self._stop.wait(self.retry_interval)
+
+    def _list(self) -> None:
+        document = k8s_json.get_json(self.api_client, self.path)
+        store = {}
+        for obj in document.get("items") or []:
+            store[_key(obj)] = self._transform(obj)
+        with self._lock:
+            previous, self._store = self._store, store
+            self._resource_version = (document.get("metadata") or {}).get("resourceVersion")
+            self.version += 1
+        if self._synced.is_set():
+            # Changes missed while the watch was down
+            for key in previous.keys() - store.keys():
+                self._notify("DELETED", previous[key], None)
+            for key, obj in store.items():
+                if previous.get(key) != obj:
+                    self._notify("MODIFIED" if key in previous else "ADDED", previous.get(key), obj)
+        self._synced.set()
+
+    def _watch(self) -> None:
+        response = self.api_client.call_api(
+            self.path, "GET",
+            query_params=[
+                ("watch", "true"),
+                ("resourceVersion", self._resource_version),
+                ("allowWatchBookmarks", "true"),
+                ("timeoutSeconds", str(WATCH_TIMEOUT_SECONDS)),
+            ],
+            header_params={"Accept": "application/json"},
+            auth_settings=["BearerToken"],
+            _preload_content=False,
+            _return_http_data_only=True,
+            _request_timeout=(10, WATCH_TIMEOUT_SECONDS + 30),
+        )
+        try:
+            for line in _lines(response):
+                if self._stop.is_set():
+                    return
+                self._apply(k8s_json.loads(line))
+        finally:
+            response.release_conn()
+
+    def _apply(self, event: dict) -> None:
+        event_type = event.get("type")
+        obj = event.get("object") or {}
+        if event_type == "ERROR":
+            if obj.get("code") == 410:
+                # Our resourceVersion is too old to resume from: list again
+                self._resource_version = None
+                return
+            raise RuntimeError(obj.get("message", "watch error"))
+
+        resource_version = (obj.get("metadata") or {}).get("resourceVersion")
+        old = new = None
+        with self._lock:
+            if event_type in ("ADDED", "MODIFIED"):
+                new = self._transform(obj)
+                old = self._store.get(_key(obj))
+                self._store[_key(obj)] = new
+                self.version += 1
+            elif event_type == "DELETED":
+                old = self._store.pop(_key(obj), None)
+                self.version += 1
+            if resource_version:
+                self._resource_version = resource_version
+        if event_type in ("ADDED", "MODIFIED") and old != new:
+            self._notify("MODIFIED" if old is not None else "ADDED", old, new)
+        elif event_type == "DELETED" and old is not None:
+            self._notify("DELETED", old, None)
+
+    def _notify(self, event_type: str, old, new) -> None:
+        for listener in self._listeners:
+            try:
+                listener(event_type, old, new)
+            except Exception as e:
+                print(f"⚠️ Listener of {self.path} failed: {e}")
+
+    def _transform(self, obj: dict):
+        return self.transform(obj) if self.transform else obj
+
+
+def _key(obj: dict) -> tuple:
+    metadata = obj.get("metadata") or {}
+    return (metadata.get("namespace") or "", metadata.get("name"))
+
+
+def _lines(response):
+    """Splits a streamed watch response into JSON lines."""
+    buffer = b""
+    for chunk in response.stream(65536, decode_content=True):
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if buffer.strip():
+        yield buffer
+
+
+_informers = {}
+_informers_lock = threading.Lock()
+
+
+def get_informer(path: str, transform=None, api_client=None) -> Informer:
+    """
+    Returns the running informer for a collection path, starting it on first use.
+
+    Informers are shared per API server and path, so ``transform`` must be the
+    same for every caller of a path.
+    """
+    if api_client is None:
+        load_kube_config()
+        api_client = client.ApiClient()
+    key = (api_client.configuration.host, path)
+    with _informers_lock:
+        if key not in _informers:
+            _informers[key] = Informer(api_client, path, transform).start()
+        return _informers[key]
+
+
+def sync_timeout() -> float:
+    """Seconds a tool waits for an informer's initial list (``KUBESAGE_INFORMER_SYNC_SECONDS``)."""
+    return float(os.getenv("KUBESAGE_INFORMER_SYNC_SECONDS", "30"))
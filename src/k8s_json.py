@@ -0,0 +1,74 @@
+"""
+Raw JSON handling for Kubernetes API responses.
+
+Requesting responses with ``_preload_content=False`` skips the client's model
+construction; the body is parsed here with orjson when it is installed and the
+standard library otherwise.
+"""
+import json
+
+from src.cancellation import aborting
+from src.tracing import record_k8s_bytes
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """Parses JSON bytes or text."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> str:
+    """Serializes an object to compact JSON."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+def read_json(response):
+    """
+    Reads and parses the body of a response requested with ``_preload_content=False``.
+
+    Args:
+        response: The urllib3 response returned by the Kubernetes client
+
+    Returns:
+        The parsed JSON document
+    """
+    # A cancelled run closes the connection instead of reading a large list to the end
+    abort = getattr(response, "shutdown", None) or response.close
+    try:
+        with aborting(abort, "k8s_reads_aborted"):
+            data = response.data
+    finally:
+        response.release_conn()
+    if not response.getheader("Content-Length"):
+        # Chunked bodies are not accounted for by the REST client instrumentation
+        record_k8s_bytes(len(data))
+    return loads(data)
+
+
+def get_json(api_client, path: str, query_params: list = None, accept: str = "application/json"):
+    """
+    Issues a GET request for an arbitrary API path and returns the parsed body.
+
+    Args:
+        api_client: The ``kubernetes.client.ApiClient`` to use
+        path: The API path, e.g. "/apis/apps/v1/namespaces/default/deployments"
+        query_params: Optional list of (name, value) tuples
+        accept: Value of the Accept header
+    """
+    response = api_client.call_api(
+        path, "GET",
+        query_params=query_params or [],
+        header_params={"Accept": accept},
+        auth_settings=["BearerToken"],
+        _preload_content=False,
+        _return_http_data_only=True,
+    )
+    return read_json(response)
@@ -0,0 +1,137 @@
+"""
+Compact records for cluster objects kept in memory by informers.
+
+A pod parsed from JSON is a tree of dicts taking tens of kilobytes, and even a
+projection into small dicts costs over a kilobyte per pod. Records keep only the
+fields the tools read, in ``__slots__`` classes without a per-instance dict.
+Strings that repeat across objects (namespaces, node names, images, label keys
+and values) are interned, and identical tuples such as the label set or owner
+of every pod of a ReplicaSet are shared, so each pod mostly costs its own slots.
+
+Run ``python -m benchmarks.record_memory`` for the footprint per 10k pods.
+"""
+import sys
+
+# Bounds the table of shared tuples; clearing it only loses sharing, never data
+SHARED_TUPLES_LIMIT = 100_000
+
+_shared_tuples = {}
+
+
+def intern(value):
+    """Interns a string so equal values are stored once; other values are returned as they are."""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def shared(values: tuple) -> tuple:
+    """Returns a canonical instance of a (hashable) tuple, so equal tuples are stored once."""
+    if not values:
+        return ()
+    instance = _shared_tuples.get(values)
+    if instance is None:
+        if len(_shared_tuples) >= SHARED_TUPLES_LIMIT:
+            _shared_tuples.clear()
+        instance = _shared_tuples[values] = values
+    return instance
+
+
+def pairs(mapping) -> tuple:
+    """Converts a string mapping (labels, selectors) to a shared, sorted tuple of interned pairs."""
+    return shared(tuple(sorted((intern(k), intern(v)) for k, v in (mapping or {}).items())))
+
+
+class Record:
+    """
+    Base class of compact records.
+
+    Records compare and hash by value, and are not modified after creation.
+    Fields listed in ``_mappings`` hold tuples of pairs and are returned as
+    dicts by ``to_dict``.
+    """
+
+    __slots__ = ()
+    _mappings = ()
+
+    def __init__(self, *values):
+        for slot, value in zip(self.__slots__, values):
+            setattr(self, slot, value)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, s) == getattr(other, s) for s in self.__slots__)
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, s) for s in self.__slots__))
+
+    def __repr__(self):
+        fields = ", ".join(f"{s}={getattr(self, s)!r}" for s in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def to_dict(self) -> dict:
+        return {slot: dict(getattr(self, slot)) if slot in self._mappings else to_plain(getattr(self, slot))
+                for slot in self.__slots__}
+
+
+def to_plain(value):
+    """Converts records, and tuples of records, to dicts and lists."""
+    if isinstance(value, Record):
+        return value.to_dict()
+    if isinstance(value, tuple):
+        return [to_plain(item) for item in value]
+    return value
+
+
+class OwnerRef(Record):
+    __slots__ = ("kind", "name", "uid")
+
+
+class ObjectMeta(Record):
+    __slots__ = ("name", "namespace", "uid", "labels", "owners")
+    _mappings = ("labels",)
+
+    @classmethod
+    def from_json(cls, obj: dict) -> "ObjectMeta":
+        metadata = obj.get("metadata") or {}
+        owners = shared(tuple(
+            OwnerRef(intern(o.get("kind")), intern(o.get("name")), intern(o.get("uid")))
+            for o in metadata.get("ownerReferences") or []
+        )) if metadata.get("ownerReferences") else ()
+        return cls(metadata.get("name"), intern(metadata.get("namespace")), metadata.get("uid"),
+                   pairs(metadata.get("labels")), owners)
+
+
+class PodRecord(Record):
+    __slots__ = ("metadata", "node", "claims", "ports", "phase", "ready", "restarts", "reason")
+
+
+class ServicePort(Record):
+    __slots__ = ("name", "port", "target_port")
+
+
+class ServiceRecord(Record):
+    __slots__ = ("metadata", "type", "selector", "ports")
+    _mappings = ("selector",)
+
+
+class Address(Record):
+    __slots__ = ("ip", "pod")
+
+
+class EndpointsRecord(Record):
+    __slots__ = ("metadata", "ready", "not_ready")
+
+
+class WorkloadRecord(Record):
+    __slots__ = ("metadata", "desired", "ready", "available", "failed", "images")
+
+
+class ClaimRecord(Record):
+    __slots__ = ("metadata", "volume", "storage_class", "requested", "phase")
+
+
+class VolumeRecord(Record):
+    __slots__ = ("metadata", "claim", "storage_class", "capacity", "phase")
+
+
+class NodeRecord(Record):
+    __slots__ = ("metadata", "unschedulable", "taints", "conditions", "kubelet")
+    _mappings = ("conditions",)
@@ -1,6 +1,17 @@
+import contextvars
 import os
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 from kubernetes import client, config
 
+from src import k8s_json
+from src.cancellation import install_kubernetes_checks
+from src.k8s_clusters import fan_out, resolve_clusters
+
+# Requests made for an agent run are refused once it is cancelled and bounded by its deadline
+install_kubernetes_checks()
+
 def load_kube_config():
     """Load Kubernetes configuration (In-Cluster or Local)."""
     if "KUBERNETES_SERVICE_HOST" in os.environ:
@@ -8,162 +19,354 @@ def load_kube_config():
     else:
         config.load_kube_config()
 
-def get_all_pods_with_usage():
-    """Fetches pod details including status, node, CPU/memory usage."""
+_shared_lists = contextvars.ContextVar("kubesage_shared_lists", default=None)
+
+class ListCache:
+    """
+    List results shared by a group of queries, such as the queries of one batch.
+
+    Concurrent requests for the same list wait for the first one instead of
+    issuing their own call. Failed calls are not cached.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+
+    def get_or_fetch(self, key: tuple, fetch):
+        with self._lock:
+            entry = self._entries.setdefault(key, {"lock": threading.Lock(), "filled": False, "value": None})
+        with entry["lock"]:
+            if entry["filled"]:
+                with self._lock:
+                    self.hits += 1
+            else:
+                entry["value"] = fetch()
+                entry["filled"] = True
+            return entry["value"]
+
+@contextmanager
+def shared_lists(cache: ListCache):
+    """Serves the list calls made inside the block from ``cache``."""
+    token = _shared_lists.set(cache)
     try:
-        load_kube_config()
-        v1 = client.CoreV1Api()
-        custom_api = client.CustomObjectsApi()
-
-        pods = v1.list_pod_for_all_namespaces().items
-        metrics = custom_api.list_cluster_custom_object("metrics.k8s.io", "v1beta1", "pods")
-
-        pod_usage_map = {}
-        for pod in metrics.get("items", []):
-            pod_name = pod.get("metadata", {}).get("name")
-            if pod_name and "containers" in pod:
-                container = pod["containers"][0] if pod["containers"] else {}
-                pod_usage_map[pod_name] = {
-                    "cpu": container.get("usage", {}).get("cpu", "N/A"),
-                    "memory": container.get("usage", {}).get("memory", "N/A"),
-                }
-
-        return {
-            "status": "success",
-            "pods": [
-                {
-                    "name": pod.metadata.name,
-                    "namespace": pod.metadata.namespace,
-                    "status": pod.status.phase if pod.status else "Unknown",
-                    "node": pod.spec.node_name if pod.spec else "Unknown",
-                    "cpu": pod_usage_map.get(pod.metadata.name, {}).get("cpu", "N/A"),
-                    "memory": pod_usage_map.get(pod.metadata.name, {}).get("memory", "N/A"),
-                }
-                for pod in pods
-            ]
-        }
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+        yield cache
+    finally:
+        _shared_lists.reset(token)
 
-def get_all_services():
-    """Fetches all services with their types and ports."""
+def list_items(path: str, api_client=None) -> list:
+    """
+    Lists a collection as raw JSON dicts.
+
+    The typed client methods build a model object for every field of every item,
+    which dominates CPU time on large lists. Here the body is parsed directly and
+    callers project only the fields they need.
+
+    Args:
+        path: The collection path, e.g. "/api/v1/pods"
+        api_client: The cluster's API client (default: the current context)
+    """
+    api_client = api_client or client.ApiClient()
+    cache = _shared_lists.get()
+    if cache is None:
+        return k8s_json.get_json(api_client, path).get("items") or []
+    return cache.get_or_fetch(
+        (api_client.configuration.host, path),
+        lambda: k8s_json.get_json(api_client, path).get("items") or [],
+    )
+
+def _pod_summary(pod: dict, usage: dict) -> dict:
+    metadata = pod.get("metadata") or {}
+    pod_usage = usage.get(metadata.get("name"), {})
+    return {
+        "name": metadata.get("name"),
+        "namespace": metadata.get("namespace"),
+        "status": pod["status"].get("phase") if pod.get("status") is not None else "Unknown",
+        "node": pod["spec"].get("nodeName") if pod.get("spec") is not None else "Unknown",
+        "cpu": pod_usage.get("cpu", "N/A"),
+        "memory": pod_usage.get("memory", "N/A"),
+    }
+
+def _service_summary(svc: dict) -> dict:
+    spec = svc.get("spec")
+    return {
+        "name": svc["metadata"].get("name"),
+        "namespace": svc["metadata"].get("namespace"),
+        "type": spec.get("type") if spec is not None else "Unknown",
+        "ports": [{"port": p.get("port"), "protocol": p.get("protocol")} for p in ((spec or {}).get("ports") or [])]
+    }
+
+def _deployment_summary(dep: dict) -> dict:
+    status = dep.get("status")
+    return {
+        "name": dep["metadata"].get("name"),
+        "namespace": dep["metadata"].get("namespace"),
+        "replicas": status.get("replicas") if status is not None else 0,
+        "available_replicas": status.get("availableReplicas") if status is not None else 0
+    }
+
+def _node_summary(node: dict) -> dict:
+    status = node.get("status") or {}
+    conditions = status.get("conditions")
+    return {
+        "name": node["metadata"].get("name"),
+        "status": conditions[-1].get("type") if conditions else "Unknown",
+        "capacity": status.get("capacity") or {}
+    }
+
+def _event_summary(event: dict) -> dict:
+    involved_object = event.get("involvedObject")
+    return {"type": event.get("type"), "message": event.get("message"),
+            "involved_object": involved_object.get("kind") if involved_object is not None else "Unknown"}
+
+def collect(key: str, fetch, clusters=None) -> dict:
+    """
+    Runs a list function against one or several clusters.
+
+    Args:
+        key: Result key for the list of items, e.g. "pods"
+        fetch: Function returning the items of one cluster given its API client
+        clusters: None for the current context, otherwise "all" or a comma-separated
+            list of kubeconfig contexts. Items are then labelled with their cluster.
+    """
     try:
-        load_kube_config()
-        v1 = client.CoreV1Api()
-        services = v1.list_service_for_all_namespaces().items
-
-        return {
-            "status": "success",
-            "services": [
-                {
-                    "name": svc.metadata.name,
-                    "namespace": svc.metadata.namespace,
-                    "type": svc.spec.type if svc.spec else "Unknown",
-                    "ports": [{"port": p.port, "protocol": p.protocol} for p in (svc.spec.ports or [])]
-                }
-                for svc in services
-            ]
+        if not clusters:
+            load_kube_config()
+            return {"status": "success", key: fetch(None)}
+
+        results, errors = fan_out(fetch, resolve_clusters(clusters))
+        result = {
+            "status": "success" if results else "error",
+            key: [{"cluster": cluster, **item} for cluster, items in results.items() for item in items],
         }
+        if errors:
+            result["cluster_errors"] = errors
+            if not results:
+                result["message"] = "; ".join(f"{cluster}: {error}" for cluster, error in errors.items())
+        return result
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-def get_all_deployments():
-    """Fetches all deployments with their replica status."""
+def _fetch_pods(api_client) -> list:
+    pods = list_items("/api/v1/pods", api_client)
+    metrics = list_items("/apis/metrics.k8s.io/v1beta1/pods", api_client)
+
+    pod_usage_map = {}
+    for pod in metrics:
+        pod_name = pod.get("metadata", {}).get("name")
+        if pod_name and "containers" in pod:
+            container = pod["containers"][0] if pod["containers"] else {}
+            pod_usage_map[pod_name] = {
+                "cpu": container.get("usage", {}).get("cpu", "N/A"),
+                "memory": container.get("usage", {}).get("memory", "N/A"),
+            }
+
+    return [_pod_summary(pod, pod_usage_map) for pod in pods]
+
+def _fetch_endpoints(api_client) -> list:
+    endpoint_data = []
+    for ep in list_items("/api/v1/endpoints", api_client):
+        if not ep.get("subsets"):
+            continue
+        for subset in ep["subsets"]:
+            addresses = [addr.get("ip") for addr in subset["addresses"]] if subset.get("addresses") else []
+            ports = [p.get("port") for p in subset["ports"]] if subset.get("ports") else []
+            endpoint_data.append({
+                "name": ep["metadata"].get("name"),
+                "namespace": ep["metadata"].get("namespace"),
+                "addresses": addresses,
+                "ports": ports
+            })
+    return endpoint_data
+
+_QUANTITY_SUFFIXES = {
+    "n": 1e-9, "u": 1e-6, "m": 1e-3, "": 1.0, "k": 1e3, "M": 1e6, "G": 1e9, "T": 1e12, "P": 1e15, "E": 1e18,
+    "Ki": 2 ** 10, "Mi": 2 ** 20, "Gi": 2 ** 30, "Ti": 2 ** 40, "Pi": 2 ** 50, "Ei": 2 ** 60,
+}
+
+@lru_cache(maxsize=4096)
+def parse_quantity(quantity) -> float:
+    """
+    Parses a Kubernetes quantity ("250m", "1.5Gi", "2e3") into a float of base units.
+
+    Quantities repeat heavily across pods, so results are cached.
+    """
+    text = str(quantity).strip()
+    number = text.rstrip("nmuMkGTPEi")
+    suffix = text[len(number):]
+    if suffix not in _QUANTITY_SUFFIXES:
+        raise ValueError(f"Invalid quantity: {quantity}")
+    return float(number) * _QUANTITY_SUFFIXES[suffix]
+
+def _resource_totals(containers: list, field: str) -> dict:
+    totals = {}
+    for container in containers:
+        for resource, value in ((container.get("resources") or {}).get(field) or {}).items():
+            if resource in ("cpu", "memory"):
+                totals[resource] = totals.get(resource, 0.0) + parse_quantity(value)
+    return totals
+
+def _pod_resources(spec: dict, field: str) -> dict:
+    """
+    Returns a pod's effective CPU (cores) and memory (bytes) ``requests`` or ``limits``.
+
+    Like the scheduler, this is the larger of the sum over app containers and the
+    largest init container, plus the pod overhead. Containers without a value
+    do not contribute, as in ``kubectl describe node``.
+    """
+    totals = _resource_totals(spec.get("containers") or [], field)
+    for init in spec.get("initContainers") or []:
+        for resource, value in _resource_totals([init], field).items():
+            totals[resource] = max(totals.get(resource, 0.0), value)
+    for resource, value in (spec.get("overhead") or {}).items():
+        if resource in totals:
+            totals[resource] += parse_quantity(value)
+    return totals
+
+def _percent(part, whole):
+    return round(100 * part / whole, 1) if part is not None and whole else None
+
+def _fetch_node_usage(api_client) -> list:
+    """Joins allocatable capacity, pod requests and limits, and metrics usage per node in one pass over pods."""
+    nodes = list_items("/api/v1/nodes", api_client)
     try:
-        load_kube_config()
-        apps_v1 = client.AppsV1Api()
-        deployments = apps_v1.list_deployment_for_all_namespaces().items
-
-        return {
-            "status": "success",
-            "deployments": [
-                {
-                    "name": dep.metadata.name,
-                    "namespace": dep.metadata.namespace,
-                    "replicas": dep.status.replicas if dep.status else 0,
-                    "available_replicas": dep.status.available_replicas if dep.status else 0
-                }
-                for dep in deployments
-            ]
-        }
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+        metrics = {m["metadata"]["name"]: m.get("usage") or {}
+                   for m in list_items("/apis/metrics.k8s.io/v1beta1/nodes", api_client)}
+    except Exception:
+        metrics = None  # metrics-server is not installed
+
+    names = [node["metadata"]["name"] for node in nodes]
+    index = {name: i for i, name in enumerate(names)}
+    cpu_requests, memory_requests = [0.0] * len(names), [0.0] * len(names)
+    cpu_limits, memory_limits = [0.0] * len(names), [0.0] * len(names)
+    pod_counts = [0] * len(names)
+
+    for pod in list_items("/api/v1/pods", api_client):
+        spec = pod.get("spec") or {}
+        i = index.get(spec.get("nodeName"))
+        if i is None or (pod.get("status") or {}).get("phase") in ("Succeeded", "Failed"):
+            continue
+        requests, limits = _pod_resources(spec, "requests"), _pod_resources(spec, "limits")
+        cpu_requests[i] += requests.get("cpu", 0.0)
+        memory_requests[i] += requests.get("memory", 0.0)
+        cpu_limits[i] += limits.get("cpu", 0.0)
+        memory_limits[i] += limits.get("memory", 0.0)
+        pod_counts[i] += 1
+
+    rows = []
+    for i, node in enumerate(nodes):
+        status = node.get("status") or {}
+        allocatable = status.get("allocatable") or status.get("capacity") or {}
+        cpu = parse_quantity(allocatable.get("cpu", 0))
+        memory = parse_quantity(allocatable.get("memory", 0))
+        usage = metrics.get(names[i]) if metrics is not None else None
+        cpu_used = parse_quantity(usage["cpu"]) if usage and "cpu" in usage else None
+        memory_used = parse_quantity(usage["memory"]) if usage and "memory" in usage else None
+        conditions = status.get("conditions") or []
+        rows.append({
+            "name": names[i],
+            "ready": any(c.get("type") == "Ready" and c.get("status") == "True" for c in conditions),
+            "unschedulable": bool((node.get("spec") or {}).get("unschedulable")),
+            "problems": [
+                {"type": c.get("type"), "status": c.get("status"), "reason": c.get("reason"),
+                 "message": (c.get("message") or "")[:200]}
+                for c in conditions
+                if (c.get("type") == "Ready") != (c.get("status") == "True")
+            ],
+            "allocatable": {"cpu_m": round(cpu * 1000), "memory_mi": round(memory / 2 ** 20),
+                            "pods": int(parse_quantity(allocatable.get("pods", 0)))},
+            "pods": pod_counts[i],
+            "cpu_requests_pct": _percent(cpu_requests[i], cpu),
+            "memory_requests_pct": _percent(memory_requests[i], memory),
+            "cpu_limits_pct": _percent(cpu_limits[i], cpu),
+            "memory_limits_pct": _percent(memory_limits[i], memory),
+            "cpu_usage_pct": _percent(cpu_used, cpu),
+            "memory_usage_pct": _percent(memory_used, memory),
+        })
+    return rows
+
+def _hotness(row: dict) -> float:
+    """Live usage when metrics are available, otherwise requested share of allocatable."""
+    usage = [row["cpu_usage_pct"], row["memory_usage_pct"]]
+    if all(value is None for value in usage):
+        usage = [row["cpu_requests_pct"], row["memory_requests_pct"]]
+    return max(value or 0.0 for value in usage)
+
+def _overcommit(row: dict) -> float:
+    return max(row[key] or 0.0 for key in ("cpu_requests_pct", "memory_requests_pct",
+                                          "cpu_limits_pct", "memory_limits_pct"))
+
+def analyze_node_capacity(clusters: str = None, top: int = 10):
+    """
+    Analyzes every node at once: allocatable capacity, summed pod requests and limits, and live usage.
+
+    Args:
+        clusters: None for the current context, otherwise "all" or a comma-separated list of contexts
+        top: Number of hottest nodes to return
+
+    Returns:
+        dict: The hottest nodes, nodes whose requests or limits exceed allocatable
+        capacity, and nodes that are not Ready or report a pressure condition.
+        Percentages are of allocatable capacity; usage is None without metrics-server.
+    """
+    result = collect("nodes", _fetch_node_usage, clusters)
+    rows = result.pop("nodes", None)
+    if rows is None:
+        return result
+
+    hot = sorted(rows, key=_hotness, reverse=True)[:max(0, top)]
+    overcommitted = sorted((row for row in rows if _overcommit(row) > 100), key=_overcommit, reverse=True)
+    unhealthy = [row for row in rows if row["problems"] or not row["ready"]]
+    result.update({
+        "summary": {
+            "nodes": len(rows),
+            "ready": sum(1 for row in rows if row["ready"]),
+            "unschedulable": sum(1 for row in rows if row["unschedulable"]),
+            "overcommitted": len(overcommitted),
+            "metrics_available": any(row["cpu_usage_pct"] is not None for row in rows),
+        },
+        "hot_nodes": hot,
+        "overcommitted_nodes": overcommitted,
+        "node_problems": [
+            {key: row[key] for key in ("cluster", "name", "ready", "unschedulable", "problems") if key in row}
+            for row in unhealthy
+        ],
+    })
+    return result
+
+def get_all_pods_with_usage(clusters: str = None):
+    """Fetches pod details including status, node, CPU/memory usage."""
+    return collect("pods", _fetch_pods, clusters)
+
+def get_all_services(clusters: str = None):
+    """Fetches all services with their types and ports."""
+    return collect("services", lambda api: [_service_summary(svc) for svc in list_items("/api/v1/services", api)],
+                   clusters)
 
-def get_all_nodes():
+def get_all_deployments(clusters: str = None):
+    """Fetches all deployments with their replica status."""
+    return collect("deployments",
+                   lambda api: [_deployment_summary(dep) for dep in list_items("/apis/apps/v1/deployments", api)],
+                   clusters)
+
+def get_all_nodes(clusters: str = None):
     """Fetches all nodes with their health conditions and resource capacity."""
-    try:
-        load_kube_config()
-        v1 = client.CoreV1Api()
-        nodes = v1.list_node().items
-
-        return {
-            "status": "success",
-            "nodes": [
-                {
-                    "name": node.metadata.name,
-                    "status": node.status.conditions[-1].type if node.status.conditions else "Unknown",
-                    "capacity": node.status.capacity if node.status else {}
-                }
-                for node in nodes
-            ]
-        }
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+    return collect("nodes", lambda api: [_node_summary(node) for node in list_items("/api/v1/nodes", api)], clusters)
 
-def get_all_endpoints():
+def get_all_endpoints(clusters: str = None):
     """Fetches all endpoints and their associated services."""
-    try:
-        load_kube_config()
-        v1 = client.CoreV1Api()
-        endpoints = v1.list_endpoints_for_all_namespaces().items
-
-        endpoint_data = []
-        for ep in endpoints:
-            if not ep.subsets:
-                continue
-            for subset in ep.subsets:
-                addresses = [addr.ip for addr in subset.addresses] if subset.addresses else []
-                ports = [p.port for p in subset.ports] if subset.ports else []
-                endpoint_data.append({
-                    "name": ep.metadata.name,
-                    "namespace": ep.metadata.namespace,
-                    "addresses": addresses,
-                    "ports": ports
-                })
-
-        return {"status": "success", "endpoints": endpoint_data}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+    return collect("endpoints", _fetch_endpoints, clusters)
 
-def get_cluster_events():
+def get_cluster_events(clusters: str = None):
     """Fetches recent cluster-wide events."""
-    try:
-        load_kube_config()
-        v1 = client.CoreV1Api()
-        events = v1.list_event_for_all_namespaces().items
-
-        return {
-            "status": "success",
-            "events": [
-                {"type": event.type, "message": event.message, "involved_object": event.involved_object.kind if event.involved_object else "Unknown"}
-                for event in events[-10:]  # Last 10 events safely
-            ]
-        }
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+    # Last 10 events safely (per cluster)
+    return collect("events", lambda api: [_event_summary(e) for e in list_items("/api/v1/events", api)[-10:]],
+                   clusters)
 
-def get_all_namespaces():
+def get_all_namespaces(clusters: str = None):
     """Fetches all namespaces with their statuses."""
-    try:
-        load_kube_config()
-        v1 = client.CoreV1Api()
-        namespaces = v1.list_namespace().items
-
-        return {
-            "status": "success",
-            "namespaces": [
-                {"name": ns.metadata.name, "status": ns.status.phase if ns.status else "Unknown"} for ns in namespaces
-            ]
-        }
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+    return collect("namespaces", lambda api: [
+        {"name": ns["metadata"].get("name"), "status": ns["status"].get("phase") if ns.get("status") is not None else "Unknown"}
+        for ns in list_items("/api/v1/namespaces", api)
+    ], clusters)
@@ -1,16 +1,157 @@
 import os
-from langchain.agents import initialize_agent
-from langchain_openai import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import PromptTemplate
-from langchain.agents import AgentType
-from openai import NotFoundError
-from src.langchain_tools import broad_insights_tools, deep_dive_tools
+import threading
+from contextlib import nullcontext
+from langchain.agents import AgentExecutor, create_structured_chat_agent, create_tool_calling_agent
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from openai import APITimeoutError, NotFoundError
+from urllib3.exceptions import TimeoutError as HTTPTimeoutError
+from src.cancellation import (
+    CancellationHandler, DeadlineExceeded, RunCancelled, budget, count, iteration_budget, time_left
+)
+from src.conversation_memory import memory_state, restore_memory
+from src.k8s_clusters import configured_clusters
+from src.k8s_utils import shared_lists
+from src.llm_router import create_router
+from src.scheduled_llm import ScheduledChatOpenAI
+from src.langchain_tools import broad_insights_tools, offered_tools, select_tools
+from src.session_store import DEFAULT_SESSION, SessionListCache, load_state, save_state
+from src.tracing import get_callbacks
 
 llm = None
 agent_executor = None
 current_model = None
 
+# Agent executors keyed by the names of the tools they were built with
+_executors = {}
+_init_lock = threading.Lock()
+
+# Text-based (ReAct) tool use for models without native tool calling, as many models served by LM Studio
+REACT_FORMATTING_RULES = """
+
+You have access to the following tools:
+
+{tools}
+
+IMPORTANT FORMATTING RULES:
+- Always include "Thought:" before reasoning
+- Always include "Action:" before a JSON blob with "action" (one of: {tool_names}) and "action_input" (the tool arguments)
+- Provide only ONE action per blob, for example:
+Action:
+```
+{{"action": "get_pod_logs", "action_input": {{"namespace": "default", "pod_name": "web-1"}}}}
+```
+- When you have a final answer, use the action "Final Answer" with the answer as "action_input"
+"""
+
+# What AgentExecutor answers when it stops at max_iterations or max_execution_time
+STOPPED_OUTPUT = "Agent stopped due to iteration limit or time limit."
+# Part of a query's time budget kept for the best-effort answer, and its upper bound in seconds
+ANSWER_RESERVE_SHARE = 0.2
+ANSWER_RESERVE_SECONDS = 15.0
+# Characters of each tool result passed to the best-effort answer
+FINDING_CHARS = 2000
+# Below this many seconds left, the findings are returned without asking the LLM
+MIN_ANSWER_SECONDS = 1.0
+
+
+def build_system_prompt(tools: list, clusters: list = None) -> str:
+    """
+    Generates the agent instructions for a set of tools.
+
+    Tool names, descriptions and argument schemas are not repeated here: they
+    are sent to the model as function definitions with every call. When several
+    clusters are configured, their names are listed so broad tools can target them.
+    """
+    broad_names = {tool.name for tool in broad_insights_tools}
+    has_broad = any(tool.name in broad_names for tool in tools)
+    has_deep = any(tool.name not in broad_names for tool in tools)
+
+    categories = []
+    if has_broad:
+        categories.append("- **Broad Insights Tools** (get_all_* and list tools) → Surface-level data for multiple resources.")
+    if has_deep:
+        categories.append("- **Deep Dive Tools** → Detailed analysis of specific resources.")
+
+    return (
+        "You are an **AI Kubernetes Troubleshooting Assistant**.\n\n"
+        "🔹 **Your tools fall into two categories**:\n"
+        + "\n".join(categories)
+        + "\n\n**🚀 General Workflow for Debugging:**\n"
+        "1️⃣ Identify affected resources.\n"
+        "2️⃣ Use **Broad Insights Tools** for an overview of overall cluster health.\n"
+        "3️⃣ Use **Deep Dive Tools** to analyze a suspected resource in depth.\n"
+        "4️⃣ Correlate multiple tool outputs and provide actionable recommendations."
+        + _clusters_section(clusters)
+    )
+
+
+def _clusters_section(clusters: list) -> str:
+    if not clusters or len(clusters) < 2:
+        return ""
+    return (
+        f"\n\n🌐 **Clusters**: {', '.join(clusters)}.\n"
+        "Broad Insights Tools query the current cluster by default; pass `clusters` (\"all\" or a "
+        "comma-separated list) to query several clusters at once. Results are labelled with their cluster."
+    )
+
+
+def agent_style() -> str:
+    """
+    Returns how the agent calls tools: "react" or "tool_calling" (``KUBESAGE_AGENT_STYLE``).
+
+    Defaults to "react" for ``LLM_PROVIDER=lmstudio``, since many local models
+    do not support native tool calling, and to "tool_calling" otherwise.
+    """
+    style = os.getenv("KUBESAGE_AGENT_STYLE", "").strip().lower()
+    if style:
+        return style
+    if os.getenv("KUBESAGE_LLM_BACKENDS", "").strip():
+        return "tool_calling"
+    return "react" if os.getenv("LLM_PROVIDER", "openrouter").strip().lower() == "lmstudio" else "tool_calling"
+
+
+def _build_executor(tools: list) -> AgentExecutor:
+    """
+    Builds an agent executor offering only the given tools.
+
+    Executors have no memory of their own: the session's history is passed
+    with each query (see ``process_query``), so one executor serves every session.
+    """
+    if agent_style() == "react":
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", build_system_prompt(tools, configured_clusters()) + REACT_FORMATTING_RULES),
+            MessagesPlaceholder("chat_history", optional=True),
+            ("human", "{input}\n\n{agent_scratchpad}\n\n(reminder to always answer with an Action JSON blob)"),
+        ])
+        return AgentExecutor(
+            agent=create_structured_chat_agent(llm, tools, prompt),
+            tools=tools,
+            verbose=True,
+            handle_parsing_errors=True,
+        )
+
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", build_system_prompt(tools, configured_clusters())),
+        MessagesPlaceholder("chat_history", optional=True),
+        ("human", "{input}"),
+        MessagesPlaceholder("agent_scratchpad"),
+    ])
+    return AgentExecutor(
+        agent=create_tool_calling_agent(llm, tools, prompt),
+        tools=tools,
+        verbose=True,
+    )
+
+
+def executor_for_query(user_query: str) -> AgentExecutor:
+    """Returns an agent executor restricted to the tools relevant to the query."""
+    tools = select_tools(user_query)
+    key = tuple(tool.name for tool in tools)
+    if key not in _executors:
+        _executors[key] = _build_executor(tools)
+    return _executors[key]
+
 
 def init_llm_and_executor(model_name: str = "openai/gpt-4o") -> None:
     """
@@ -24,7 +165,15 @@ def init_llm_and_executor(model_name: str = "openai/gpt-4o") -> None:
         RateLimitError: If OpenRouter usage limits are exceeded.
         Exception: For any other unexpected errors.
     """
-    global llm, agent_executor, current_model
+    global llm
+
+    # Several backends kept live at once, routed per call by latency and health
+    backends = os.getenv("KUBESAGE_LLM_BACKENDS", "").strip()
+    if backends:
+        llm = create_router(model_name, backends.split(","))
+        llm.invoke("Hi, this is a test query")
+        _install_agent(model_name)
+        return
 
     # Decide provider: OpenRouter (default) or LM Studio local server
     provider = os.getenv("LLM_PROVIDER", "openrouter").strip().lower()
@@ -35,10 +184,11 @@ def init_llm_and_executor(model_name: str = "openai/gpt-4o") -> None:
         # LM Studio usually accepts any API key string; provide a default placeholder
         api_key = ""
 
-        llm = ChatOpenAI(
+        llm = ScheduledChatOpenAI(
             model_name=model_name,
             openai_api_key=api_key,
             openai_api_base=base_url,
+            provider="lmstudio",
         )
     else:
         # Default to OpenRouter
@@ -46,10 +196,11 @@ def init_llm_and_executor(model_name: str = "openai/gpt-4o") -> None:
         if not api_key:
             raise ValueError("OPENAI_API_KEY environment variable is not set")
 
-        llm = ChatOpenAI(
+        llm = ScheduledChatOpenAI(
             model_name=model_name,
             openai_api_key=api_key,
             openai_api_base="https://openrouter.ai/api/v1",
+            provider="openrouter",
         )
 
     try:
@@ -58,134 +209,177 @@ def init_llm_and_executor(model_name: str = "openai/gpt-4o") -> None:
         # Only attempt OpenRouter fallback if using OpenRouter
         if os.getenv("LLM_PROVIDER", "openrouter").strip().lower() != "lmstudio":
             print(f"{model_name} doesn't exist, using openai/gpt-4o-mini instead")
-            llm = ChatOpenAI(
+            llm = ScheduledChatOpenAI(
                 model_name="openai/gpt-4o-mini",
                 openai_api_key=os.getenv("OPENAI_API_KEY"),
                 openai_api_base="https://openrouter.ai/api/v1",
+                provider="openrouter",
             )
             llm.invoke("Hi, this is a test query")
         else:
             # For LM Studio, surface the error (model likely not loaded or name mismatch)
             raise
 
-    # Build prompt text dynamically to optionally include formatting rules for LM Studio
-    rules_block = (
-        """
-            
-            IMPORTANT FORMATTING RULES:
-            - Always include "Thought:" before reasoning
-            - Always include "Action:" before tool name  
-            - Always include "Action Input:" before parameters
-            - When you have a final answer, use: Final Answer: [your answer]
-            
-            ---
-            
-        """
-        if provider == "lmstudio" else ""
-    )
+    _install_agent(model_name)
 
-    prompt_text = (
-        """
-            You are an **AI Kubernetes Troubleshooting Assistant**.
-
-            🔹 **You have access to two categories of tools**:
-            1️⃣ **Broad Insights Tools** → Surface-level data for multiple resources.
-            2️⃣ **Deep Dive Tools** → Detailed analysis of specific resources.
-
-            ---
-
-            **📌 How to use these tools:**
-            - **Start with Broad Insights** → Use **broad tools** if the user asks about overall cluster health.
-            - **Use Deep Dive Tools** → If an issue is suspected, analyze a specific resource in-depth.
-            - **Correlate multiple tool outputs** to provide insightful recommendations.
-
-            ---
-
-            **🔹 Available Tools:**
-
-            🟢 **Broad Insights Tools**
-            - "Get All Pods with Resource Usage" → Lists all pods with CPU & Memory usage.
-            - "Get All Services" → Lists all services with their types and ports.
-            - "Get All Deployments" → Lists deployments with replica status.
-            - "Get All Nodes" → Lists nodes with their health & capacity.
-            - "Get All Endpoints" → Fetches endpoints and associated services.
-            - "Get Cluster Events" → Lists recent cluster-wide warnings & failures.
-            - "Get Namespace List" → Lists all namespaces and their statuses.
-
-            🔵 **Deep Dive Tools**
-            - "Describe Pod with Restart Count" → Fetches detailed pod info + restart count.
-            - "Get Pod Logs" → Fetches the last 10 log lines for a specific pod.
-            - "Describe Service" → Fetches service details (ClusterIP, NodePort, ExternalName).
-            - "Describe Deployment" → Fetches replica counts & container images.
-            - "Get Node Status & Capacity" → Fetches node health conditions & resource usage.
-            - "Check RBAC Events & Role Bindings" → Fetches RBAC security events & role bindings.
-            - "Get Persistent Volumes & Claims" → Lists PVs, PVCs, and their bound claims.
-            - "Get Running Jobs & CronJobs" → Lists active Jobs & CronJobs.
-            - "Get Ingress Resources & Annotations" → Lists Ingress rules, hosts, and annotations.
-            - "Check Pod Affinity & Anti-Affinity" → Analyzes pod scheduling constraints.
-            - "Get Kubernetes Object YAML" → Fetches the complete YAML representation of any Kubernetes object (pod, deployment, service, configmap, secret, etc.)
-
-            ---
-
-            **🚀 General Workflow for Debugging:
-            1️⃣ Identify affected resources.
-            2️⃣ Use **Broad Insights Tools** for an overview.
-            3️⃣ Use **Deep Dive Tools** for root cause analysis.
-            4️⃣ Provide actionable recommendations.
-
-            ---
-
-            **🚀 Example Workflow for a Pod Issue:**
-            1️⃣ **User Query:** "Why is my app crashing?"
-            2️⃣ **Step 1:** Use "Get All Pods with Resource Usage" to identify failing pods.
-            3️⃣ **Step 2:** Use "Describe Pod with Restart Count" for specific failure reasons.
-            4️⃣ **Step 3:** Use "Get Pod Logs" to analyze errors.
-            5️⃣ **Step 4:** If node issues are suspected, use "Get Node Status & Capacity".
-            6️⃣ **Step 5:** Provide an **actionable recommendation** based on tool outputs.
-
-            **🚀 Example Workflow for a Advenced Pod Issue:**
-            1️⃣ **User Query:** "Why is my app crashing?"
-            2️⃣ **Step 1:** Use "Get All Pods with Resource Usage" to identify failing pods.
-            3️⃣ **Step 2:** Use "Describe Pod with Restart Count" for specific failure reasons.
-            4️⃣ **Step 3:** Use "Get Pod Logs" to analyze errors.
-            5️⃣ **Step 4:** Use "Get Kubernetes Object YAML" to check if YAML is valid and no parameters are missed according to previous fetched logs.
-            6️⃣ **Step 5:** Provide an **actionable recommendation** based on tool outputs.
-        """
-        + rules_block
-        + """
-            **🔹 User Query:** {input}
-            """
-    )
+def _install_agent(model_name: str) -> None:
+    """Builds the executors around the freshly created ``llm``."""
+    global agent_executor, current_model
 
-    # Define a Prompt Template for guiding the agent
-    prompt_template = PromptTemplate(
-        input_variables=["input"],
-        template=prompt_text,
-    )
+    # Initialize the LangChain Agent with all Kubernetes tools
+    _executors.clear()
+    tools = offered_tools()
+    agent_executor = _build_executor(tools)
+    _executors[tuple(tool.name for tool in tools)] = agent_executor
 
-    # Conversation memory to maintain context
-    memory = ConversationBufferMemory(memory_key="chat_history")
-
-    # Initialize the LangChain Agent with Kubernetes tools
-    agent_executor = initialize_agent(
-        tools=broad_insights_tools + deep_dive_tools,
-        llm=llm,
-        agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-        verbose=True,
-        memory=memory,
-        prompt=prompt_template,
-        handle_parsing_errors=True
-    )
-    
     # Store the current model name
     current_model = model_name
 
-def process_query(user_query: str, model_name: str = "openai/gpt-4o"):
-    """Process natural language queries and fetch Kubernetes data via LangChain."""
-    global current_model
-    
-    # Initialize if not done yet, or reinitialize if model changed
-    if agent_executor is None or current_model != model_name:
-        init_llm_and_executor(model_name)
-    
-    return agent_executor.invoke(user_query)
+def ensure_initialized(model_name: str = "openai/gpt-4o") -> None:
+    """Initializes the agent if not done yet, or reinitializes it if the model changed."""
+    if agent_executor is not None and current_model == model_name:
+        return
+    # Queries from worker threads (batches, jobs) must not initialize concurrently
+    with _init_lock:
+        if agent_executor is None or current_model != model_name:
+            init_llm_and_executor(model_name)
+
+# Striped locks that serialize the history updates of a session within this process
+_session_locks = [threading.Lock() for _ in range(64)]
+
+
+def _session_lock(session_id: str):
+    return _session_locks[hash(session_id) % len(_session_locks)]
+
+
+def _load_memory(session_id: str):
+    """Restores a session's token-bounded conversation memory from the session store."""
+    try:
+        state = load_state(session_id, "memory")
+    except Exception as e:
+        # Answer without history rather than failing the query
+        print(f"⚠️ Session state unavailable, answering without history: {e}")
+        state = None
+    return restore_memory(llm, state)
+
+
+def _save_memory(session_id: str, memory) -> None:
+    try:
+        save_state(session_id, "memory", memory_state(memory))
+    except Exception as e:
+        print(f"⚠️ Could not save session state: {e}")
+
+
+class FindingsRecorder(BaseCallbackHandler):
+    """Keeps the tool results of an agent run, to answer from if the run is stopped early."""
+
+    def __init__(self):
+        self.findings = []
+        self._started = {}
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._started[run_id] = ((serialized or {}).get("name", "tool"), input_str)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        name, tool_input = self._started.pop(run_id, ("tool", ""))
+        self.findings.append((name, tool_input, str(getattr(output, "content", output))))
+
+
+def best_effort_answer(user_query: str, findings: list) -> str:
+    """Answers from the tool results gathered before the budget ran out, with the LLM if time is left."""
+    if not findings:
+        return ("⏱️ I ran out of time before gathering any cluster data. "
+                "Try a narrower question or a larger time budget.")
+    notes = "\n\n".join(f"{name}({tool_input}):\n{output[:FINDING_CHARS]}" for name, tool_input, output in findings)
+    remaining = time_left()
+    if remaining is None or remaining >= MIN_ANSWER_SECONDS:
+        try:
+            message = llm.invoke([
+                ("system", "You ran out of time while investigating a Kubernetes question. Answer it as well "
+                           "as you can from these tool results alone, and say what is still unknown."),
+                ("human", f"Question: {user_query}\n\nTool results:\n{notes}"),
+            ])
+            return f"⏱️ {message.content}"
+        except RunCancelled:
+            raise
+        except Exception as e:
+            print(f"⚠️ Could not write a best-effort answer: {e}")
+    return f"⏱️ I ran out of time before finishing. What I found so far:\n\n{notes}"
+
+
+def _timed_out(error: Exception) -> bool:
+    """Whether an error is a call cut short by a timeout, as the deadline does, rather than a failure."""
+    # urllib3's ReadTimeoutError (Kubernetes requests) is one of its TimeoutErrors
+    return isinstance(error, (DeadlineExceeded, APITimeoutError, HTTPTimeoutError, TimeoutError))
+
+
+def _invoke_within_budget(executor: AgentExecutor, inputs: dict, config: dict) -> dict:
+    """
+    Runs the agent within the current budget, answering with what it found if the budget runs out.
+
+    The agent loop gets the iteration budget and the time budget minus a
+    reserve, so the best-effort answer still has time to be written.
+    """
+    remaining = time_left()
+    reserve = min(remaining * ANSWER_RESERVE_SHARE, ANSWER_RESERVE_SECONDS)
+    limited = executor.model_copy(update={
+        "max_iterations": iteration_budget(),
+        "max_execution_time": remaining - reserve,
+    })
+    recorder = FindingsRecorder()
+    config = {**config, "callbacks": config["callbacks"] + [recorder]}
+    try:
+        with budget(remaining - reserve):
+            response = limited.invoke(inputs, config=config)
+    except RunCancelled:
+        raise
+    except Exception as e:
+        # LLM and Kubernetes calls cut short by the deadline fail with their own timeout errors;
+        # any other error, even near the deadline, is a failure of the query
+        if not _timed_out(e) or (not isinstance(e, DeadlineExceeded) and time_left() > reserve):
+            raise
+        response = {**inputs, "output": STOPPED_OUTPUT}
+    if response.get("output") == STOPPED_OUTPUT:
+        count("budgets_exhausted")
+        response["output"] = best_effort_answer(inputs["input"], recorder.findings)
+    return response
+
+
+def process_query(user_query: str, model_name: str = "openai/gpt-4o", use_memory: bool = True,
+                  callbacks: list = None, session_id: str = None):
+    """
+    Process natural language queries and fetch Kubernetes data via LangChain.
+
+    Args:
+        user_query: The question to answer
+        model_name: The model to use
+        use_memory: Whether the query reads and extends the session's conversation history
+        callbacks: Additional LangChain callbacks for the agent run
+        session_id: The conversation the query belongs to (default: the shared "default" session)
+
+    The query runs within the caller's ``budget``, or the default one
+    (``KUBESAGE_QUERY_TIMEOUT_SECONDS``, ``KUBESAGE_MAX_ITERATIONS``).
+    """
+    with budget():
+        ensure_initialized(model_name)
+        executor = executor_for_query(user_query)
+        # Stops the agent at its next step when the run is cancelled or out of time (see src.cancellation)
+        config = {"callbacks": get_callbacks() + [CancellationHandler()] + list(callbacks or [])}
+        if not use_memory:
+            return _invoke_within_budget(executor, {"input": user_query}, config)
+
+        session_id = session_id or DEFAULT_SESSION
+        memory = _load_memory(session_id)
+        cache_seconds = float(os.getenv("KUBESAGE_SESSION_CACHE_SECONDS", "0"))
+        # Follow-up questions of a session may reuse its recent list results, on any replica
+        with shared_lists(SessionListCache(session_id, cache_seconds)) if cache_seconds > 0 else nullcontext():
+            response = _invoke_within_budget(
+                executor, {"input": user_query, **memory.load_memory_variables({})}, config)
+        # Concurrent queries of the session may have saved turns since this one started:
+        # append this turn to the history as it is now, so none of them is lost
+        with _session_lock(session_id):
+            memory = _load_memory(session_id)
+            # Turns that cannot be summarized now (e.g. out of time) stay in the buffer for the next query
+            memory.save_context({"input": user_query}, {"output": response["output"]})
+            _save_memory(session_id, memory)
+        return response
@@ -1,146 +1,267 @@
-import json
+import re
+from typing import Literal, Optional
 
-from langchain.tools import Tool
+from langchain_core.tools import StructuredTool
+from pydantic import BaseModel, Field
+from src.history_store import history_available
 from src.k8s_utils import (
     get_all_pods_with_usage, get_all_services, get_all_deployments,
-    get_all_nodes, get_all_endpoints, get_cluster_events, get_all_namespaces
+    get_all_nodes, get_all_endpoints, get_cluster_events, get_all_namespaces, analyze_node_capacity
 )
 from src.k8s_depth_utils import (
     describe_pod_with_restart_count, get_pod_logs, describe_service,
     describe_deployment, get_node_status_and_capacity, get_rbac_events_and_role_bindings,
     get_persistent_volumes_and_claims, get_running_jobs_and_cronjobs, get_ingress_resources, check_pod_affinity,
-    get_kubernetes_object_yaml
+    get_kubernetes_object_yaml, check_rbac_access, who_can_access,
+    get_resource_dependencies, get_recent_changes, get_usage_trends
 )
 
-# Broad Insights Tools
-broad_insights_tools = [
-    Tool(
-        name="Get All Pods with Resource Usage",
-        description="Fetches pod details including status, node, CPU/memory usage.",
-        func=lambda _: get_all_pods_with_usage(),
-    ),
-    Tool(
-        name="Get All Services",
-        description="Lists all services with types and ports.",
-        func=lambda _: get_all_services(),
-    ),
-    Tool(
-        name="Get All Deployments",
-        description="Lists deployments with replica status.",
-        func=lambda _: get_all_deployments(),
-    ),
-    Tool(
-        name="Get All Nodes",
-        description="Lists nodes with health conditions & capacity.",
-        func=lambda _: get_all_nodes(),
-    ),
-    Tool(
-        name="Get All Endpoints",
-        description="Fetches endpoints and associated services.",
-        func=lambda _: get_all_endpoints(),
+# Tool categories, attached to each tool as LangChain tags. Tools tagged "core"
+# are always offered; the others only when the query mentions their category.
+# Tools tagged "history" are only offered while cluster history is recorded.
+# Keywords match whole words (plurals included); a trailing "*" matches any word
+# starting with the stem, e.g. "crash*" matches "crashing" and "CrashLoopBackOff".
+TOOL_CATEGORY_KEYWORDS = {
+    "workloads": (
+        "pod", "crash*", "restart*", "oom*", "container", "image", "log", "deployment",
+        "replica*", "rollout", "job", "cron*", "schedul*", "affinit*", "pending",
     ),
-    Tool(
-        name="Get Cluster Events",
-        description="Lists recent cluster-wide warnings & failures.",
-        func=lambda _: get_cluster_events(),
+    "networking": (
+        "service", "svc", "endpoint", "ingress", "network*", "dns", "port", "traffic",
+        "connect*", "host", "rout*", "503", "502", "504", "timeout", "load balancer",
     ),
-    Tool(
-        name="Get Namespace List",
-        description="Lists all namespaces and their statuses.",
-        func=lambda _: get_all_namespaces(),
+    "storage": ("volume", "pvc", "pv", "storage", "disk", "mount*", "claim"),
+    "rbac": (
+        "rbac", "role*", "permission", "forbidden", "denied", "serviceaccount",
+        "service account", "access", "403", "can i", "who can",
     ),
-]
+    "cluster": ("node", "cluster", "capacity", "pressure", "cpu", "memory", "health*", "taint"),
+}
 
-# Utility function to safely parse JSON inputs
-def parse_params(params):
-    """Parses input parameters safely and ensures correct function arguments."""
-    print(f"Unparsed Params: {params}") # Debugging Output
-    if isinstance(params, dict):
-        # print(f"✅ Parsed Params (Already Dict): {params}")  # Debugging Output
-        return params  # Already a dictionary, return as is
 
-    try:
-        parsed = json.loads(params)  # Convert JSON string to dictionary
-        if not isinstance(parsed, dict):
-            raise ValueError("Parsed parameters must be a dictionary.")
+def _keyword_pattern(keywords: tuple):
+    words = [re.escape(k[:-1]) + r"\w*" if k.endswith("*") else re.escape(k) + "(?:e?s)?" for k in keywords]
+    return re.compile(r"\b(?:" + "|".join(words) + r")\b")
 
-        # print(f"✅ Parsed Params (From JSON): {parsed}")  # Debugging Output
-        return parsed
-    except json.JSONDecodeError:
-        raise ValueError("Invalid parameter format. Please provide a valid JSON.")
 
+_CATEGORY_PATTERNS = {category: _keyword_pattern(keywords) for category, keywords in TOOL_CATEGORY_KEYWORDS.items()}
 
+class ClusterArgs(BaseModel):
+    clusters: Optional[str] = Field(
+        default=None,
+        description="Comma-separated kubeconfig contexts to query, or 'all'; omit to query the current cluster only",
+    )
 
-# Deep Dive Tools with Fixed Parameter Parsing
-deep_dive_tools = [
-    Tool(
-        name="Describe Pod with Restart Count",
-        description="Fetches detailed pod info + restart count. (pass input as valid JSON)",
-        func=lambda params: describe_pod_with_restart_count(
-            **parse_params(params)
-        ),
-    ),
-    Tool(
-        name="Get Pod Logs",
-        description="Fetches the last 10 log lines for a specific pod. (pass input as valid JSON)",
-        func=lambda params: get_pod_logs(
-            **parse_params(params)
-        ),
+
+class NodeCapacityArgs(ClusterArgs):
+    top: int = Field(default=10, description="Number of hottest nodes to return")
+
+
+class PodArgs(BaseModel):
+    namespace: str = Field(description="Namespace of the pod")
+    pod_name: str = Field(description="Name of the pod")
+
+
+class ServiceArgs(BaseModel):
+    namespace: str = Field(description="Namespace of the service")
+    service_name: str = Field(description="Name of the service")
+
+
+class DeploymentArgs(BaseModel):
+    namespace: str = Field(description="Namespace of the deployment")
+    deployment_name: str = Field(description="Name of the deployment")
+
+
+class NodeArgs(BaseModel):
+    node_name: str = Field(description="Name of the node")
+
+
+class ObjectArgs(BaseModel):
+    resource_type: str = Field(
+        description="Kind, plural or short name of the object, e.g. pod, deploy, svc, certificate, rollouts.argoproj.io"
+    )
+    name: str = Field(description="Name of the object")
+    namespace: str = Field(default="default", description="Namespace of the object; ignored for cluster-scoped kinds")
+    output_format: Literal["yaml", "json"] = Field(default="yaml", description="yaml, or json for compact output")
+    strip_noise: bool = Field(default=True, description="Omit managedFields and last-applied-configuration")
+
+
+class DependencyArgs(BaseModel):
+    kind: str = Field(
+        description="Service, Deployment, ReplicaSet, StatefulSet, DaemonSet, Job, CronJob, Pod, PVC or PV"
+    )
+    name: str = Field(description="Name of the object")
+    namespace: str = Field(default="default", description="Namespace of the object; ignored for PVs")
+
+
+class ChangesArgs(BaseModel):
+    minutes: int = Field(default=60, description="Length of the time window in minutes")
+    kind: Optional[str] = Field(default=None, description="Only changes to this kind, e.g. pod, deployment, node")
+    namespace: Optional[str] = Field(default=None, description="Only changes in this namespace")
+    name: Optional[str] = Field(default=None, description="Only changes to objects with this name")
+    ending_minutes_ago: int = Field(default=0, description="End the window this many minutes before now")
+    limit: int = Field(default=100, description="Maximum number of changes to return")
+
+
+class TrendArgs(BaseModel):
+    kind: Literal["pod", "node"] = Field(default="pod", description="pod or node")
+    minutes: int = Field(default=60, description="Length of the time window in minutes, ending now")
+    namespace: Optional[str] = Field(default=None, description="Only pods in this namespace")
+    name: Optional[str] = Field(default=None, description="Only the pod or node with this name")
+    sort_by: Literal["memory", "cpu"] = Field(default="memory", description="Rank by growth of memory or cpu")
+    top: int = Field(default=10, description="Number of objects to return")
+
+
+class RbacAccessArgs(BaseModel):
+    subject_kind: Literal["User", "Group", "ServiceAccount"] = Field(description="Kind of the subject")
+    subject_name: str = Field(description="Name of the user, group or service account")
+    verb: str = Field(description="API verb, e.g. get, list, watch, create, update, patch, delete")
+    resource: str = Field(description="Resource, e.g. secrets, deployments, pods/log, pods/exec")
+    namespace: Optional[str] = Field(default=None, description="Namespace of the request; omit for cluster-wide")
+    subject_namespace: Optional[str] = Field(default=None, description="Namespace of a ServiceAccount subject")
+
+
+class WhoCanArgs(BaseModel):
+    verb: str = Field(description="API verb, e.g. get, list, watch, create, update, patch, delete")
+    resource: str = Field(description="Resource, e.g. secrets, deployments, pods/log, pods/exec")
+    namespace: Optional[str] = Field(default=None, description="Namespace to check; omit for every namespace")
+
+
+def _invalid_arguments(error) -> str:
+    """Returns argument validation errors to the model instead of raising."""
+    return f"Invalid tool arguments: {error}"
+
+
+def make_tool(func, description: str, tags: list, args_schema=None) -> StructuredTool:
+    """Wraps a Kubernetes function as a schema-typed tool named after the function."""
+    return StructuredTool.from_function(
+        func=func,
+        description=description,
+        args_schema=args_schema,
+        tags=tags,
+        handle_validation_error=_invalid_arguments,
+    )
+
+
+# Broad Insights Tools
+broad_insights_tools = [
+    make_tool(get_all_pods_with_usage, "Fetches pod details including status, node, CPU/memory usage.", ["workloads"], ClusterArgs),
+    make_tool(get_all_services, "Lists all services with types and ports.", ["networking"], ClusterArgs),
+    make_tool(get_all_deployments, "Lists deployments with replica status.", ["workloads"], ClusterArgs),
+    make_tool(get_all_nodes, "Lists nodes with health conditions & capacity.", ["cluster"], ClusterArgs),
+    make_tool(
+        analyze_node_capacity,
+        "Analyzes all nodes at once: allocatable capacity vs. summed pod requests/limits and live usage. "
+        "Returns the hottest and overcommitted nodes and every node that is not Ready or under pressure.",
+        ["cluster"],
+        NodeCapacityArgs,
     ),
-    Tool(
-        name="Describe Service",
-        description="Fetches detailed information about a specific service. (pass input as valid JSON)",
-        func=lambda params: describe_service(
-            **parse_params(params)
-        ),
+    make_tool(get_all_endpoints, "Fetches endpoints and associated services.", ["networking"], ClusterArgs),
+    make_tool(get_cluster_events, "Lists recent cluster-wide warnings & failures.", ["core"], ClusterArgs),
+    make_tool(get_all_namespaces, "Lists all namespaces and their statuses.", ["core"], ClusterArgs),
+]
+
+# Deep Dive Tools
+deep_dive_tools = [
+    make_tool(describe_pod_with_restart_count, "Fetches detailed pod info + restart count.", ["workloads"], PodArgs),
+    make_tool(get_pod_logs, "Fetches the last 10 log lines for a specific pod.", ["workloads"], PodArgs),
+    make_tool(describe_service, "Fetches detailed information about a specific service.", ["networking"], ServiceArgs),
+    make_tool(
+        describe_deployment,
+        "Fetches deployment details including replica count and container images.",
+        ["workloads"],
+        DeploymentArgs,
     ),
-    Tool(
-        name="Describe Deployment",
-        description="Fetches deployment details including replica count and container images. Takes namespace and deployment_name as inputs (pass input as valid JSON)",
-        func=lambda params: describe_deployment(
-            **parse_params(params)
-        ),
+    make_tool(get_node_status_and_capacity, "Fetches node health conditions and resource pressure.", ["cluster"], NodeArgs),
+    make_tool(get_rbac_events_and_role_bindings, "Fetches RBAC events, RoleBindings, and ClusterRoleBindings.", ["rbac"]),
+    make_tool(
+        get_resource_dependencies,
+        "Returns the whole dependency chain of an object in one step: owning workloads "
+        "(Deployment -> ReplicaSet -> Pod), the pods a service selects and its endpoint readiness, "
+        "and the PVCs and PVs the pods mount, with findings such as no ready endpoints or pending claims. "
+        "Use it first for questions like 'why is service X returning 503s?'.",
+        ["core"],
+        DependencyArgs,
     ),
-    Tool(
-        name="Get Node Status & Capacity",
-        description="Fetches node health conditions and resource pressure. (pass input as valid JSON)",
-        func=lambda params: get_node_status_and_capacity(
-            **parse_params(params)
-        ),
+    make_tool(
+        get_recent_changes,
+        "Lists recorded changes to pods, workloads, services, endpoints, volumes and nodes in a time window "
+        "(field-level diffs such as image, replica, readiness or condition changes). "
+        "Use it for 'what changed before this outage?' questions.",
+        ["core", "history"],
+        ChangesArgs,
     ),
-    Tool(
-        name="Check RBAC Events & Role Bindings",
-        description="Fetches RBAC events, RoleBindings, and ClusterRoleBindings.",
-        func=lambda _: get_rbac_events_and_role_bindings(),  # No parameters needed
+    make_tool(
+        get_usage_trends,
+        "Summarizes recorded CPU and memory usage of pods or nodes over a time window, "
+        "ranked by growth (first, last, min, avg, max).",
+        ["cluster", "workloads", "history"],
+        TrendArgs,
     ),
-    Tool(
-        name="Get Persistent Volumes & Claims",
-        description="Lists all Persistent Volumes (PVs) and Persistent Volume Claims (PVCs).",
-        func=lambda _: get_persistent_volumes_and_claims(),  # No parameters needed
+    make_tool(
+        check_rbac_access,
+        "Checks whether a user, group or service account may perform a verb on a resource, "
+        "and lists the bindings and roles that allow it.",
+        ["rbac"],
+        RbacAccessArgs,
     ),
-    Tool(
-        name="Get Running Jobs & CronJobs",
-        description="Lists all active Jobs and CronJobs.",
-        func=lambda _: get_running_jobs_and_cronjobs(),  # No parameters needed
+    make_tool(
+        who_can_access,
+        "Lists the users, groups and service accounts that may perform a verb on a resource, "
+        "with the bindings and roles that allow it.",
+        ["rbac"],
+        WhoCanArgs,
     ),
-    Tool(
-        name="Get Ingress Resources & Annotations",
-        description="Fetches all Ingress resources, their rules, hosts, and annotations.",
-        func=lambda _: get_ingress_resources(),  # No parameters needed
+    make_tool(
+        get_persistent_volumes_and_claims,
+        "Lists all Persistent Volumes (PVs) and Persistent Volume Claims (PVCs).",
+        ["storage"],
     ),
-    Tool(
-        name="Check Pod Affinity & Anti-Affinity",
-        description="Analyzes the affinity and anti-affinity rules for a specific pod. (pass input as valid JSON)",
-        func=lambda params: check_pod_affinity(
-            **parse_params(params)
-        ),
+    make_tool(get_running_jobs_and_cronjobs, "Lists all active Jobs and CronJobs.", ["workloads"]),
+    make_tool(get_ingress_resources, "Fetches all Ingress resources, their rules, hosts, and annotations.", ["networking"]),
+    make_tool(
+        check_pod_affinity,
+        "Analyzes the affinity and anti-affinity rules for a specific pod.",
+        ["workloads", "cluster"],
+        PodArgs,
     ),
-    Tool(
-        name="Get Kubernetes Object YAML",
-        description="Fetches the complete YAML representation of any Kubernetes object (pod, deployment, service, configmap, secret, etc.). Supports both namespaced and cluster-scoped resources. (pass input as valid JSON with resource_type, name, and optionally namespace)",
-        func=lambda params: get_kubernetes_object_yaml(
-            **parse_params(params)
-        ),
+    make_tool(
+        get_kubernetes_object_yaml,
+        "Fetches the complete YAML representation of any Kubernetes object (pod, deployment, service, "
+        "configmap, secret, etc.), including custom resources (CRDs). Supports both namespaced and "
+        "cluster-scoped resources.",
+        ["core"],
+        ObjectArgs,
     ),
 ]
 
+# Single registry of every tool offered to the agent
+all_tools = broad_insights_tools + deep_dive_tools
+
+
+def classify_query(user_query: str) -> set:
+    """Returns the tool categories a query is about, based on whole-word keyword matches."""
+    text = user_query.lower()
+    return {category for category, pattern in _CATEGORY_PATTERNS.items() if pattern.search(text)}
+
+
+def offered_tools() -> list:
+    """Returns every tool that can be offered now; the history tools only while history is recorded."""
+    if history_available():
+        return list(all_tools)
+    return [tool for tool in all_tools if "history" not in (tool.tags or [])]
+
+
+def select_tools(user_query: str) -> list:
+    """
+    Selects the tools relevant to a query.
+
+    Returns the core tools plus the tools of every category the query mentions,
+    or all offered tools when no category can be recognized.
+    """
+    tools = offered_tools()
+    categories = classify_query(user_query)
+    if not categories:
+        return tools
+    categories.add("core")
+    return [tool for tool in tools if categories.intersection(tool.tags or [])]
@@ -0,0 +1,276 @@
+"""
+Latency-aware routing of LLM calls across several OpenAI-compatible backends.
+
+``KUBESAGE_LLM_BACKENDS`` lists the backends to keep live at the same time, in
+order of preference:
+
+- ``openrouter``: OpenRouter, using ``OPENAI_API_KEY``;
+- ``lmstudio``: a local LM Studio server at ``LM_STUDIO_BASE_URL``, serving
+  ``LM_STUDIO_MODEL`` (default: the requested model name);
+- ``name=https://host/v1``: any other OpenAI-compatible endpoint, with its key in
+  ``KUBESAGE_LLM_<NAME>_API_KEY`` and its model in ``KUBESAGE_LLM_<NAME>_MODEL``.
+
+Every agent step goes to the backend with the best score: the moving average of
+its latency (time to first token for streams), inflated by its recent error
+rate. Backends that keep failing, or whose scheduler lane is paused by a rate
+limit, are tried last. A failed call is retried on the next backend.
+
+With ``KUBESAGE_LLM_HEDGE_AFTER_MS`` set, a streamed step that has not produced
+its first token within that time is also sent to the second-best backend, and
+the first stream to answer wins.
+
+A cancelled run, or one out of time, is not a backend failure: it is neither
+recorded against the backend nor retried on another one.
+"""
+import contextvars
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, List
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.outputs import ChatResult
+from openai import APITimeoutError, BadRequestError, UnprocessableEntityError
+
+from src.cancellation import DeadlineExceeded, RunCancelled, time_left
+from src.llm_scheduler import get_scheduler
+from src.scheduled_llm import ScheduledChatOpenAI
+
+# Errors caused by the request itself fail the same way on every backend
+NON_RETRYABLE_ERRORS = (BadRequestError, UnprocessableEntityError)
+
+# Weight of the newest sample in the latency moving average
+LATENCY_ALPHA = 0.3
+ERROR_WINDOW = 20
+
+
+def _ends_run(error: Exception) -> bool:
+    """Whether an error stops the whole run, rather than failing one backend."""
+    if isinstance(error, (RunCancelled, DeadlineExceeded)):
+        return True
+    # A call cut short by the run's deadline would time out on every backend
+    return isinstance(error, (APITimeoutError, TimeoutError)) and time_left() == 0
+
+
+class Backend:
+    """One OpenAI-compatible endpoint and its rolling latency and error statistics."""
+
+    def __init__(self, name: str, llm: ScheduledChatOpenAI):
+        self.name = name
+        self.llm = llm
+        self.latency_ms = None
+        self.outcomes = deque(maxlen=ERROR_WINDOW)
+        self._lock = threading.Lock()
+
+    def record(self, ok: bool, latency_ms: float = None) -> None:
+        with self._lock:
+            self.outcomes.append(ok)
+            if ok and latency_ms is not None:
+                self.latency_ms = latency_ms if self.latency_ms is None else (
+                    LATENCY_ALPHA * latency_ms + (1 - LATENCY_ALPHA) * self.latency_ms)
+
+    @property
+    def error_rate(self) -> float:
+        with self._lock:
+            return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def score(self) -> tuple:
+        """Sort key: lower is better. Unmeasured backends score 0 so they get tried."""
+        paused = get_scheduler().paused_for(self.llm.scheduler_key) > 0
+        unhealthy = self.error_rate >= 0.5
+        return (paused or unhealthy, (self.latency_ms or 0.0) * (1 + 4 * self.error_rate))
+
+    def to_dict(self) -> dict:
+        return {
+            "model": self.llm.model_name,
+            "latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "error_rate": round(self.error_rate, 2),
+            "calls": len(self.outcomes),
+        }
+
+
+class RoutedChatModel(BaseChatModel):
+    """Chat model that sends each call to the healthiest, fastest of several backends."""
+
+    backends: List[Any]
+    hedge_after_ms: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "kubesage-router"
+
+    @property
+    def model_name(self) -> str:
+        return self.backends[0].llm.model_name
+
+    def ranked_backends(self) -> list:
+        # sorted() is stable, so ties keep the configured order of preference
+        return sorted(self.backends, key=lambda backend: backend.score())
+
+    def stats(self) -> dict:
+        return {backend.name: backend.to_dict() for backend in self.backends}
+
+    def bind_tools(self, tools, **kwargs):
+        # Tool schemas are formatted the OpenAI way by the primary backend
+        return self.bind(**self.backends[0].llm.bind_tools(tools, **kwargs).kwargs)
+
+    def get_num_tokens(self, text: str) -> int:
+        return self.backends[0].llm.get_num_tokens(text)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        errors = []
+        for backend in self.ranked_backends():
+            started = time.perf_counter()
+            try:
+                result = backend.llm._generate(messages, stop=stop, **kwargs)
+            except NON_RETRYABLE_ERRORS:
+                raise
+            except Exception as e:
+                if _ends_run(e):
+                    raise
+                backend.record(False)
+                errors.append(f"{backend.name}: {e}")
+                print(f"⚠️ LLM backend {backend.name} failed, trying the next one: {e}")
+                continue
+            backend.record(True, (time.perf_counter() - started) * 1000)
+            result.llm_output = {**(result.llm_output or {}), "backend": backend.name}
+            return result
+        raise RuntimeError(f"All LLM backends failed: {'; '.join(errors)}")
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        ranked = self.ranked_backends()
+        errors = []
+        while ranked:
+            hedge = ranked[:2] if self.hedge_after_ms > 0 else ranked[:1]
+            winner, stream, first = self._first_chunk(hedge, messages, stop, kwargs, errors)
+            ranked = [backend for backend in ranked if backend not in hedge]
+            if winner is None:
+                continue
+
+            try:
+                for chunk in chunks_after(first, stream):
+                    if run_manager:
+                        run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                    yield chunk
+            except Exception as e:
+                # Tokens were already emitted; failing over would duplicate them
+                if not _ends_run(e):
+                    winner.record(False)
+                raise
+            return
+        raise RuntimeError(f"All LLM backends failed: {'; '.join(errors)}")
+
+    def _first_chunk(self, backends: list, messages, stop, kwargs: dict, errors: list):
+        """
+        Starts streams on ``backends`` (the second only after the hedge delay)
+        and returns the first backend to produce a chunk, with its stream and chunk.
+        """
+        results = queue.Queue()
+        started = time.perf_counter()
+
+        def start(backend):
+            stream = backend.llm._stream(messages, stop=stop, **kwargs)
+            try:
+                results.put((backend, stream, next(stream), None))
+            except StopIteration:
+                results.put((backend, None, None, RuntimeError("empty response")))
+            except Exception as e:
+                results.put((backend, None, None, e))
+
+        pending = 0
+        for index, backend in enumerate(backends):
+            if index > 0:
+                try:
+                    # Hedge only if the preferred backend has not answered in time
+                    result = results.get(timeout=self.hedge_after_ms / 1000)
+                    results.put(result)
+                    error = result[3]
+                    if error is None or isinstance(error, NON_RETRYABLE_ERRORS) or _ends_run(error):
+                        break
+                    # The preferred backend failed fast: start the next one right away
+                except queue.Empty:
+                    print(f"⏱️ No first token from {backends[0].name} after {self.hedge_after_ms:g} ms, "
+                          f"hedging on {backend.name}")
+            # Copy the context so the stream is scheduled and traced as part of the current request
+            threading.Thread(target=contextvars.copy_context().run, args=(start, backend),
+                             name="kubesage-llm-stream", daemon=True).start()
+            pending += 1
+
+        while pending:
+            backend, stream, first, error = results.get()
+            pending -= 1
+            if error is not None:
+                if isinstance(error, NON_RETRYABLE_ERRORS) or _ends_run(error):
+                    if pending:
+                        threading.Thread(target=_close_losers, args=(results, pending), daemon=True).start()
+                    raise error
+                backend.record(False)
+                errors.append(f"{backend.name}: {error}")
+                continue
+            backend.record(True, (time.perf_counter() - started) * 1000)
+            if pending:
+                threading.Thread(target=_close_losers, args=(results, pending), daemon=True).start()
+            return backend, stream, first
+        return None, None, None
+
+
+def chunks_after(first, stream):
+    yield first
+    yield from stream
+
+
+def _close_losers(results: queue.Queue, pending: int) -> None:
+    """Closes the streams of hedged requests that lost the race."""
+    for _ in range(pending):
+        _, stream, _, _ = results.get()
+        if stream is not None:
+            stream.close()
+
+
+def _backend(spec: str, model_name: str) -> Backend:
+    spec = spec.strip()
+    if spec == "openrouter":
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY environment variable is not set")
+        return Backend("openrouter", ScheduledChatOpenAI(
+            model_name=model_name,
+            openai_api_key=api_key,
+            openai_api_base="https://openrouter.ai/api/v1",
+            provider="openrouter",
+        ))
+    if spec == "lmstudio":
+        return Backend("lmstudio", ScheduledChatOpenAI(
+            model_name=os.getenv("LM_STUDIO_MODEL", model_name),
+            openai_api_key=os.getenv("LM_STUDIO_API_KEY", "lm-studio"),
+            openai_api_base=os.getenv("LM_STUDIO_BASE_URL", "http://localhost:1234/v1"),
+            provider="lmstudio",
+        ))
+    if "=" in spec:
+        name, base_url = (part.strip() for part in spec.split("=", 1))
+        prefix = f"KUBESAGE_LLM_{name.upper().replace('-', '_')}"
+        return Backend(name, ScheduledChatOpenAI(
+            model_name=os.getenv(f"{prefix}_MODEL", model_name),
+            openai_api_key=os.getenv(f"{prefix}_API_KEY", "not-needed"),
+            openai_api_base=base_url,
+            provider=name,
+        ))
+    raise ValueError(f"Unknown LLM backend '{spec}'. Use openrouter, lmstudio or name=https://host/v1")
+
+
+def create_router(model_name: str, specs: list) -> RoutedChatModel:
+    """
+    Creates a router over the given backend specifications.
+
+    Raises:
+        ValueError: If a specification is invalid or a required API key is missing.
+    """
+    backends = [_backend(spec, model_name) for spec in specs if spec.strip()]
+    if not backends:
+        raise ValueError("KUBESAGE_LLM_BACKENDS does not name any backend")
+    return RoutedChatModel(
+        backends=backends,
+        hedge_after_ms=float(os.getenv("KUBESAGE_LLM_HEDGE_AFTER_MS", "0")),
+    )
@@ -0,0 +1,373 @@
+"""
+Admission control for LLM calls.
+
+Every call to a provider goes through ``LLMScheduler``. It keeps one lane per
+provider and model, and each lane has:
+
+- a token bucket of ``KUBESAGE_LLM_RPM`` requests per minute (unlimited by
+  default) with bursts of up to ``KUBESAGE_LLM_BURST``;
+- at most ``KUBESAGE_LLM_MAX_CONCURRENCY`` calls in flight;
+- a fair queue: waiting calls are served by priority (interactive WebSocket and
+  REST queries before batches and background jobs), then round-robin across
+  clients, so one client's burst cannot starve the others.
+
+Rate-limit responses pause the whole lane for the provider's ``Retry-After``
+(or an exponential backoff when it is missing) and the call is retried, up to
+``KUBESAGE_LLM_MAX_RETRIES`` times. Connection errors, timeouts and other
+server errors are retried twice, as the OpenAI client does, and only the
+failed call waits.
+"""
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from email.utils import parsedate_to_datetime
+
+from src.cancellation import DeadlineExceeded, current_token, time_left
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Retries of connection errors, timeouts and server errors (the OpenAI client's default)
+TRANSIENT_RETRIES = 2
+
+_request_context = contextvars.ContextVar("kubesage_llm_request", default=(INTERACTIVE, "default"))
+
+
+@contextmanager
+def scheduling(priority: int, client_id: str):
+    """Sets the priority and client that LLM calls made inside the block are queued under."""
+    token = _request_context.set((priority, client_id))
+    try:
+        yield
+    finally:
+        _request_context.reset(token)
+
+
+class TokenBucket:
+    """Requests-per-minute limit with bursts, which can be paused after a rate-limit response."""
+
+    def __init__(self, rate_per_minute: float, burst: float):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, burst)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """Returns the seconds until a request may be sent (0 when one may be sent now)."""
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.rate <= 0:
+            return 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        if self.rate > 0:
+            self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class _Lane:
+    """Queue, rate limit and in-flight count of one provider and model."""
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.in_flight = 0
+        # Waiting calls dropped because their run was cancelled or ran out of time
+        self.cancelled = 0
+        # priority -> client -> waiting tickets; clients rotate to the end when served
+        self.waiting = {}
+
+    def enqueue(self, priority: int, client_id: str, ticket) -> None:
+        clients = self.waiting.setdefault(priority, OrderedDict())
+        clients.setdefault(client_id, deque()).append(ticket)
+
+    def head(self):
+        if not self.waiting:
+            return None
+        clients = self.waiting[min(self.waiting)]
+        return next(iter(clients.values()))[0]
+
+    def pop_head(self) -> None:
+        priority = min(self.waiting)
+        clients = self.waiting[priority]
+        client_id, tickets = next(iter(clients.items()))
+        tickets.popleft()
+        if tickets:
+            clients.move_to_end(client_id)
+        else:
+            del clients[client_id]
+        if not clients:
+            del self.waiting[priority]
+
+    def discard(self, ticket) -> None:
+        """Removes a waiting ticket, wherever it is in the queue."""
+        for priority, clients in list(self.waiting.items()):
+            for client_id, tickets in list(clients.items()):
+                if ticket in tickets:
+                    tickets.remove(ticket)
+                    if not tickets:
+                        del clients[client_id]
+                    if not clients:
+                        del self.waiting[priority]
+                    return
+
+    @property
+    def queued(self) -> int:
+        return sum(len(tickets) for clients in self.waiting.values() for tickets in clients.values())
+
+
+class LLMScheduler:
+    """Admits LLM calls per provider and model according to rate, concurrency and fairness."""
+
+    def __init__(self, rate_per_minute: float = None, burst: float = None,
+                 max_concurrency: int = None, max_retries: int = None):
+        self.rate_per_minute = rate_per_minute if rate_per_minute is not None else float(
+            os.getenv("KUBESAGE_LLM_RPM", "0"))
+        self.burst = burst if burst is not None else float(os.getenv("KUBESAGE_LLM_BURST", "10"))
+        self.max_concurrency = max_concurrency or int(os.getenv("KUBESAGE_LLM_MAX_CONCURRENCY", "8"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("KUBESAGE_LLM_MAX_RETRIES", "6"))
+        self._lanes = {}
+        self._cond = threading.Condition()
+
+    def _lane(self, key: tuple) -> _Lane:
+        if key not in self._lanes:
+            self._lanes[key] = _Lane(TokenBucket(self.rate_per_minute, self.burst))
+        return self._lanes[key]
+
+    def acquire(self, key: tuple, priority: int = None, client_id: str = None) -> None:
+        """
+        Blocks until the caller may send a request on the lane ``key``.
+
+        Raises:
+            RunCancelled: If the caller's run is cancelled while it waits; its place in the queue is freed.
+            DeadlineExceeded: If the run's time budget runs out while it waits.
+        """
+        default_priority, default_client = _request_context.get()
+        priority = default_priority if priority is None else priority
+        client_id = client_id or default_client
+        token = current_token()
+        with token.on_cancel(self._wake) if token is not None else nullcontext():
+            self._acquire(key, priority, client_id, token)
+
+    def _wake(self) -> None:
+        with self._cond:
+            self._cond.notify_all()
+
+    def _acquire(self, key: tuple, priority: int, client_id: str, token) -> None:
+        ticket = object()
+        with self._cond:
+            lane = self._lane(key)
+            lane.enqueue(priority, client_id, ticket)
+            while True:
+                remaining = time_left()
+                if (token is not None and token.cancelled) or remaining == 0:
+                    lane.discard(ticket)
+                    lane.cancelled += 1
+                    self._cond.notify_all()
+                    if token is not None:
+                        token.check()
+                    raise DeadlineExceeded("⏱️ The query ran out of time waiting for the LLM")
+                wait = None
+                if lane.head() is ticket and lane.in_flight < self.max_concurrency:
+                    wait = lane.bucket.wait_time(time.monotonic())
+                    if wait <= 0:
+                        lane.bucket.take()
+                        lane.pop_head()
+                        lane.in_flight += 1
+                        self._cond.notify_all()
+                        return
+                if remaining is not None:
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._cond.wait(timeout=wait)
+
+    def release(self, key: tuple) -> None:
+        with self._cond:
+            self._lane(key).in_flight -= 1
+            self._cond.notify_all()
+
+    def paused_for(self, key: tuple) -> float:
+        """Returns the seconds the lane stays paused after a rate-limit response."""
+        with self._cond:
+            return max(0.0, self._lane(key).bucket.paused_until - time.monotonic())
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"/".join(key): {"in_flight": lane.in_flight, "queued": lane.queued, "cancelled": lane.cancelled}
+                    for key, lane in self._lanes.items()}
+
+    def _backoff(self, key: tuple, error: Exception, attempt: int):
+        """
+        Schedules the retry of a failed call.
+
+        Rate limits pause the whole lane; after other retryable errors only the
+        failed call waits. Returns the seconds the caller should wait before
+        retrying (0 when the lane is paused), or None if it should not retry.
+        """
+        delay = retry_delay(error, attempt)
+        remaining = time_left()
+        if delay is None or attempt >= self.max_retries or (remaining is not None and delay >= remaining):
+            return None
+        if not is_rate_limit(error):
+            if attempt >= TRANSIENT_RETRIES:
+                return None
+            print(f"⏳ {'/'.join(key)} failed ({type(error).__name__}), retrying in {delay:.1f}s (attempt {attempt + 1})")
+            return delay
+        print(f"⏳ {'/'.join(key)} is rate limited, retrying in {delay:.1f}s (attempt {attempt + 1})")
+        with self._cond:
+            self._lane(key).bucket.pause(delay)
+            self._cond.notify_all()
+        return 0.0
+
+    def call(self, key: tuple, func):
+        """Runs ``func`` once admitted, retrying rate-limited and transiently failed calls."""
+        attempt = 0
+        while True:
+            self.acquire(key)
+            try:
+                return func()
+            except Exception as e:
+                wait = self._backoff(key, e, attempt)
+                if wait is None:
+                    raise
+            finally:
+                self.release(key)
+            _sleep(wait)
+            attempt += 1
+
+    def stream(self, key: tuple, factory):
+        """
+        Yields from ``factory()`` once admitted.
+
+        The call holds its slot until the stream ends. Retryable errors are
+        retried as long as nothing has been yielded yet.
+        """
+        attempt = 0
+        while True:
+            self.acquire(key)
+            started = False
+            try:
+                for chunk in factory():
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                wait = None if started else self._backoff(key, e, attempt)
+                if wait is None:
+                    raise
+            finally:
+                self.release(key)
+            _sleep(wait)
+            attempt += 1
+
+    async def acall(self, key: tuple, coroutine_factory):
+        """Async variant of ``call``; waiting for admission does not block the event loop."""
+        attempt = 0
+        while True:
+            await asyncio.to_thread(self.acquire, key)
+            try:
+                return await coroutine_factory()
+            except Exception as e:
+                wait = self._backoff(key, e, attempt)
+                if wait is None:
+                    raise
+            finally:
+                self.release(key)
+            await asyncio.sleep(wait)
+            attempt += 1
+
+    async def astream(self, key: tuple, factory):
+        """Async variant of ``stream``."""
+        attempt = 0
+        while True:
+            await asyncio.to_thread(self.acquire, key)
+            started = False
+            try:
+                async for chunk in factory():
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                wait = None if started else self._backoff(key, e, attempt)
+                if wait is None:
+                    raise
+            finally:
+                self.release(key)
+            await asyncio.sleep(wait)
+            attempt += 1
+
+
+def _sleep(seconds: float) -> None:
+    """Waits before a retry; a cancelled run stops waiting at once."""
+    if seconds <= 0:
+        return
+    token = current_token()
+    woken = threading.Event()
+    with token.on_cancel(woken.set) if token is not None else nullcontext():
+        woken.wait(seconds)
+    if token is not None:
+        token.check()
+
+
+def is_rate_limit(error: Exception) -> bool:
+    """Returns True for responses that ask the whole lane to slow down."""
+    from openai import APIStatusError
+
+    # RateLimitError is the 429 APIStatusError; 503 is returned by overloaded providers
+    return isinstance(error, APIStatusError) and error.status_code in (429, 503)
+
+
+def retry_delay(error: Exception, attempt: int):
+    """
+    Returns how long to wait before retrying a failed LLM call, or None if it should not be retried.
+
+    Rate limits, connection errors, timeouts and 408, 409 and 5xx responses are
+    retried, as the OpenAI client does. ``Retry-After`` (seconds or an HTTP date)
+    and ``retry-after-ms`` headers are honored; otherwise the delay grows
+    exponentially with jitter.
+    """
+    # Imported here so the scheduling context can be used without loading the OpenAI client
+    from openai import APIConnectionError, APIStatusError
+
+    # APITimeoutError is an APIConnectionError
+    retryable_status = (isinstance(error, APIStatusError)
+                        and (error.status_code in (408, 409, 429) or error.status_code >= 500))
+    if not (retryable_status or isinstance(error, APIConnectionError)):
+        return None
+
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    retry_after_ms = headers.get("retry-after-ms")
+    retry_after = headers.get("retry-after")
+    try:
+        if retry_after_ms:
+            return float(retry_after_ms) / 1000
+        if retry_after:
+            if retry_after.strip().replace(".", "", 1).isdigit():
+                return float(retry_after)
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return min(2 ** attempt, 30) * (0.5 + random.random() / 2)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    """Returns the process-wide LLM scheduler, created on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler()
+        return _scheduler
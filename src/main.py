@@ -1,18 +1,71 @@
-from fastapi import FastAPI, WebSocket
+# First import, so startup is measured from here (see src.startup)
+from src.startup import load, mark_http_ready, start_warm_up, startup_report
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Header, Request, WebSocket
 from src.websocket_handler import websocket_handler
 from src.rest_api_handler import (
     process_kubernetes_query, 
+    process_kubernetes_batch,
     health_check,
     QueryRequest,
-    QueryResponse
+    QueryResponse,
+    BatchQueryRequest,
+    BatchQueryResponse,
+    JobStatus,
+    JobSubmission,
+    submit_query_job,
+    get_job_status,
+    get_job_result,
+    stream_job_events,
+    rest_client_id,
+    run_until_disconnected
+)
+from src.cancellation import cancellation_stats, install_kubernetes_checks
+from src.llm_scheduler import get_scheduler
+from src.profiling import PROFILE_HEADER
+from src.tracing import instrument_kubernetes
+
+def start_history_recording():
+    # Record cluster changes and usage so "what changed?" questions can be answered later
+    try:
+        # With several workers, the one elected to collect cluster snapshots records for all of them
+        snapshots = load("src.cluster_snapshot")
+        if snapshots.start_snapshot_sharing():
+            print(f"🗂️ Sharing cluster snapshots through {snapshots.snapshot_dir()}")
+        elif load("src.history_store").start_history_recording():
+            print("📼 Recording cluster history")
+    except Exception as e:
+        print(f"⚠️ Cluster history is not recorded: {e}")
+
+# Loaded in the background after the server starts, in this order; requests
+# that need a module before then import it themselves
+WARM_UP = (
+    "kubernetes",
+    # Record a span for every Kubernetes API request made while a trace is active
+    ("instrument_kubernetes", instrument_kubernetes),
+    # Refuse Kubernetes requests of cancelled runs
+    ("cancellable_kubernetes", install_kubernetes_checks),
+    "openai",
+    "langchain_openai",
+    "langchain.agents",
+    "src.langchain_agent",
+    ("history_recording", start_history_recording),
 )
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    mark_http_ready()
+    start_warm_up(WARM_UP)
+    yield
+
 app = FastAPI(
     title="KubeSage API",
     description="AI-powered Kubernetes troubleshooting assistant with WebSocket and REST API support",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # Health check endpoint
@@ -26,11 +79,56 @@ async def health():
     """Health check endpoint."""
     return health_check()
 
+@app.get("/ready", response_model=dict)
+async def ready():
+    """Readiness probe: ready as soon as the API answers, while the agent warms up in the background."""
+    report = startup_report()
+    return {"status": "ready", "warm_up": report["status"], "uptime": report["uptime"]}
+
+@app.get("/api/startup", response_model=dict)
+async def startup():
+    """Startup time broken down by import and warm-up step."""
+    return startup_report()
+
+@app.get("/api/metrics", response_model=dict)
+async def metrics():
+    """Runs in progress and cancelled, and the LLM capacity in use per provider and model."""
+    return {"runs": cancellation_stats(), "llm": get_scheduler().stats()}
+
 # REST API endpoints
+# The agent runs in a worker thread, so the event loop stays free to notice disconnects
 @app.post("/api/query", response_model=QueryResponse)
-async def query_kubernetes(request: QueryRequest):
-    """Process a Kubernetes query using natural language."""
-    return process_kubernetes_query(request)
+async def query_kubernetes(request: QueryRequest, http_request: Request,
+                           profile_token: str = Header(default=None, alias=PROFILE_HEADER)):
+    """Process a Kubernetes query using natural language; stops if the client disconnects."""
+    return await run_until_disconnected(http_request, process_kubernetes_query, request, profile_token,
+                                        client_id=rest_client_id(http_request, request))
+
+@app.post("/api/query/batch", response_model=BatchQueryResponse)
+async def query_kubernetes_batch(batch: BatchQueryRequest):
+    """Process several independent queries concurrently (NDJSON as each finishes when stream is true)."""
+    return await process_kubernetes_batch(batch)
+
+# Background jobs for long-running investigations
+@app.post("/api/jobs", response_model=JobSubmission, status_code=202)
+async def submit_job(request: QueryRequest):
+    """Queue a query as a background job and return its ID."""
+    return submit_query_job(request)
+
+@app.get("/api/jobs/{job_id}", response_model=JobStatus)
+async def job_status(job_id: str):
+    """Get the state of a background job."""
+    return get_job_status(job_id)
+
+@app.get("/api/jobs/{job_id}/result", response_model=QueryResponse)
+async def job_result(job_id: str):
+    """Get the result of a finished background job."""
+    return get_job_result(job_id)
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str, last_event_id: str = Header(default=None, alias="Last-Event-ID")):
+    """Follow the progress of a background job as Server-Sent Events."""
+    return stream_job_events(job_id, last_event_id)
 
 # WebSocket for Live Chat with `kubectl`
 @app.websocket("/ws")
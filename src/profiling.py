@@ -0,0 +1,164 @@
+"""
+On-demand sampling profiler for single query runs.
+
+Profiling is opt-in per request (``X-KubeSage-Profile`` header on REST, the
+``profile <query>`` command on the WebSocket) and is refused unless
+``KUBESAGE_PROFILING_ENABLED`` is set. When ``KUBESAGE_PROFILING_TOKEN`` is set,
+the header value must match it. Nothing runs unless a request asks for it.
+
+A background thread samples the stack of the profiled thread every
+``KUBESAGE_PROFILE_INTERVAL_MS`` milliseconds. The result is a flame graph in
+folded-stack format (readable by speedscope or flamegraph.pl) and a table of
+the hottest functions. When ``KUBESAGE_PROFILE_DIR`` is set, both are written
+to disk and the response carries the file paths instead of the flame graph.
+"""
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+PROFILE_HEADER = "X-KubeSage-Profile"
+
+
+def profiling_allowed(token: str) -> bool:
+    """Checks whether a profiling request is permitted by configuration."""
+    if os.getenv("KUBESAGE_PROFILING_ENABLED", "false").strip().lower() not in ("1", "true", "yes"):
+        return False
+    expected = os.getenv("KUBESAGE_PROFILING_TOKEN")
+    if expected:
+        return hmac.compare_digest(expected, token or "")
+    return True
+
+
+class SamplingProfiler:
+    """Periodically captures the Python stacks of a set of threads."""
+
+    def __init__(self, thread_ids: set = None, interval: float = None):
+        self.thread_ids = thread_ids
+        self.interval = interval if interval is not None else float(os.getenv("KUBESAGE_PROFILE_INTERVAL_MS", "5")) / 1000
+        self.stacks = Counter()
+        self.sample_count = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="kubesage-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.stopped_at = time.perf_counter()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                self.stacks[_stack_of(frame)] += 1
+            self.sample_count += 1
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.stopped_at or time.perf_counter()
+        return (end - self.started_at) * 1000 if self.started_at else 0.0
+
+    def folded(self) -> str:
+        """Returns the samples in folded-stack flame graph format."""
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common())
+
+    def top_functions(self, n: int = 25) -> list:
+        """Returns the N functions with the most samples at the top of the stack."""
+        self_samples = Counter()
+        total_samples = Counter()
+        for stack, count in self.stacks.items():
+            self_samples[stack[-1]] += count
+            for frame in set(stack):
+                total_samples[frame] += count
+
+        total = sum(self.stacks.values()) or 1
+        return [
+            {
+                "function": frame,
+                "self_samples": count,
+                "total_samples": total_samples[frame],
+                "self_percent": round(100 * count / total, 1),
+                "total_percent": round(100 * total_samples[frame] / total, 1),
+            }
+            for frame, count in self_samples.most_common(n)
+        ]
+
+
+def _stack_of(frame) -> tuple:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        name = getattr(code, "co_qualname", code.co_name)
+        stack.append(f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def run_profiled(label: str, func, *args, **kwargs):
+    """
+    Runs ``func`` on the current thread under the sampling profiler.
+
+    Returns:
+        tuple: The function result and the profile report.
+    """
+    profiler = SamplingProfiler(thread_ids={threading.get_ident()})
+    profiler.start()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        profiler.stop()
+    return result, build_report(profiler, label)
+
+
+def build_report(profiler: SamplingProfiler, label: str) -> dict:
+    """Builds the profile report and stores it on disk if KUBESAGE_PROFILE_DIR is set."""
+    report = {
+        "label": label,
+        "duration_ms": round(profiler.duration_ms, 1),
+        "samples": profiler.sample_count,
+        "interval_ms": profiler.interval * 1000,
+        "top_functions": profiler.top_functions(int(os.getenv("KUBESAGE_PROFILE_TOP_N", "25"))),
+    }
+
+    profile_dir = os.getenv("KUBESAGE_PROFILE_DIR")
+    if not profile_dir:
+        report["flamegraph"] = profiler.folded()
+        return report
+
+    os.makedirs(profile_dir, exist_ok=True)
+    base = os.path.join(profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}")
+    with open(base + ".folded", "w", encoding="utf-8") as f:
+        f.write(profiler.folded())
+    with open(base + ".json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    report["flamegraph_path"] = base + ".folded"
+    report["report_path"] = base + ".json"
+    return report
+
+
+def format_top_functions(report: dict) -> str:
+    """Formats the hot-function table of a report as plain text."""
+    lines = [
+        f"🔥 Profile of {report['label']}: {report['duration_ms']} ms, {report['samples']} samples",
+        f"{'self%':>6} {'total%':>7}  function",
+    ]
+    for row in report["top_functions"]:
+        lines.append(f"{row['self_percent']:>6} {row['total_percent']:>7}  {row['function']}")
+    if "flamegraph_path" in report:
+        lines.append(f"Flame graph: {report['flamegraph_path']}")
+    return "\n".join(lines)
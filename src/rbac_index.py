@@ -0,0 +1,219 @@
+"""
+In-memory RBAC index for "can X do Y" and "who can do Y" questions.
+
+Roles, ClusterRoles, RoleBindings and ClusterRoleBindings are kept current by
+informers. Whenever one of them changes, the index is rebuilt on the next
+lookup into grants (subject → binding → role → rule), indexed both by subject
+and by (resource, verb), so questions are answered with dictionary lookups
+instead of scanning every binding.
+
+Subjects are matched the way the API server authorizes them: a ServiceAccount
+also acts as the ``system:serviceaccount:<ns>:<name>`` user and belongs to the
+``system:serviceaccounts``, ``system:serviceaccounts:<ns>`` and
+``system:authenticated`` groups. Aggregated ClusterRoles are used as
+materialized by the controller manager.
+"""
+import threading
+
+from src.cluster_snapshot import get_source
+from src.k8s_informer import sync_timeout
+
+RBAC_PATH = "/apis/rbac.authorization.k8s.io/v1"
+SOURCES = {
+    "roles": f"{RBAC_PATH}/roles",
+    "cluster_roles": f"{RBAC_PATH}/clusterroles",
+    "role_bindings": f"{RBAC_PATH}/rolebindings",
+    "cluster_role_bindings": f"{RBAC_PATH}/clusterrolebindings",
+}
+
+
+def slim_rbac_object(obj: dict) -> dict:
+    """Keeps only the fields the index needs."""
+    metadata = obj.get("metadata") or {}
+    return {
+        "metadata": {"name": metadata.get("name"), "namespace": metadata.get("namespace")},
+        "rules": obj.get("rules") or [],
+        "roleRef": obj.get("roleRef"),
+        "subjects": obj.get("subjects") or [],
+    }
+
+
+class Grant:
+    """A rule granted to a subject through a binding, within a namespace or cluster-wide."""
+
+    __slots__ = ("subject", "scope", "binding", "role", "rule")
+
+    def __init__(self, subject: tuple, scope, binding: str, role: str, rule: dict):
+        self.subject = subject
+        self.scope = scope
+        self.binding = binding
+        self.role = role
+        self.rule = rule
+
+    def to_dict(self) -> dict:
+        kind, namespace, name = self.subject
+        result = {
+            "subject": f"{kind} {namespace}/{name}" if namespace else f"{kind} {name}",
+            "scope": self.scope or "cluster-wide",
+            "binding": self.binding,
+            "role": self.role,
+            "verbs": self.rule.get("verbs", []),
+            "resources": self.rule.get("resources", []),
+        }
+        if self.rule.get("resourceNames"):
+            result["resource_names"] = self.rule["resourceNames"]
+        return result
+
+
+def rule_allows(rule: dict, verb: str, resource: str, api_group: str = None, name: str = None) -> bool:
+    """
+    Checks whether a PolicyRule allows a request.
+
+    ``resource`` may name a subresource ("pods/log"). A rule limited to
+    resourceNames only matches requests for one of those names; with
+    ``name`` None it is reported as a match so callers can show the limitation.
+    """
+    verbs = rule.get("verbs") or []
+    if "*" not in verbs and verb not in verbs:
+        return False
+    if api_group is not None:
+        groups = rule.get("apiGroups") or []
+        if "*" not in groups and api_group not in groups:
+            return False
+    resources = rule.get("resources") or []
+    base, _, subresource = resource.partition("/")
+    if not ("*" in resources or resource in resources or (subresource and f"{base}/*" in resources)):
+        return False
+    names = rule.get("resourceNames")
+    return not (names and name is not None and name not in names)
+
+
+def effective_subjects(kind: str, name: str, namespace: str = None) -> list:
+    """Returns the subject keys a request from this identity is authorized as."""
+    kind = {"serviceaccount": "ServiceAccount", "user": "User", "group": "Group"}.get(kind.lower(), kind)
+    if kind == "Group":
+        return [("Group", "", name)]
+    if kind == "ServiceAccount":
+        return [
+            ("ServiceAccount", namespace or "default", name),
+            ("User", "", f"system:serviceaccount:{namespace or 'default'}:{name}"),
+            ("Group", "", "system:serviceaccounts"),
+            ("Group", "", f"system:serviceaccounts:{namespace or 'default'}"),
+            ("Group", "", "system:authenticated"),
+        ]
+    if name.startswith("system:serviceaccount:") and name.count(":") == 3:
+        _, _, sa_namespace, sa_name = name.split(":")
+        return effective_subjects("ServiceAccount", sa_name, sa_namespace)
+    return [("User", "", name), ("Group", "", "system:authenticated")]
+
+
+class RbacIndex:
+    """Grants indexed by subject and by (resource, verb), rebuilt when RBAC objects change."""
+
+    def __init__(self, sources: dict):
+        self.sources = sources
+        self._versions = None
+        self._by_subject = {}
+        self._by_resource_verb = {}
+        self._lock = threading.Lock()
+
+    def _current(self) -> None:
+        versions = tuple(source.version for source in self.sources.values())
+        if versions == self._versions:
+            return
+        with self._lock:
+            if versions != self._versions:
+                self._build()
+                self._versions = versions
+
+    def _build(self) -> None:
+        roles = {}
+        for role in self.sources["roles"].items():
+            roles[("Role", role["metadata"]["namespace"], role["metadata"]["name"])] = role["rules"]
+        for role in self.sources["cluster_roles"].items():
+            roles[("ClusterRole", "", role["metadata"]["name"])] = role["rules"]
+
+        by_subject, by_resource_verb = {}, {}
+        bindings = [(b, b["metadata"]["namespace"], "RoleBinding") for b in self.sources["role_bindings"].items()]
+        bindings += [(b, None, "ClusterRoleBinding") for b in self.sources["cluster_role_bindings"].items()]
+        for binding, scope, binding_kind in bindings:
+            ref = binding.get("roleRef") or {}
+            role_key = (ref.get("kind"), scope if ref.get("kind") == "Role" else "", ref.get("name"))
+            binding_name = f"{binding_kind} {scope}/{binding['metadata']['name']}" if scope else \
+                f"{binding_kind} {binding['metadata']['name']}"
+            role_name = f"{ref.get('kind')} {ref.get('name')}"
+            for subject in binding["subjects"]:
+                subject_key = (
+                    subject.get("kind"),
+                    (subject.get("namespace") or scope or "") if subject.get("kind") == "ServiceAccount" else "",
+                    subject.get("name"),
+                )
+                for rule in roles.get(role_key, []):
+                    if not rule.get("resources"):
+                        continue  # nonResourceURLs rules
+                    grant = Grant(subject_key, scope, binding_name, role_name, rule)
+                    by_subject.setdefault(subject_key, []).append(grant)
+                    for resource in rule["resources"]:
+                        for verb in rule.get("verbs") or []:
+                            by_resource_verb.setdefault((resource.partition("/")[0], verb), []).append(grant)
+
+        self._by_subject = by_subject
+        self._by_resource_verb = by_resource_verb
+
+    def can(self, subjects: list, verb: str, resource: str, namespace: str = None,
+            api_group: str = None, name: str = None) -> list:
+        """Returns the grants that allow any of ``subjects`` the request; empty if it is denied."""
+        self._current()
+        return [
+            grant
+            for subject in subjects
+            for grant in self._by_subject.get(subject, [])
+            if (grant.scope is None or grant.scope == namespace) and rule_allows(grant.rule, verb, resource, api_group, name)
+        ]
+
+    def who_can(self, verb: str, resource: str, namespace: str = None, api_group: str = None) -> list:
+        """
+        Returns the grants allowing ``verb`` on ``resource``.
+
+        With a namespace, only grants that apply in it (cluster-wide or bound
+        there) are returned; without one, grants in every namespace are.
+        """
+        self._current()
+        base = resource.partition("/")[0]
+        candidates = []
+        for key in ((base, verb), (base, "*"), ("*", verb), ("*", "*")):
+            candidates.extend(self._by_resource_verb.get(key, []))
+
+        seen, grants = set(), []
+        for grant in candidates:
+            if id(grant) in seen:
+                continue
+            seen.add(id(grant))
+            if namespace is not None and grant.scope not in (None, namespace):
+                continue
+            if rule_allows(grant.rule, verb, resource, api_group):
+                grants.append(grant)
+        return grants
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_rbac_index(api_client=None) -> RbacIndex:
+    """
+    Returns the RBAC index of a cluster, starting its informers (or reading the shared snapshots) on first use.
+
+    Raises:
+        TimeoutError: If the RBAC objects are not listed within ``sync_timeout()``.
+    """
+    sources = {name: get_source(path, slim_rbac_object, api_client) for name, path in SOURCES.items()}
+    host = sources["roles"].api_client.configuration.host
+    with _indexes_lock:
+        if host not in _indexes:
+            _indexes[host] = RbacIndex(sources)
+        index = _indexes[host]
+    for source in sources.values():
+        if not source.wait_synced(sync_timeout()):
+            raise TimeoutError(f"RBAC objects from {source.path} are not loaded yet")
+    return index
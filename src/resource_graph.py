@@ -0,0 +1,445 @@
+"""
+In-memory graph of how workloads, pods, services and storage relate.
+
+Informers keep compact records of the objects involved (see ``k8s_records``)
+and report each change to the graph, which updates the indexes of just that
+object. Snapshot sources (see ``cluster_snapshot``) cannot report changes; the
+indexes of a kind are reloaded on the next query when its snapshot changes.
+It links:
+
+- owners to the objects they own (Deployment → ReplicaSet → Pod, CronJob → Job
+  → Pod, StatefulSet/DaemonSet → Pod) by ownerReferences;
+- Services to the Pods their selector matches, through a label index;
+- Services to the readiness of their Endpoints;
+- Pods to the PersistentVolumeClaims they mount, and claims to their volumes.
+
+A single query then returns the whole dependency chain around one object,
+with findings that explain common failures (no ready endpoints, a selector
+matching nothing, pending claims, stalled rollouts).
+"""
+import threading
+from functools import partial
+
+from src.cluster_snapshot import get_source
+from src.k8s_informer import sync_timeout
+from src.k8s_records import (
+    Address, ClaimRecord, EndpointsRecord, ObjectMeta, PodRecord, ServicePort, ServiceRecord, VolumeRecord,
+    WorkloadRecord, intern, pairs, shared,
+)
+
+
+def slim_pod(obj: dict) -> PodRecord:
+    spec, status = obj.get("spec") or {}, obj.get("status") or {}
+    statuses = status.get("containerStatuses") or []
+    reason = None
+    for container_status in statuses:
+        state = container_status.get("state") or {}
+        detail = state.get("waiting") or state.get("terminated")
+        if detail and detail.get("reason"):
+            reason = detail["reason"]
+            break
+    return PodRecord(
+        ObjectMeta.from_json(obj),
+        intern(spec.get("nodeName")),
+        shared(tuple(v["persistentVolumeClaim"].get("claimName") for v in spec.get("volumes") or []
+                     if v.get("persistentVolumeClaim"))),
+        shared(tuple(intern(p.get("name")) for c in spec.get("containers") or [] for p in c.get("ports") or []
+                     if p.get("name"))),
+        intern(status.get("phase")),
+        any(c.get("type") == "Ready" and c.get("status") == "True" for c in status.get("conditions") or []),
+        sum(c.get("restartCount") or 0 for c in statuses),
+        intern(reason or status.get("reason")),
+    )
+
+
+def slim_service(obj: dict) -> ServiceRecord:
+    spec = obj.get("spec") or {}
+    return ServiceRecord(
+        ObjectMeta.from_json(obj),
+        intern(spec.get("type")),
+        pairs(spec.get("selector")),
+        tuple(ServicePort(p.get("name"), p.get("port"), p.get("targetPort")) for p in spec.get("ports") or []),
+    )
+
+
+def slim_endpoints(obj: dict) -> EndpointsRecord:
+    ready, not_ready = [], []
+    for subset in obj.get("subsets") or []:
+        for field, target in (("addresses", ready), ("notReadyAddresses", not_ready)):
+            for address in subset.get(field) or []:
+                target.append(Address(address.get("ip"), (address.get("targetRef") or {}).get("name")))
+    return EndpointsRecord(ObjectMeta.from_json(obj), tuple(ready), tuple(not_ready))
+
+
+def slim_workload(obj: dict) -> WorkloadRecord:
+    spec, status = obj.get("spec") or {}, obj.get("status") or {}
+    template = spec.get("template") or ((spec.get("jobTemplate") or {}).get("spec") or {}).get("template") or {}
+    desired = spec.get("replicas")
+    if desired is None:
+        desired = status.get("desiredNumberScheduled", spec.get("completions"))
+    return WorkloadRecord(
+        ObjectMeta.from_json(obj),
+        desired,
+        status.get("readyReplicas", status.get("numberReady", status.get("ready"))),
+        status.get("availableReplicas", status.get("numberAvailable")),
+        status.get("failed"),
+        shared(tuple(intern(c.get("image")) for c in (template.get("spec") or {}).get("containers") or [])),
+    )
+
+
+def slim_claim(obj: dict) -> ClaimRecord:
+    spec, status = obj.get("spec") or {}, obj.get("status") or {}
+    return ClaimRecord(
+        ObjectMeta.from_json(obj),
+        spec.get("volumeName"),
+        intern(spec.get("storageClassName")),
+        intern(((spec.get("resources") or {}).get("requests") or {}).get("storage")),
+        intern(status.get("phase")),
+    )
+
+
+def slim_volume(obj: dict) -> VolumeRecord:
+    spec, status = obj.get("spec") or {}, obj.get("status") or {}
+    claim = spec.get("claimRef") or {}
+    return VolumeRecord(
+        ObjectMeta.from_json(obj),
+        f"{claim.get('namespace')}/{claim.get('name')}" if claim else None,
+        intern(spec.get("storageClassName")),
+        intern((spec.get("capacity") or {}).get("storage")),
+        intern(status.get("phase")),
+    )
+
+
+# kind -> (collection path, transform)
+SOURCES = {
+    "Pod": ("/api/v1/pods", slim_pod),
+    "Service": ("/api/v1/services", slim_service),
+    "Endpoints": ("/api/v1/endpoints", slim_endpoints),
+    "Deployment": ("/apis/apps/v1/deployments", slim_workload),
+    "ReplicaSet": ("/apis/apps/v1/replicasets", slim_workload),
+    "StatefulSet": ("/apis/apps/v1/statefulsets", slim_workload),
+    "DaemonSet": ("/apis/apps/v1/daemonsets", slim_workload),
+    "Job": ("/apis/batch/v1/jobs", slim_workload),
+    "CronJob": ("/apis/batch/v1/cronjobs", slim_workload),
+    "PersistentVolumeClaim": ("/api/v1/persistentvolumeclaims", slim_claim),
+    "PersistentVolume": ("/api/v1/persistentvolumes", slim_volume),
+}
+
+KIND_ALIASES = {
+    "Pod": ("pod", "pods", "po"),
+    "Service": ("service", "services", "svc"),
+    "Deployment": ("deployment", "deployments", "deploy"),
+    "ReplicaSet": ("replicaset", "replicasets", "rs"),
+    "StatefulSet": ("statefulset", "statefulsets", "sts"),
+    "DaemonSet": ("daemonset", "daemonsets", "ds"),
+    "Job": ("job", "jobs"),
+    "CronJob": ("cronjob", "cronjobs", "cj"),
+    "PersistentVolumeClaim": ("persistentvolumeclaim", "persistentvolumeclaims", "pvc"),
+    "PersistentVolume": ("persistentvolume", "persistentvolumes", "pv"),
+}
+
+WORKLOAD_KINDS = ("Deployment", "ReplicaSet", "StatefulSet", "DaemonSet", "Job", "CronJob")
+
+
+def normalize_kind(kind: str):
+    """Returns the graph kind for a kind, plural or short name, or None if it is not part of the graph."""
+    key = kind.strip().lower()
+    for graph_kind, aliases in KIND_ALIASES.items():
+        if key in aliases:
+            return graph_kind
+    return None
+
+
+class ResourceGraph:
+    """Relationship indexes over the watched objects, updated as they change."""
+
+    def __init__(self, sources: dict):
+        self.sources = sources
+        # kind -> version of the source last loaded, for sources that cannot report changes
+        self._versions = {}
+        self._listening = set()
+        self._lock = threading.Lock()
+        self._objects = {}
+        self._by_uid = {}
+        self._children = {}
+        self._pods_by_label = {}
+        self._pods_by_claim = {}
+        self._services_by_namespace = {}
+
+    def _current(self) -> None:
+        """Loads the kinds that are not indexed yet or whose snapshot changed; the caller holds ``_lock``."""
+        for kind, source in self.sources.items():
+            if kind in self._listening:
+                continue
+            if hasattr(source, "add_listener"):
+                # Changes made while the objects are loaded are applied after them, and converge
+                source.add_listener(partial(self._on_change, kind))
+                self._listening.add(kind)
+                self._load(kind, source.items())
+                continue
+            version = source.version
+            if kind not in self._versions or version != self._versions[kind]:
+                self._load(kind, source.items())
+                self._versions[kind] = version
+
+    def _on_change(self, kind: str, event_type: str, old, new) -> None:
+        with self._lock:
+            if old is not None:
+                self._remove(kind, old)
+            if new is not None:
+                self._add(kind, new)
+
+    def _load(self, kind: str, items: list) -> None:
+        for obj in [obj for key, obj in self._objects.items() if key[0] == kind]:
+            self._remove(kind, obj)
+        for obj in items:
+            self._add(kind, obj)
+
+    def _add(self, kind: str, obj) -> None:
+        metadata = obj.metadata
+        key = (kind, metadata.namespace or "", metadata.name)
+        self._objects[key] = obj
+        if metadata.uid:
+            self._by_uid[metadata.uid] = key
+        for owner in metadata.owners:
+            self._children.setdefault(owner.uid, set()).add(key)
+        if kind == "Pod":
+            for label in metadata.labels:
+                self._pods_by_label.setdefault((key[1], label), set()).add(key)
+            for claim in obj.claims:
+                self._pods_by_claim.setdefault((key[1], claim), set()).add(key)
+        elif kind == "Service":
+            self._services_by_namespace.setdefault(key[1], set()).add(key)
+
+    def _remove(self, kind: str, obj) -> None:
+        metadata = obj.metadata
+        key = (kind, metadata.namespace or "", metadata.name)
+        self._objects.pop(key, None)
+        if metadata.uid and self._by_uid.get(metadata.uid) == key:
+            del self._by_uid[metadata.uid]
+        for owner in metadata.owners:
+            _discard(self._children, owner.uid, key)
+        if kind == "Pod":
+            for label in metadata.labels:
+                _discard(self._pods_by_label, (key[1], label), key)
+            for claim in obj.claims:
+                _discard(self._pods_by_claim, (key[1], claim), key)
+        elif kind == "Service":
+            _discard(self._services_by_namespace, key[1], key)
+
+    # ------------------------------
+    # Edges
+    # ------------------------------
+
+    def selected_pods(self, namespace: str, selector: tuple) -> list:
+        """Returns the pods of a namespace whose labels match every (key, value) pair of ``selector``."""
+        if not selector:
+            return []
+        candidates = sorted((self._pods_by_label.get((namespace, label), set()) for label in selector), key=len)
+        return sorted(set.intersection(*candidates))
+
+    def owner_chain(self, key: tuple) -> list:
+        """Returns the owners of an object, nearest first."""
+        chain, seen = [], {key}
+        while True:
+            owners = self._objects[key].metadata.owners
+            owner_key = next((self._by_uid[o.uid] for o in owners if o.uid in self._by_uid), None)
+            if owner_key is None or owner_key in seen:
+                return chain
+            chain.append(owner_key)
+            seen.add(owner_key)
+            key = owner_key
+
+    def descendants(self, key: tuple) -> list:
+        uid = self._objects[key].metadata.uid
+        result, stack = [], list(self._children.get(uid, []))
+        while stack:
+            child = stack.pop()
+            result.append(child)
+            stack.extend(self._children.get(self._objects[child].metadata.uid, []))
+        return result
+
+    def services_for(self, pods: list) -> list:
+        pod_set = set(pods)
+        namespaces = {pod[1] for pod in pods}
+        return sorted(
+            key for namespace in namespaces for key in self._services_by_namespace.get(namespace, ())
+            if pod_set.intersection(self.selected_pods(namespace, self._objects[key].selector))
+        )
+
+    # ------------------------------
+    # Queries
+    # ------------------------------
+
+    def query(self, kind: str, namespace: str, name: str) -> dict:
+        """
+        Returns the dependency chain around one object.
+
+        Raises:
+            KeyError: If the object does not exist.
+        """
+        with self._lock:
+            self._current()
+            return self._query(kind, namespace, name)
+
+    def _query(self, kind: str, namespace: str, name: str) -> dict:
+        namespace = "" if kind == "PersistentVolume" else (namespace or "default")
+        root = (kind, namespace, name)
+        if root not in self._objects:
+            raise KeyError(f"{kind} {namespace + '/' if namespace else ''}{name} not found")
+        obj = self._objects[root]
+        findings = []
+
+        if kind == "Service":
+            pods = self.selected_pods(namespace, obj.selector)
+            services = [root]
+        elif kind == "Pod":
+            pods = [root]
+        elif kind in WORKLOAD_KINDS:
+            pods = sorted(key for key in self.descendants(root) if key[0] == "Pod")
+        elif kind == "PersistentVolumeClaim":
+            pods = sorted(self._pods_by_claim.get((namespace, name), []))
+        else:
+            claim_namespace, _, claim_name = (obj.claim or "/").partition("/")
+            pods = sorted(self._pods_by_claim.get((claim_namespace, claim_name), []))
+        if kind != "Service":
+            services = self.services_for(pods)
+
+        workloads = {}
+        for pod in pods:
+            for owner in self.owner_chain(pod):
+                workloads[owner] = self._objects[owner]
+        if kind in WORKLOAD_KINDS:
+            workloads[root] = obj
+            for owner in self.owner_chain(root):
+                workloads[owner] = self._objects[owner]
+
+        result = {
+            "root": {"kind": kind, "namespace": namespace or None, "name": name},
+            "workloads": [self._workload_summary(key, findings) for key in sorted(workloads)],
+            "pods": [self._pod_summary(key, findings) for key in pods],
+            "services": [self._service_summary(key, findings) for key in services],
+            "volumes": self._volumes(pods, root, findings),
+        }
+        if not pods and kind != "PersistentVolume":
+            findings.insert(0, f"No pods are related to {kind} {name}")
+        result["findings"] = findings
+        return result
+
+    def _workload_summary(self, key: tuple, findings: list) -> dict:
+        obj = self._objects[key]
+        summary = {"ref": f"{key[0]}/{key[2]}", "namespace": key[1],
+                   "owners": [f"{k}/{n}" for k, _, n in self.owner_chain(key)]}
+        for field in ("desired", "ready", "available", "failed"):
+            if getattr(obj, field) is not None:
+                summary[field] = getattr(obj, field)
+        if key[0] in ("Deployment", "StatefulSet", "DaemonSet") and obj.desired and (obj.ready or 0) < obj.desired:
+            findings.append(f"{key[0]} {key[2]} has {obj.ready or 0}/{obj.desired} ready replicas")
+        if key[0] == "Deployment":
+            active = [k for k in self.descendants(key) if k[0] == "ReplicaSet" and self._objects[k].desired]
+            if len(active) > 1:
+                findings.append(f"Deployment {key[2]} has {len(active)} ReplicaSets with replicas: a rollout is in progress")
+        return summary
+
+    def _pod_summary(self, key: tuple, findings: list) -> dict:
+        pod = self._objects[key]
+        if not pod.ready and pod.phase != "Succeeded":
+            detail = f" ({pod.reason})" if pod.reason else ""
+            findings.append(f"Pod {key[2]} is not ready: {pod.phase}{detail}, {pod.restarts} restarts")
+        return {
+            "name": key[2],
+            "namespace": key[1],
+            "phase": pod.phase,
+            "ready": pod.ready,
+            "restarts": pod.restarts,
+            "reason": pod.reason,
+            "node": pod.node,
+            "owners": [f"{k}/{n}" for k, _, n in self.owner_chain(key)],
+        }
+
+    def _service_summary(self, key: tuple, findings: list) -> dict:
+        service = self._objects[key]
+        endpoints = self._objects.get(("Endpoints", key[1], key[2]))
+        pods = self.selected_pods(key[1], service.selector)
+        summary = {
+            "name": key[2],
+            "namespace": key[1],
+            "type": service.type,
+            "selector": dict(service.selector),
+            "ports": [port.to_dict() for port in service.ports],
+            "selected_pods": len(pods),
+            "ready_endpoints": [a.pod or a.ip for a in endpoints.ready] if endpoints else [],
+            "not_ready_endpoints": [a.pod or a.ip for a in endpoints.not_ready] if endpoints else [],
+        }
+        if not service.selector:
+            findings.append(f"Service {key[2]} has no selector; its endpoints are managed outside Kubernetes")
+        elif not pods:
+            findings.append(f"Service {key[2]} selector {summary['selector']} matches no pods in {key[1]}")
+        if service.selector and not summary["ready_endpoints"]:
+            findings.append(f"Service {key[2]} has no ready endpoints: requests to it fail (e.g. 503 from an ingress)")
+        named_ports = {name for pod in pods for name in self._objects[pod].ports}
+        for port in service.ports:
+            if pods and isinstance(port.target_port, str) and port.target_port not in named_ports:
+                findings.append(f"Service {key[2]} targets port '{port.target_port}', which no selected pod names")
+        return summary
+
+    def _volumes(self, pods: list, root: tuple, findings: list) -> list:
+        claims = {(pod[1], claim) for pod in pods for claim in self._objects[pod].claims}
+        if root[0] == "PersistentVolumeClaim":
+            claims.add(root[1:])
+        elif root[0] == "PersistentVolume" and self._objects[root].claim:
+            claims.add(tuple(self._objects[root].claim.split("/", 1)))
+
+        volumes = []
+        for namespace, claim_name in sorted(claims):
+            claim = self._objects.get(("PersistentVolumeClaim", namespace, claim_name))
+            if claim is None:
+                findings.append(f"PersistentVolumeClaim {namespace}/{claim_name} is mounted but does not exist")
+                volumes.append({"claim": f"{namespace}/{claim_name}", "phase": "Missing"})
+                continue
+            volume = self._objects.get(("PersistentVolume", "", claim.volume)) if claim.volume else None
+            if claim.phase != "Bound":
+                findings.append(f"PersistentVolumeClaim {namespace}/{claim_name} is {claim.phase}")
+            volumes.append({
+                "claim": f"{namespace}/{claim_name}",
+                "phase": claim.phase,
+                "storage_class": claim.storage_class,
+                "requested": claim.requested,
+                "volume": claim.volume,
+                "volume_phase": volume.phase if volume else None,
+                "capacity": volume.capacity if volume else None,
+                "used_by": [pod[2] for pod in sorted(self._pods_by_claim.get((namespace, claim_name), ()))],
+            })
+        return volumes
+
+
+def _discard(index: dict, key, value) -> None:
+    """Removes ``value`` from the set at ``index[key]``, dropping the set once it is empty."""
+    values = index.get(key)
+    if values is not None:
+        values.discard(value)
+        if not values:
+            del index[key]
+
+
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+
+def get_resource_graph(api_client=None) -> ResourceGraph:
+    """
+    Returns the relationship graph of a cluster, starting its informers (or reading the shared snapshots) on first use.
+
+    Raises:
+        TimeoutError: If the objects are not listed within ``sync_timeout()``.
+    """
+    sources = {kind: get_source(path, transform, api_client) for kind, (path, transform) in SOURCES.items()}
+    host = sources["Pod"].api_client.configuration.host
+    with _graphs_lock:
+        if host not in _graphs:
+            _graphs[host] = ResourceGraph(sources)
+        graph = _graphs[host]
+    for source in sources.values():
+        if not source.wait_synced(sync_timeout()):
+            raise TimeoutError(f"Objects from {source.path} are not loaded yet")
+    return graph
@@ -1,55 +1,407 @@
+import asyncio
+import json
+import os
+import sys
+import time
 import traceback
+import uuid
+from typing import List, Optional
 from fastapi import HTTPException
-from pydantic import BaseModel
-from openai import RateLimitError, AuthenticationError
-from src.langchain_agent import process_query
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from src.cancellation import CancellationToken, DeadlineExceeded, RunCancelled, budget, cancellable, run_cancellable
+from src.jobs import FINISHED, JobProgressHandler, JobQueueFull, get_job_manager, job_max_iterations, job_timeout
+from src.llm_scheduler import BACKGROUND, INTERACTIVE, scheduling
+from src.profiling import profiling_allowed, run_profiled
+from src.startup import load
+from src.timings import build_timings
+from src.tracing import collect_spans, start_span
+
+
+# The agent, with LangChain and the OpenAI and Kubernetes clients, is imported on
+# first use (or by the startup warm-up), so the API can answer before it is loaded
+def ensure_initialized(model_name: str) -> None:
+    load("src.langchain_agent").ensure_initialized(model_name)
+
+
+def process_query(*args, **kwargs):
+    return load("src.langchain_agent").process_query(*args, **kwargs)
 
 
 class QueryRequest(BaseModel):
     """Request model for processing queries."""
     query: str
     model_name: str = "openai/gpt-4o"
+    include_timings: bool = False
+    # Conversation the query continues; queries without one share the "default" session
+    session_id: Optional[str] = Field(default=None, max_length=128)
+    # Time and agent-iteration budget; when either runs out the agent answers with what it found
+    # (defaults: KUBESAGE_QUERY_TIMEOUT_SECONDS, KUBESAGE_MAX_ITERATIONS)
+    timeout_seconds: Optional[float] = Field(default=None, gt=0, le=3600)
+    max_iterations: Optional[int] = Field(default=None, ge=1, le=100)
+
+
+class StepTiming(BaseModel):
+    """Latency, token usage and Kubernetes traffic of one agent step."""
+    step: int
+    tool: Optional[str] = None
+    tool_wall_ms: float = 0.0
+    k8s_bytes: int = 0
+    k8s_requests: int = 0
+    llm_latency_ms: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+class TimingTotals(BaseModel):
+    """Totals over all steps of a query."""
+    wall_ms: float
+    llm_calls: int
+    llm_latency_ms: float
+    tool_calls: int
+    tool_wall_ms: float
+    prompt_tokens: int
+    completion_tokens: int
+    k8s_bytes: int
+    k8s_requests: int
+
+
+class QueryTimings(BaseModel):
+    """Per-step latency and token breakdown of a query."""
+    steps: List[StepTiming]
+    totals: TimingTotals
 
 
 class QueryResponse(BaseModel):
     """Response model for query operations."""
     status: str
-    output: str = None
-    error: str = None
+    output: Optional[str] = None
+    error: Optional[str] = None
+    profile: Optional[dict] = None
+    timings: Optional[QueryTimings] = None
 
 
-def process_kubernetes_query(request: QueryRequest) -> QueryResponse:
-    """Process a Kubernetes query using the LangChain agent."""
-    try:
-        # Process the query with specified model
-        response = process_query(request.query, request.model_name)
-        
-        return QueryResponse(
-            status="success",
-            output=str(response.get('output', ''))
-        )
-    except ValueError as e:
-        raise HTTPException(
+class BatchQueryRequest(BaseModel):
+    """Request model for running several independent queries concurrently."""
+    queries: List[QueryRequest]
+    max_concurrency: Optional[int] = None
+    stream: bool = False
+
+
+class BatchQueryResult(QueryResponse):
+    """Result of one query of a batch."""
+    index: int
+    status_code: int = 200
+
+
+class BatchQueryResponse(BaseModel):
+    """Response model for batch queries."""
+    status: str
+    results: List[BatchQueryResult]
+    wall_ms: float
+
+
+def _http_error(e: Exception) -> HTTPException:
+    """Maps an agent error to the HTTP error returned to the client."""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, DeadlineExceeded):
+        return HTTPException(status_code=504, detail=str(e))
+    if isinstance(e, RunCancelled):
+        # 499: the client closed the request (nginx convention); nobody is left to read it
+        return HTTPException(status_code=499, detail=str(e))
+    if isinstance(e, ValueError):
+        return HTTPException(
             status_code=400,
             detail=f"❌ Configuration error: {str(e)}"
         )
-    except AuthenticationError:
-        raise HTTPException(
+    # An error raised by the OpenAI client means the client is already loaded
+    errors = sys.modules.get("openai")
+    if errors is not None and isinstance(e, errors.AuthenticationError):
+        return HTTPException(
             status_code=401,
             detail="❌ Invalid API Key! Please check your OPENROUTER_API_KEY environment variable."
         )
-    except RateLimitError:
-        raise HTTPException(
+    if errors is not None and isinstance(e, errors.RateLimitError):
+        return HTTPException(
             status_code=429,
             detail="⚠️ You exceeded your quota, please check your plan and billing details."
         )
-    except Exception as e:
-        print(traceback.format_exc())
+    print(traceback.format_exc())
+    return HTTPException(
+        status_code=500,
+        detail=f"❌ An unexpected error occurred: {str(e)}"
+    )
+
+
+class JobSubmission(BaseModel):
+    """Response model for a submitted job."""
+    job_id: str
+    status: str
+    status_url: str
+    result_url: str
+    events_url: str
+
+
+class JobStatus(BaseModel):
+    """State of a background job."""
+    job_id: str
+    status: str
+    description: str
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    events: int
+    error: Optional[str] = None
+
+
+# Headers set by authenticating proxies (oauth2-proxy, Pomerium, ...) in front of the API
+IDENTITY_HEADERS = ("x-forwarded-user", "x-auth-request-user", "x-forwarded-email", "x-auth-request-email")
+
+
+def rest_client_id(http_request, request: QueryRequest) -> str:
+    """
+    Returns the client that a REST query's LLM calls are queued under for fairness.
+
+    The user named by an authenticating proxy comes first, then the query's
+    session, then the original client address from ``X-Forwarded-For`` and
+    finally the peer address, which behind a proxy is the same for everyone.
+    """
+    for header in IDENTITY_HEADERS:
+        if http_request.headers.get(header):
+            return f"user-{http_request.headers[header]}"
+    if request.session_id:
+        return f"session-{request.session_id}"
+    forwarded = http_request.headers.get("x-forwarded-for", "").split(",")[0].strip()
+    if forwarded:
+        return forwarded
+    return http_request.client.host if http_request.client else "rest"
+
+
+def process_kubernetes_query(request: QueryRequest, profile_token: str = None,
+                             use_memory: bool = True, callbacks: list = None,
+                             client_id: str = None) -> QueryResponse:
+    """
+    Process a Kubernetes query using the LangChain agent.
+
+    Args:
+        request: The query request
+        profile_token: Value of the profiling header; when set, the run is profiled
+        use_memory: Whether the query reads and extends the conversation history
+        callbacks: Additional LangChain callbacks for the agent run
+        client_id: When set, the query's LLM calls are queued as interactive calls of this client
+    """
+    if client_id is not None:
+        with scheduling(INTERACTIVE, client_id):
+            return process_kubernetes_query(request, profile_token, use_memory, callbacks)
+
+    if profile_token is not None and not profiling_allowed(profile_token):
         raise HTTPException(
-            status_code=500,
-            detail=f"❌ An unexpected error occurred: {str(e)}"
+            status_code=403,
+            detail="❌ Profiling is not enabled or the profiling token is invalid."
         )
 
+    spans = [] if request.include_timings else None
+    limits = budget(request.timeout_seconds, request.max_iterations)
+    with limits, collect_spans(spans), start_span("POST /api/query", {
+        "kubesage.query.size": len(request.query),
+        "gen_ai.request.model": request.model_name,
+    }, kind="server") as span:
+        try:
+            # Process the query with specified model
+            profile = None
+            if profile_token is None:
+                response = process_query(request.query, request.model_name, use_memory, callbacks,
+                                         request.session_id)
+            else:
+                response, profile = run_profiled(
+                    "POST /api/query", process_query, request.query, request.model_name, use_memory, callbacks,
+                    request.session_id
+                )
+            output = str(response.get('output', ''))
+            span.set_attribute("kubesage.output.size", len(output))
+
+            return QueryResponse(
+                status="success",
+                output=output,
+                profile=profile,
+                timings=build_timings(spans, span) if spans is not None else None
+            )
+        except Exception as e:
+            raise _http_error(e)
+
+
+async def run_until_disconnected(http_request, func, *args, **kwargs):
+    """
+    Runs ``func`` in a worker thread, cancelling it if the client disconnects first.
+
+    The run stops at its next LLM call, tool call or Kubernetes request (see
+    ``src.cancellation``), and its HTTPException is raised here.
+    """
+    token = CancellationToken(f"{http_request.method} {http_request.url.path}")
+    task = asyncio.ensure_future(asyncio.to_thread(run_cancellable, token, func, *args, **kwargs))
+    while not task.done():
+        await asyncio.wait({task}, timeout=0.5)
+        if not task.done() and await http_request.is_disconnected():
+            token.cancel("client disconnected")
+            break
+    return await task
+
+
+def _run_batch_item(index: int, request: QueryRequest, cache, batch_id: str, token) -> BatchQueryResult:
+    with load("src.k8s_utils").shared_lists(cache), scheduling(BACKGROUND, batch_id), cancellable(token):
+        try:
+            response = process_kubernetes_query(request, use_memory=False)
+            return BatchQueryResult(index=index, **response.model_dump())
+        except HTTPException as e:
+            return BatchQueryResult(index=index, status="error", error=e.detail, status_code=e.status_code)
+
+
+async def iter_batch_results(batch: BatchQueryRequest):
+    """
+    Runs the queries of a batch concurrently and yields each result as it finishes.
+
+    At most ``max_concurrency`` queries (capped by ``KUBESAGE_BATCH_CONCURRENCY``)
+    run at a time. The queries share one list cache, so a list fetched by one
+    query is reused by the others instead of being requested again.
+    """
+    limit = int(os.getenv("KUBESAGE_BATCH_CONCURRENCY", "4"))
+    if batch.max_concurrency:
+        limit = max(1, min(batch.max_concurrency, limit))
+    semaphore = asyncio.Semaphore(limit)
+    cache = load("src.k8s_utils").ListCache()
+    # All queries of a batch form one client of the LLM scheduler, behind interactive queries
+    batch_id = f"batch-{uuid.uuid4().hex[:8]}"
+    # Cancelled when the results are no longer read, e.g. when a streaming client disconnects
+    token = CancellationToken(batch_id)
+
+    async def run(index, request):
+        async with semaphore:
+            return await asyncio.to_thread(_run_batch_item, index, request, cache, batch_id, token)
+
+    tasks = [asyncio.create_task(run(index, request)) for index, request in enumerate(batch.queries)]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            yield await next_result
+    finally:
+        if not all(task.done() for task in tasks):
+            token.cancel("batch abandoned")
+        for task in tasks:
+            task.cancel()
+
+
+async def process_kubernetes_batch(batch: BatchQueryRequest):
+    """
+    Process several independent Kubernetes queries concurrently.
+
+    Queries in a batch do not use the conversation history. With ``stream``
+    set, results are sent as newline-delimited JSON in completion order;
+    otherwise they are returned together, in request order.
+    """
+    max_queries = int(os.getenv("KUBESAGE_BATCH_MAX_QUERIES", "50"))
+    if not batch.queries:
+        raise HTTPException(status_code=400, detail="❌ A batch must contain at least one query.")
+    if len(batch.queries) > max_queries:
+        raise HTTPException(status_code=400, detail=f"❌ A batch may contain at most {max_queries} queries.")
+    models = {request.model_name for request in batch.queries}
+    if len(models) > 1:
+        raise HTTPException(status_code=400, detail="❌ All queries in a batch must use the same model.")
+
+    # Initialize once up front so concurrent queries never race to (re)initialize the agent
+    try:
+        await asyncio.to_thread(ensure_initialized, models.pop())
+    except Exception as e:
+        raise _http_error(e)
+
+    if batch.stream:
+        async def lines():
+            async for result in iter_batch_results(batch):
+                yield result.model_dump_json() + "\n"
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    started = time.perf_counter()
+    results = [result async for result in iter_batch_results(batch)]
+    results.sort(key=lambda result: result.index)
+    succeeded = sum(result.status == "success" for result in results)
+    return BatchQueryResponse(
+        status="success" if succeeded == len(results) else "partial" if succeeded else "error",
+        results=results,
+        wall_ms=round((time.perf_counter() - started) * 1000, 1),
+    )
+
+
+def submit_query_job(request: QueryRequest) -> JobSubmission:
+    """
+    Queues a query as a background job and returns immediately.
+
+    Jobs do not use the conversation history. Without ``timeout_seconds`` and
+    ``max_iterations`` they get the job budget (see ``src.jobs``). The result
+    is kept for ``KUBESAGE_JOB_TTL_SECONDS`` after the job finishes.
+    """
+    def run(job):
+        limits = budget(request.timeout_seconds or job_timeout(), request.max_iterations or job_max_iterations())
+        try:
+            with scheduling(BACKGROUND, f"job-{job.id}"), limits:
+                return process_kubernetes_query(request, use_memory=False, callbacks=[JobProgressHandler(job)])
+        except HTTPException as e:
+            raise RuntimeError(e.detail)
+
+    try:
+        job = get_job_manager().submit(run, description=request.query[:200])
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=f"⚠️ Too many jobs in progress: {str(e)}. Retry later.")
+
+    base = f"/api/jobs/{job.id}"
+    return JobSubmission(job_id=job.id, status=job.status, status_url=base,
+                         result_url=f"{base}/result", events_url=f"{base}/events")
+
+
+def _get_job(job_id: str):
+    job = get_job_manager().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"❌ Job {job_id} not found or expired.")
+    return job
+
+
+def get_job_status(job_id: str) -> JobStatus:
+    """Returns the state of a background job."""
+    return JobStatus(**_get_job(job_id).to_dict())
+
+
+def get_job_result(job_id: str) -> QueryResponse:
+    """Returns the result of a finished job; 409 while it is still queued or running."""
+    job = _get_job(job_id)
+    if job.status not in FINISHED:
+        raise HTTPException(status_code=409, detail=f"⏳ Job {job_id} is still {job.status}.")
+    if job.error is not None:
+        return QueryResponse(status="error", error=job.error)
+    return job.result
+
+
+def stream_job_events(job_id: str, last_event_id: str = None) -> StreamingResponse:
+    """
+    Streams the progress events of a job as Server-Sent Events until it finishes.
+
+    Clients that reconnect with ``Last-Event-ID`` resume after that event.
+    """
+    job = _get_job(job_id)
+    cursor = int(last_event_id) + 1 if last_event_id and last_event_id.isdigit() else 0
+
+    async def events():
+        nonlocal cursor
+        while True:
+            new_events = await job.next_events(cursor, 15)
+            if not new_events:
+                yield ": keep-alive\n\n"
+                continue
+            for event in new_events:
+                yield f"id: {cursor}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+                cursor += 1
+                if event["type"] in FINISHED:
+                    return
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 
 def health_check() -> dict:
     """Health check endpoint."""
@@ -0,0 +1,83 @@
+"""
+ChatOpenAI whose calls go through the LLM scheduler.
+
+Kept apart from ``src.llm_scheduler`` so that setting the scheduling context
+(priority and client of a request) does not import LangChain or the OpenAI client.
+"""
+from typing import Optional
+
+from langchain_core.language_models.chat_models import generate_from_stream
+from langchain_openai import ChatOpenAI
+
+from src.cancellation import current_token, time_left
+from src.llm_scheduler import get_scheduler
+
+
+class ScheduledChatOpenAI(ChatOpenAI):
+    """ChatOpenAI whose requests are admitted by the LLM scheduler."""
+
+    provider: str = "openrouter"
+    # The scheduler retries rate limits, connection errors, timeouts and 5xx responses,
+    # pausing the whole lane on rate limits, so the client does not retry on its own
+    max_retries: Optional[int] = 0
+
+    @property
+    def scheduler_key(self) -> tuple:
+        return (self.provider, self.model_name)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        token = current_token()
+        if token is not None and not self.streaming:
+            # Streamed inside a cancellable run, so cancelling closes the response between chunks
+            chunks = self._stream(messages, stop=stop, run_manager=run_manager, stream_usage=True, **kwargs)
+            return _with_token_usage(generate_from_stream(token.guard(chunks)), self.model_name)
+        parent = super(ScheduledChatOpenAI, self)
+        return get_scheduler().call(
+            self.scheduler_key,
+            lambda: parent._generate(messages, stop=stop, run_manager=run_manager, **_bounded(kwargs)),
+        )
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        parent = super(ScheduledChatOpenAI, self)
+        yield from get_scheduler().stream(
+            self.scheduler_key,
+            lambda: parent._stream(messages, stop=stop, run_manager=run_manager, **_bounded(kwargs)),
+        )
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        parent = super(ScheduledChatOpenAI, self)
+        return await get_scheduler().acall(
+            self.scheduler_key,
+            lambda: parent._agenerate(messages, stop=stop, run_manager=run_manager, **_bounded(kwargs)),
+        )
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        parent = super(ScheduledChatOpenAI, self)
+        async for chunk in get_scheduler().astream(
+            self.scheduler_key,
+            lambda: parent._astream(messages, stop=stop, run_manager=run_manager, **_bounded(kwargs)),
+        ):
+            yield chunk
+
+
+def _bounded(kwargs: dict) -> dict:
+    """Adds the time left in the run's budget, when the call is admitted, as its request timeout."""
+    remaining = time_left()
+    if remaining is None:
+        return kwargs
+    timeout = kwargs.get("timeout")
+    return {**kwargs, "timeout": remaining if timeout is None else min(timeout, remaining)}
+
+
+def _with_token_usage(result, model_name: str):
+    """Reports the usage of a streamed response in ``llm_output``, as for a non-streamed one."""
+    usage = getattr(result.generations[0].message, "usage_metadata", None) or {}
+    result.llm_output = {
+        "token_usage": {
+            "prompt_tokens": usage.get("input_tokens", 0),
+            "completion_tokens": usage.get("output_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0),
+        },
+        "model_name": model_name,
+    }
+    return result
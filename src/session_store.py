@@ -0,0 +1,262 @@
+"""
+Session state kept outside the process, so any replica can serve any session.
+
+Conversation memory and per-session tool caches are stored under the session
+ID in the backend selected by ``KUBESAGE_SESSION_STORE``:
+
+- ``memory`` (default): in this process only, for a single replica;
+- ``sqlite:///path/to/sessions.db``: a database file shared by the processes
+  of a host, or by replicas mounting the same volume;
+- ``redis://[[user]:password@]host[:port][/db]`` (or ``rediss://`` for TLS):
+  any server speaking the Redis protocol (Redis, Valkey, KeyDB, Dragonfly).
+
+Values are stored as JSON, compressed with zlib above ``COMPRESS_ABOVE``
+bytes. They expire ``KUBESAGE_SESSION_TTL_SECONDS`` after their last write.
+"""
+import os
+import socket
+import sqlite3
+import ssl
+import threading
+import time
+import zlib
+from urllib.parse import unquote, urlsplit
+
+from src import k8s_json
+
+DEFAULT_SESSION = "default"
+COMPRESS_ABOVE = 1024
+KEY_PREFIX = "kubesage:session:"
+
+_PLAIN, _COMPRESSED = b"j", b"z"
+
+
+def session_ttl() -> float:
+    """Seconds session state is kept after its last write (``KUBESAGE_SESSION_TTL_SECONDS``)."""
+    return float(os.getenv("KUBESAGE_SESSION_TTL_SECONDS", str(24 * 3600)))
+
+
+def encode(value) -> bytes:
+    """Serializes a JSON-compatible value, compressing large ones."""
+    data = k8s_json.dumps(value).encode("utf-8")
+    if len(data) > COMPRESS_ABOVE:
+        return _COMPRESSED + zlib.compress(data, 6)
+    return _PLAIN + data
+
+
+def decode(data: bytes):
+    """Reverses ``encode``."""
+    if data[:1] == _COMPRESSED:
+        return k8s_json.loads(zlib.decompress(data[1:]))
+    return k8s_json.loads(data[1:])
+
+
+class MemorySessionStore:
+    """Session state in this process."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                return None
+            return entry[1]
+
+    def set(self, key: str, data: bytes, ttl: float) -> None:
+        now = time.time()
+        with self._lock:
+            self._entries[key] = (now + ttl, data)
+            if now >= self._next_purge:
+                self._next_purge = now + 60
+                for expired in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+                    del self._entries[expired]
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class SqliteSessionStore:
+    """Session state in an SQLite database file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (key TEXT PRIMARY KEY, expires REAL NOT NULL, data BLOB NOT NULL)"
+        )
+
+    def get(self, key: str):
+        with self._lock:
+            row = self._db.execute("SELECT data FROM sessions WHERE key = ? AND expires > ?",
+                                   (key, time.time())).fetchone()
+        return bytes(row[0]) if row else None
+
+    def set(self, key: str, data: bytes, ttl: float) -> None:
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", (key, now + ttl, data))
+            if now >= self._next_purge:
+                self._next_purge = now + 60
+                self._db.execute("DELETE FROM sessions WHERE expires <= ?", (now,))
+
+    def delete(self, key: str) -> None:
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM sessions WHERE key = ?", (key,))
+
+
+class RedisError(Exception):
+    """Error reply from a Redis-protocol server."""
+
+
+class RedisSessionStore:
+    """Session state in a server speaking the Redis protocol (RESP), using one connection."""
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 6379
+        self.username = unquote(parts.username) if parts.username else None
+        self.password = unquote(parts.password) if parts.password else None
+        self.db = int(parts.path.strip("/") or 0)
+        self.tls = parts.scheme == "rediss"
+        self.timeout = timeout
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> None:
+        sock = socket.create_connection((self.host, self.port), self.timeout)
+        if self.tls:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+        self._sock, self._reader = sock, sock.makefile("rb")
+        if self.password:
+            self._call("AUTH", *([self.username] if self.username else []), self.password)
+        if self.db:
+            self._call("SELECT", self.db)
+
+    def _close(self) -> None:
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._reader = None
+
+    def _call(self, *args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._sock.sendall(b"".join(parts))
+        return self._reply()
+
+    def _reply(self):
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("connection closed by the session store")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode("utf-8")
+        if kind == b"-":
+            raise RedisError(rest.decode("utf-8"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            if int(rest) < 0:
+                return None
+            data = self._reader.read(int(rest) + 2)
+            return data[:-2]
+        if kind == b"*":
+            return None if int(rest) < 0 else [self._reply() for _ in range(int(rest))]
+        raise ConnectionError(f"unexpected reply from the session store: {line[:20]!r}")
+
+    def command(self, *args):
+        """Sends one command and returns its reply, reconnecting once if the connection was lost."""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._call(*args)
+                except (OSError, ConnectionError):
+                    self._close()
+                    if attempt:
+                        raise
+
+    def get(self, key: str):
+        return self.command("GET", KEY_PREFIX + key)
+
+    def set(self, key: str, data: bytes, ttl: float) -> None:
+        self.command("SET", KEY_PREFIX + key, data, "PX", max(1, int(ttl * 1000)))
+
+    def delete(self, key: str) -> None:
+        self.command("DEL", KEY_PREFIX + key)
+
+
+def create_session_store(url: str):
+    """Creates the backend for a ``KUBESAGE_SESSION_STORE`` value."""
+    if not url or url == "memory":
+        return MemorySessionStore()
+    if url.startswith("sqlite://"):
+        return SqliteSessionStore(url[len("sqlite://"):])
+    if url.startswith(("redis://", "rediss://")):
+        return RedisSessionStore(url)
+    raise ValueError(f"Unsupported KUBESAGE_SESSION_STORE: {url}")
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    """Returns the process-wide session store, created on first use."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = create_session_store(os.getenv("KUBESAGE_SESSION_STORE", "memory").strip())
+        return _store
+
+
+def load_state(session_id: str, name: str):
+    """Returns a session's ``name`` value, or None if it is not set or expired."""
+    data = get_session_store().get(f"{session_id}:{name}")
+    return decode(data) if data is not None else None
+
+
+def save_state(session_id: str, name: str, value, ttl: float = None) -> None:
+    """Stores a session's ``name`` value for ``ttl`` seconds (default ``session_ttl()``)."""
+    get_session_store().set(f"{session_id}:{name}", encode(value), ttl or session_ttl())
+
+
+class SessionListCache:
+    """
+    List results reused by the queries of one session for ``ttl`` seconds.
+
+    Has the interface of ``k8s_utils.ListCache``, so it can be installed with
+    ``shared_lists``; entries live in the session store, so follow-up
+    questions reuse them on any replica.
+    """
+
+    def __init__(self, session_id: str, ttl: float):
+        self.session_id = session_id
+        self.ttl = ttl
+        self.hits = 0
+
+    def get_or_fetch(self, key: tuple, fetch):
+        name = "lists:" + "|".join(str(part) for part in key)
+        value = load_state(self.session_id, name)
+        if value is not None:
+            self.hits += 1
+            return value
+        value = fetch()
+        save_state(self.session_id, name, value, self.ttl)
+        return value
@@ -0,0 +1,125 @@
+"""
+Lazy loading of heavy subsystems and background warm-up.
+
+The HTTP layer only imports FastAPI, Pydantic and light helpers, so the server
+answers as soon as it starts. LangChain, the OpenAI client and the Kubernetes
+client are imported on first use through ``load``, or ahead of time by the
+warm-up thread started from the application lifespan. Every import and
+warm-up step is timed, and ``startup_report`` breaks the startup down by them.
+"""
+import importlib
+import sys
+import threading
+import time
+import traceback
+
+# Startup is measured from the first import of this module, the first import of src.main
+STARTED = time.perf_counter()
+
+STARTING, WARMING, WARM, FAILED = "starting", "warming", "warm", "failed"
+
+_lock = threading.Lock()
+_imports = {}
+_steps = {}
+_errors = {}
+_state = {"status": STARTING, "http_ready": None, "warm_up_started": None, "warm_up_finished": None}
+_warm = threading.Event()
+_warm_up_thread = None
+
+
+def _elapsed() -> float:
+    return round(time.perf_counter() - STARTED, 3)
+
+
+def load(name: str):
+    """Imports a module on first use, recording how long the import took."""
+    loaded = name in sys.modules
+    started = time.perf_counter()
+    # import_module waits for an import in progress in another thread instead of returning a partial module
+    module = importlib.import_module(name)
+    if not loaded:
+        with _lock:
+            _imports.setdefault(name, round(time.perf_counter() - started, 3))
+    return module
+
+
+def mark_http_ready() -> None:
+    """Records the moment the HTTP layer can answer requests."""
+    with _lock:
+        if _state["http_ready"] is None:
+            _state["http_ready"] = _elapsed()
+
+
+def warm_up(items) -> bool:
+    """
+    Imports modules and runs warm-up steps in order.
+
+    Args:
+        items: Module names to import, or ``(name, callable)`` steps to run
+
+    Returns:
+        True if every import and step succeeded; failures are recorded and do not stop the others.
+    """
+    with _lock:
+        _state["status"] = WARMING
+        _state["warm_up_started"] = _elapsed()
+    for item in items:
+        name, run = (item, None) if isinstance(item, str) else item
+        started = time.perf_counter()
+        try:
+            if run is None:
+                load(name)
+            else:
+                run()
+                with _lock:
+                    _steps[name] = round(time.perf_counter() - started, 3)
+        except Exception as e:
+            print(f"⚠️ Warm-up of {name} failed: {e}")
+            print(traceback.format_exc())
+            with _lock:
+                _errors[name] = str(e)
+    with _lock:
+        _state["status"] = FAILED if _errors else WARM
+        _state["warm_up_finished"] = _elapsed()
+    _warm.set()
+    slowest = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in _slowest(_imports)[:5])
+    print(f"🔥 Warm-up finished {_state['warm_up_finished']:.2f}s after start ({slowest})")
+    return not _errors
+
+
+def start_warm_up(items) -> threading.Thread:
+    """Runs ``warm_up`` in a daemon thread, once per process."""
+    global _warm_up_thread
+    with _lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=warm_up, args=(list(items),), name="kubesage-warm-up", daemon=True)
+            _warm_up_thread.start()
+        return _warm_up_thread
+
+
+def wait_until_warm(timeout: float = None) -> bool:
+    """Waits for the warm-up to finish; returns False on timeout."""
+    return _warm.wait(timeout)
+
+
+def _slowest(timings: dict) -> list:
+    return sorted(timings.items(), key=lambda item: item[1], reverse=True)
+
+
+def startup_report() -> dict:
+    """
+    Returns the startup state and where the startup time went.
+
+    Times are in seconds; ``http_ready``, ``warm_up_started`` and
+    ``warm_up_finished`` are measured from the first import of the app.
+    Imports are listed slowest first. Each import excludes the modules that
+    were already loaded by an earlier one.
+    """
+    with _lock:
+        return {
+            **_state,
+            "uptime": _elapsed(),
+            "imports": [{"module": name, "seconds": seconds} for name, seconds in _slowest(_imports)],
+            "steps": [{"step": name, "seconds": seconds} for name, seconds in _slowest(_steps)],
+            "errors": dict(_errors),
+        }
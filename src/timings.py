@@ -0,0 +1,80 @@
+"""
+Per-request latency and token breakdown built from the spans of one query.
+
+Every LLM call opens an agent step. The tool invoked after that call, its wall
+time and the Kubernetes bytes it received are attributed to the same step.
+"""
+
+
+def build_timings(spans: list, root_span) -> dict:
+    """
+    Summarizes the spans recorded for one query.
+
+    Args:
+        spans: Spans collected with ``tracing.collect_spans`` during the run
+        root_span: The request's root span
+
+    Returns:
+        dict: Per-step breakdown and totals
+    """
+    llm_spans = sorted((s for s in spans if s.name == "llm.call"), key=lambda s: s.start_time_ns)
+    tool_spans = sorted((s for s in spans if "tool.name" in s.attributes), key=lambda s: s.start_time_ns)
+    k8s_requests = {}
+    for s in spans:
+        if s.name.startswith("k8s "):
+            k8s_requests[s.parent_span_id] = k8s_requests.get(s.parent_span_id, 0) + 1
+
+    steps = []
+    for llm in llm_spans:
+        step = _new_step(len(steps) + 1)
+        step["llm_latency_ms"] = round(llm.duration_ms, 1)
+        step["prompt_tokens"] = llm.attributes.get("gen_ai.usage.input_tokens", 0)
+        step["completion_tokens"] = llm.attributes.get("gen_ai.usage.output_tokens", 0)
+        steps.append(step)
+
+    for tool in tool_spans:
+        step = _step_for(tool, llm_spans, steps)
+        if step is None:
+            step = _new_step(len(steps) + 1)
+            steps.append(step)
+        step["tool"] = tool.attributes["tool.name"] if step["tool"] is None else f"{step['tool']}, {tool.attributes['tool.name']}"
+        step["tool_wall_ms"] = round(step["tool_wall_ms"] + tool.duration_ms, 1)
+        step["k8s_bytes"] += tool.attributes.get("k8s.response.bytes", 0)
+        step["k8s_requests"] += k8s_requests.get(tool.span_id, 0)
+
+    return {
+        "steps": steps,
+        "totals": {
+            "wall_ms": round(root_span.duration_ms, 1),
+            "llm_calls": len(llm_spans),
+            "llm_latency_ms": round(sum(s["llm_latency_ms"] for s in steps), 1),
+            "tool_calls": len(tool_spans),
+            "tool_wall_ms": round(sum(s["tool_wall_ms"] for s in steps), 1),
+            "prompt_tokens": sum(s["prompt_tokens"] for s in steps),
+            "completion_tokens": sum(s["completion_tokens"] for s in steps),
+            "k8s_bytes": sum(s["k8s_bytes"] for s in steps),
+            "k8s_requests": sum(s["k8s_requests"] for s in steps),
+        },
+    }
+
+
+def _new_step(number: int) -> dict:
+    return {
+        "step": number,
+        "llm_latency_ms": 0.0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "tool": None,
+        "tool_wall_ms": 0.0,
+        "k8s_bytes": 0,
+        "k8s_requests": 0,
+    }
+
+
+def _step_for(tool_span, llm_spans: list, steps: list):
+    """Returns the step of the last LLM call that finished before the tool started."""
+    step = None
+    for llm, candidate in zip(llm_spans, steps):
+        if llm.end_time_ns is not None and llm.end_time_ns <= tool_span.start_time_ns:
+            step = candidate
+    return step
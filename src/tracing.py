@@ -0,0 +1,464 @@
+"""
+OpenTelemetry-compatible tracing for KubeSage.
+
+One REST query or WebSocket message produces one trace: a root span opened by
+the handler, child spans for every LLM call and tool invocation (recorded by
+``TracingCallbackHandler``) and, underneath the tools, one span per Kubernetes
+API request (recorded by ``instrument_kubernetes``).
+
+Spans are exported in OTLP/JSON shape once their root span ends. The exporter
+is selected with ``KUBESAGE_TRACE_EXPORTER``:
+
+- ``none`` (default): nothing is exported; spans are no-ops unless a
+  ``collect_spans`` block (used for per-request timings) is active.
+- ``console``: one JSON line per span on stdout.
+- ``file``: one JSON line per span appended to ``KUBESAGE_TRACE_FILE``.
+- ``otlp``: spans are POSTed to ``OTEL_EXPORTER_OTLP_ENDPOINT`` (OTLP/HTTP JSON).
+
+Additional exporters can be plugged in with ``register_exporter`` or set
+directly with ``set_exporter``.
+"""
+import contextvars
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from urllib import request as urllib_request
+from urllib.parse import urlsplit
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+_current_span = contextvars.ContextVar("kubesage_current_span", default=None)
+_span_collector = contextvars.ContextVar("kubesage_span_collector", default=None)
+
+_exporter = None
+_exporter_configured = False
+_exporter_factories = {}
+
+_pending_lock = threading.Lock()
+_pending_spans = {}
+
+_kubernetes_instrumented = False
+
+
+class Span:
+    """A single timed operation within a trace."""
+
+    __slots__ = (
+        "name", "trace_id", "span_id", "parent_span_id", "kind",
+        "start_time_ns", "end_time_ns", "attributes", "status", "status_message", "collector",
+    )
+
+    def __init__(self, name: str, parent: "Span" = None, attributes: dict = None, kind: str = "internal"):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent.span_id if parent else None
+        self.kind = kind
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = "unset"
+        self.status_message = ""
+        self.collector = _span_collector.get()
+
+    @property
+    def is_recording(self) -> bool:
+        return True
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_time_ns or time.time_ns()
+        return (end - self.start_time_ns) / 1_000_000
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def add_to_attribute(self, key: str, amount) -> None:
+        """Increments a numeric attribute, starting from zero."""
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def set_error(self, error) -> None:
+        self.status = "error"
+        self.status_message = str(error)
+
+    def end(self) -> None:
+        if self.end_time_ns is not None:
+            return
+        self.end_time_ns = time.time_ns()
+        if self.status == "unset":
+            self.status = "ok"
+        _on_span_end(self)
+
+    def to_otlp(self) -> dict:
+        """Returns the span in OTLP/JSON representation."""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": _OTLP_SPAN_KINDS.get(self.kind, 1),
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.end_time_ns or self.start_time_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": _OTLP_STATUS_CODES[self.status], "message": self.status_message},
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        return span
+
+
+class _NoopSpan:
+    """Span stand-in used when tracing is disabled."""
+
+    trace_id = None
+    span_id = None
+    parent_span_id = None
+    attributes = {}
+    is_recording = False
+    duration_ms = 0.0
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+    def add_to_attribute(self, key: str, amount) -> None:
+        pass
+
+    def set_error(self, error) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+_OTLP_SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+_OTLP_STATUS_CODES = {"unset": 0, "ok": 1, "error": 2}
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _resource() -> dict:
+    return {"attributes": [_otlp_attribute("service.name", os.getenv("OTEL_SERVICE_NAME", "kubesage"))]}
+
+
+# ==============================
+# Exporters
+# ==============================
+
+class ConsoleExporter:
+    """Writes each finished span as a JSON line to stdout."""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def export(self, spans: list) -> None:
+        for span in spans:
+            self.stream.write(json.dumps(span.to_otlp(), separators=(",", ":")) + "\n")
+        self.stream.flush()
+
+
+class FileExporter:
+    """Appends each finished span as a JSON line to a local file, for offline analysis."""
+
+    def __init__(self, path: str = None):
+        self.path = path or os.getenv("KUBESAGE_TRACE_FILE", "kubesage-traces.jsonl")
+        self._lock = threading.Lock()
+
+    def export(self, spans: list) -> None:
+        lines = "".join(json.dumps(span.to_otlp(), separators=(",", ":")) + "\n" for span in spans)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+class OTLPHttpExporter:
+    """Sends each finished trace to an OTLP/HTTP collector using the JSON encoding."""
+
+    def __init__(self, endpoint: str = None, timeout: float = 5.0):
+        base = endpoint or os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318")
+        self.url = base if base.rstrip("/").endswith("/v1/traces") else base.rstrip("/") + "/v1/traces"
+        self.timeout = timeout
+
+    def export(self, spans: list) -> None:
+        payload = {
+            "resourceSpans": [{
+                "resource": _resource(),
+                "scopeSpans": [{"scope": {"name": "kubesage"}, "spans": [s.to_otlp() for s in spans]}],
+            }]
+        }
+        req = urllib_request.Request(
+            self.url,
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            urllib_request.urlopen(req, timeout=self.timeout).close()
+        except Exception as e:
+            print(f"⚠️ Failed to export {len(spans)} spans to {self.url}: {e}")
+
+
+def register_exporter(name: str, factory) -> None:
+    """Registers an exporter factory selectable through KUBESAGE_TRACE_EXPORTER."""
+    _exporter_factories[name.lower()] = factory
+
+
+register_exporter("console", ConsoleExporter)
+register_exporter("file", FileExporter)
+register_exporter("otlp", OTLPHttpExporter)
+
+
+def set_exporter(exporter) -> None:
+    """Sets the exporter explicitly. Pass None to disable tracing."""
+    global _exporter, _exporter_configured
+    _exporter = exporter
+    _exporter_configured = True
+
+
+def get_exporter():
+    """Returns the active exporter, creating it from the environment on first use."""
+    global _exporter, _exporter_configured
+    if not _exporter_configured:
+        name = os.getenv("KUBESAGE_TRACE_EXPORTER", "none").strip().lower()
+        if name in ("", "none"):
+            _exporter = None
+        elif name in _exporter_factories:
+            _exporter = _exporter_factories[name]()
+        else:
+            raise ValueError(f"Unknown trace exporter: {name}. Available: {', '.join(_exporter_factories)}")
+        _exporter_configured = True
+    return _exporter
+
+
+def tracing_enabled() -> bool:
+    return get_exporter() is not None
+
+
+def _recording() -> bool:
+    return _span_collector.get() is not None or tracing_enabled()
+
+
+@contextmanager
+def collect_spans(collector: list = None):
+    """
+    Appends every span finished within the block to ``collector``.
+
+    Spans are recorded while a collector is active even when no exporter is
+    configured. Passing None makes the block a no-op.
+    """
+    if collector is None:
+        yield collector
+        return
+    token = _span_collector.set(collector)
+    try:
+        yield collector
+    finally:
+        _span_collector.reset(token)
+
+
+def _on_span_end(span: Span) -> None:
+    """Buffers spans per trace and exports the whole trace when its root span ends."""
+    if span.collector is not None:
+        span.collector.append(span)
+
+    with _pending_lock:
+        spans = _pending_spans.setdefault(span.trace_id, [])
+        spans.append(span)
+        if span.parent_span_id is not None:
+            return
+        del _pending_spans[span.trace_id]
+
+    exporter = get_exporter()
+    if exporter is None:
+        return
+    try:
+        exporter.export(spans)
+    except Exception as e:
+        print(f"⚠️ Trace export failed: {e}")
+
+
+# ==============================
+# Span creation
+# ==============================
+
+def get_current_span():
+    """Returns the innermost active span, or a no-op span when there is none."""
+    return _current_span.get() or NOOP_SPAN
+
+
+def begin_span(name: str, attributes: dict = None, parent=None, kind: str = "internal"):
+    """Starts a span without making it current. The caller must call ``end()``."""
+    if not _recording():
+        return NOOP_SPAN
+    parent = parent if parent is not None else _current_span.get()
+    return Span(name, parent=parent if isinstance(parent, Span) else None, attributes=attributes, kind=kind)
+
+
+@contextmanager
+def start_span(name: str, attributes: dict = None, kind: str = "internal"):
+    """Starts a span as a child of the current span and makes it current."""
+    span = begin_span(name, attributes, kind=kind)
+    if span is NOOP_SPAN:
+        yield span
+        return
+
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.set_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+
+# ==============================
+# LangChain instrumentation
+# ==============================
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Records a span for every LLM call and tool invocation of an agent run."""
+
+    # Run in the caller's context so that the tool span becomes the parent
+    # of the Kubernetes request spans issued by the tool.
+    run_inline = True
+
+    def __init__(self):
+        self._spans = {}
+        self._previous_spans = {}
+
+    def _start(self, run_id, parent_run_id, name: str, attributes: dict):
+        parent = self._spans.get(parent_run_id) or _current_span.get()
+        span = begin_span(name, attributes, parent=parent)
+        self._spans[run_id] = span
+        return span
+
+    def _finish(self, run_id, error=None):
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return None
+        if error is not None:
+            span.set_error(error)
+        span.end()
+        return span
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, **kwargs):
+        prompt_chars = sum(len(str(m.content)) for batch in messages for m in batch)
+        self._start(run_id, parent_run_id, "llm.call", {
+            "gen_ai.request.model": _model_name(serialized, kwargs),
+            "gen_ai.prompt.size": prompt_chars,
+        })
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, **kwargs):
+        self._start(run_id, parent_run_id, "llm.call", {
+            "gen_ai.request.model": _model_name(serialized, kwargs),
+            "gen_ai.prompt.size": sum(len(p) for p in prompts),
+        })
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        span = self._spans.get(run_id)
+        if span is not None:
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            span.set_attribute("gen_ai.usage.input_tokens", usage.get("prompt_tokens", 0))
+            span.set_attribute("gen_ai.usage.output_tokens", usage.get("completion_tokens", 0))
+            span.set_attribute(
+                "gen_ai.completion.size",
+                sum(len(g.text) for batch in response.generations for g in batch),
+            )
+        self._finish(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        tool_name = (serialized or {}).get("name", "unknown")
+        span = self._start(run_id, parent_run_id, f"tool {tool_name}", {
+            "tool.name": tool_name,
+            "tool.input.size": len(input_str or ""),
+        })
+        if span is not NOOP_SPAN:
+            self._previous_spans[run_id] = _current_span.get()
+            _current_span.set(span)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        span = self._spans.get(run_id)
+        if span is not None:
+            span.set_attribute("tool.output.size", len(str(output)))
+        self._restore_previous(run_id, self._finish(run_id))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._restore_previous(run_id, self._finish(run_id, error))
+
+    def _restore_previous(self, run_id, span):
+        previous = self._previous_spans.pop(run_id, None)
+        if span is not None and _current_span.get() is span:
+            _current_span.set(previous)
+
+
+def _model_name(serialized: dict, kwargs: dict) -> str:
+    params = kwargs.get("invocation_params") or {}
+    return params.get("model_name") or params.get("model") or (serialized or {}).get("name", "unknown")
+
+
+def get_callbacks() -> list:
+    """Returns the LangChain callbacks to attach to an agent run."""
+    return [TracingCallbackHandler()] if _recording() else []
+
+
+# ==============================
+# Kubernetes instrumentation
+# ==============================
+
+def instrument_kubernetes() -> None:
+    """Wraps the Kubernetes REST client so that every API request records a span."""
+    global _kubernetes_instrumented
+    if _kubernetes_instrumented:
+        return
+
+    from kubernetes.client import rest
+
+    original_request = rest.RESTClientObject.request
+
+    def traced_request(self, method, url, *args, **kwargs):
+        parent = _current_span.get()
+        if parent is None:
+            return original_request(self, method, url, *args, **kwargs)
+
+        with start_span(f"k8s {method}", {
+            "http.request.method": method,
+            "url.path": urlsplit(url).path,
+        }, kind="client") as span:
+            response = original_request(self, method, url, *args, **kwargs)
+            span.set_attribute("http.response.status_code", response.status)
+            size = _response_size(response, kwargs.get("_preload_content", True))
+            if size is not None:
+                span.set_attribute("http.response.body.size", size)
+                parent.add_to_attribute("k8s.response.bytes", size)
+            return response
+
+    rest.RESTClientObject.request = traced_request
+    _kubernetes_instrumented = True
+
+
+def _response_size(response, preloaded: bool):
+    if preloaded and getattr(response, "data", None) is not None:
+        return len(response.data)
+    length = response.getheader("Content-Length") if hasattr(response, "getheader") else None
+    return int(length) if length else None
+
+
+def record_k8s_bytes(size: int) -> None:
+    """Accounts for response bytes read outside the REST client (streamed bodies)."""
+    get_current_span().add_to_attribute("k8s.response.bytes", size)
@@ -1,52 +1,367 @@
+"""
+WebSocket chat with the troubleshooting agent.
+
+Plain-text messages are answered one at a time, in order. Clients that send
+JSON frames can run several queries at once on one connection:
+
+    → {"type": "query", "id": "q1", "query": "why is web failing?", "model": "...", "profile": false,
+       "timeout": 60, "max_iterations": 8, "include_timings": false}
+    ← {"type": "result", "id": "q1", "output": "..."}
+    ← {"type": "error", "id": "q1", "error": "..."}
+    → {"type": "cancel", "id": "q1"}            (or the text "cancel q1" while q1 runs)
+    ← {"type": "cancelled", "id": "q1"}
+
+Results arrive as each query finishes, so they may interleave. At most
+``KUBESAGE_WS_MAX_CONCURRENCY`` queries of a connection run at a time, and
+at most ``KUBESAGE_WS_MAX_QUEUED`` may be running or waiting; further
+queries are rejected with an error frame. Every message leaves through one
+bounded queue (``KUBESAGE_WS_SEND_BUFFER`` messages): when the client reads
+slowly, finished queries wait to send their results while holding their
+slot. New queries then stay queued, and once the queue is full the server
+stops reading from the connection.
+
+With ``"include_timings": true`` the result carries the query's latency and
+token breakdown under ``timings``. Plain-text clients opt in for the whole
+connection with ``/ws?include_timings=true``, and then receive a
+``{"type": "timings", ...}`` frame after each answer.
+
+Queries of one connection share its session. Concurrent queries each see the
+history as it was when they started, and each appends its turn to the history
+as it is when it finishes, so no turn is lost.
+
+A frame's ``timeout`` (seconds, counted from when the frame is received) and
+``max_iterations`` bound its agent run (see ``src.cancellation.budget``);
+once either runs out, the result holds a best-effort answer. Plain-text
+queries use the defaults.
+
+Cancelling a query, sending "exit" or disconnecting stops the agent at its
+next step and aborts its LLM and Kubernetes calls (see ``src.cancellation``);
+the text "cancel" cancels the plain-text query in progress.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
 import traceback
-from fastapi import WebSocket
-from openai import RateLimitError, AuthenticationError
-from src.langchain_agent import process_query, init_llm_and_executor
+import uuid
+from fastapi import WebSocket, WebSocketDisconnect
+from src.cancellation import CancellationToken, RunCancelled, budget, run_cancellable
+from src.llm_scheduler import INTERACTIVE, scheduling
+from src.profiling import PROFILE_HEADER, format_top_functions, profiling_allowed, run_profiled
+from src.startup import load
+from src.timings import build_timings
+from src.tracing import collect_spans, start_span
 
 
-async def websocket_handler(websocket: WebSocket):
-    """WebSocket for real-time Kubernetes AI chatbot."""
-    await websocket.accept()
-    await websocket.send_text("🔹 Kubernetes Chat Assistant Started! Using OPENROUTER_API_KEY from environment.")
+# The agent is imported on first use (or by the startup warm-up), see src.startup
+def init_llm_and_executor(*args, **kwargs):
+    return load("src.langchain_agent").init_llm_and_executor(*args, **kwargs)
+
+
+def process_query(*args, **kwargs):
+    return load("src.langchain_agent").process_query(*args, **kwargs)
+
+
+def _init_error_message(e: Exception) -> str:
+    """Returns the message sent to the client when the agent cannot be initialized."""
+    if isinstance(e, ValueError):
+        return f"❌ Configuration error: {str(e)}"
+    # An error raised by the OpenAI client means the client is already loaded
+    errors = sys.modules.get("openai")
+    if errors is not None and isinstance(e, errors.AuthenticationError):
+        return "❌ Invalid API Key! Please check your OPENROUTER_API_KEY environment variable."
+    if errors is not None and isinstance(e, errors.RateLimitError):
+        return "⚠️ You exceeded your quota, please check your plan and billing details."
+    return None
+
 
-    initialized = False
+def _run_query(client_id: str, query: str, profiling: bool, session_id: str, model_name: str = None,
+               timeout: float = None, max_iterations: int = None):
+    kwargs = {"session_id": session_id}
+    if model_name:
+        kwargs["model_name"] = model_name
+    with scheduling(INTERACTIVE, client_id), budget(timeout, max_iterations):
+        if profiling:
+            return run_profiled("websocket.message", process_query, query, **kwargs)
+        return process_query(query, **kwargs), None
 
+
+async def _answer(client_id: str, query: str, profiling: bool, session_id: str, model_name: str = None,
+                  token: CancellationToken = None, timeout: float = None, max_iterations: int = None,
+                  include_timings: bool = False):
+    """Runs a query off the event loop; returns its output, profile and timings (None unless asked for)."""
+    spans = [] if include_timings else None
+    with collect_spans(spans), start_span("websocket.message", {"kubesage.query.size": len(query)}, kind="server") as span:
+        response, profile = await asyncio.to_thread(
+            run_cancellable, token or CancellationToken(client_id), _run_query,
+            client_id, query, profiling, session_id, model_name, timeout, max_iterations)
+        output = str(response.get('output'))
+        span.set_attribute("kubesage.output.size", len(output))
+        return output, profile, build_timings(spans, span) if spans is not None else None
+
+
+def frame_limits(frame: dict):
+    """
+    Returns the ``timeout`` and ``max_iterations`` of a query frame, None where not given.
+
+    Raises:
+        ValueError: If a limit is not a positive number (an integer for iterations).
+    """
+    timeout, iterations = frame.get("timeout"), frame.get("max_iterations")
+    if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float)) or timeout <= 0):
+        raise ValueError("❌ timeout must be a positive number of seconds.")
+    if iterations is not None and (isinstance(iterations, bool) or not isinstance(iterations, int) or iterations < 1):
+        raise ValueError("❌ max_iterations must be a positive integer.")
+    return timeout, iterations
+
+
+def parse_frame(message: str):
+    """Returns the JSON frame in a message, or None for a plain-text message."""
+    if not message.lstrip().startswith("{"):
+        return None
+    try:
+        frame = json.loads(message)
+    except ValueError:
+        return None
+    return frame if isinstance(frame, dict) and "type" in frame else None
+
+
+async def _send_messages(websocket: WebSocket, outbox: asyncio.Queue) -> None:
+    """Sends queued messages one at a time; waits while the client is slow to read them."""
     while True:
-        query = await websocket.receive_text()
+        message = await outbox.get()
+        try:
+            await websocket.send_text(message)
+        except Exception:
+            pass  # The client is gone; keep draining so senders never block on a full queue
+        finally:
+            outbox.task_done()
+
+
+class FramedQueries:
+    """The concurrent framed queries of one connection."""
+
+    def __init__(self, send, client_id: str, session_id: str, profiling_token: str = None,
+                 max_concurrency: int = None, max_queued: int = None):
+        self.send = send
+        self.client_id = client_id
+        self.session_id = session_id
+        self.profiling_token = profiling_token
+        self.max_queued = max_queued or int(os.getenv("KUBESAGE_WS_MAX_QUEUED", "16"))
+        self.slots = asyncio.Semaphore(max_concurrency or int(os.getenv("KUBESAGE_WS_MAX_CONCURRENCY", "4")))
+        self.tasks = {}
+        self.tokens = {}
+
+    async def _error(self, request_id, error: str) -> None:
+        await self.send(json.dumps({"type": "error", "id": request_id, "error": error}))
+
+    async def handle(self, frame: dict) -> None:
+        """Starts or cancels the query of a frame, or answers with an error frame."""
+        request_id = frame.get("id")
+        if frame.get("type") == "cancel":
+            if not self.cancel(request_id):
+                await self._error(request_id, f"❌ No query {request_id} in progress.")
+            return
+        if frame.get("type") != "query":
+            await self._error(request_id, f"❌ Unknown frame type: {frame.get('type')}")
+            return
+        if not isinstance(request_id, str) or not request_id or not isinstance(frame.get("query"), str):
+            await self._error(request_id, "❌ A query frame needs a string id and query.")
+            return
+        if request_id in self.tasks:
+            await self._error(request_id, f"❌ Query {request_id} is already in progress.")
+            return
+        try:
+            frame_limits(frame)
+        except ValueError as e:
+            await self._error(request_id, str(e))
+            return
+        if len(self.tasks) >= self.max_queued:
+            await self._error(request_id, f"⚠️ Too many queries in progress on this connection (limit {self.max_queued}).")
+            return
+        self.tokens[request_id] = CancellationToken(f"{self.client_id}/{request_id}")
+        self.tasks[request_id] = asyncio.create_task(self._run(request_id, frame, time.monotonic()))
+
+    async def _run(self, request_id: str, frame: dict, received: float) -> None:
+        token = self.tokens[request_id]
+        timeout, max_iterations = frame_limits(frame)
+        try:
+            async with self.slots:
+                profiling = bool(frame.get("profile"))
+                if profiling and not profiling_allowed(self.profiling_token):
+                    await self._error(request_id, "❌ Profiling is not enabled or the profiling token is invalid.")
+                    return
+                try:
+                    token.check()
+                    if timeout is not None:
+                        # Time spent queued on this connection counts against the query's budget
+                        timeout = max(0.0, timeout - (time.monotonic() - received))
+                    output, profile, timings = await _answer(
+                        self.client_id, frame["query"], profiling, self.session_id, frame.get("model"), token,
+                        timeout, max_iterations, bool(frame.get("include_timings")))
+                except RunCancelled:
+                    await self.send(json.dumps({"type": "cancelled", "id": request_id}))
+                    return
+                except Exception as e:
+                    message = _init_error_message(e)
+                    if message is None:
+                        print(traceback.format_exc())
+                        message = f"❌ Query processing error: {str(e)}"
+                    await self._error(request_id, message)
+                    return
+                result = {"type": "result", "id": request_id, "output": output}
+                if timings is not None:
+                    result["timings"] = timings
+                if profiling:
+                    result["profile"] = format_top_functions(profile)
+                # Sent while holding the slot, so a client that reads slowly slows down its own queries
+                await self.send(json.dumps(result))
+        finally:
+            self.tasks.pop(request_id, None)
+            self.tokens.pop(request_id, None)
+
+    def cancel(self, request_id: str = None, reason: str = "cancelled by the client") -> bool:
+        """Cancels one query, or all of them when ``request_id`` is None; returns False if there was none."""
+        tokens = list(self.tokens.values()) if request_id is None else [self.tokens.get(request_id)]
+        for token in tokens:
+            if token is not None:
+                token.cancel(reason)
+        return any(token is not None for token in tokens)
+
+    def cancel_all(self) -> None:
+        self.cancel(reason="connection closed")
+        for task in self.tasks.values():
+            task.cancel()
+
+
+class TextQueries:
+    """The plain-text queries of one connection, answered one at a time in order."""
+
+    def __init__(self, websocket: WebSocket, send, client_id: str, session_id: str, include_timings: bool = False):
+        self.websocket = websocket
+        self.send = send
+        self.client_id = client_id
+        self.session_id = session_id
+        self.include_timings = include_timings
+        self.initialized = False
+        # asyncio.Lock wakes waiters in order, so answers keep the order of the questions
+        self.turn = asyncio.Lock()
+        self.tasks = set()
+        self.current = None
 
-        if query.lower() == "exit":
-            await websocket.send_text("❌ Closing connection.")
-            break
+    def submit(self, query: str) -> None:
+        task = asyncio.create_task(self._answer(query))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
 
-        if not initialized:
+    async def _answer(self, query: str) -> None:
+        async with self.turn:
+            if not self.initialized:
+                try:
+                    await asyncio.to_thread(init_llm_and_executor)
+                    self.initialized = True
+                    await self.send("✅ LLM initialized! You can now ask questions.")
+                except Exception as e:
+                    error_message = _init_error_message(e)
+                    if error_message is None:
+                        print(traceback.format_exc())
+                        await self.send(f"❌ An unexpected error occurred: {str(e)}")
+                        return
+                    await self.send(error_message)
+                    await self.send("Type 'exit' to quit.")
+                    return
+
+            profiling = query.lower().startswith("profile ")
+            if profiling:
+                if not profiling_allowed(self.websocket.headers.get(PROFILE_HEADER)):
+                    await self.send("❌ Profiling is not enabled or the profiling token is invalid.")
+                    return
+                query = query[len("profile "):]
+
+            self.current = CancellationToken(f"{self.client_id}/text")
             try:
-                init_llm_and_executor()
-                initialized = True
-                await websocket.send_text("✅ LLM initialized! You can now ask questions.")
-            except ValueError as e:
-                await websocket.send_text(f"❌ Configuration error: {str(e)}")
-                await websocket.send_text("Type 'exit' to quit.")
-                continue
-            except AuthenticationError:
-                await websocket.send_text("❌ Invalid API Key! Please check your OPENROUTER_API_KEY environment variable.")
-                await websocket.send_text("Type 'exit' to quit.")
-                continue
-            except RateLimitError:
-                await websocket.send_text("⚠️ You exceeded your quota, please check your plan and billing details.")
-                await websocket.send_text("Type 'exit' to quit.")
-                continue
+                output, profile, timings = await _answer(self.client_id, query, profiling, self.session_id,
+                                                         token=self.current, include_timings=self.include_timings)
+                await self.send(output)
+                if profiling:
+                    await self.send(format_top_functions(profile))
+                if timings is not None:
+                    await self.send(json.dumps({"type": "timings", **timings}))
+            except RunCancelled:
+                await self.send("🛑 Query cancelled.")
             except Exception as e:
-                error_message = f"❌ An unexpected error occurred: {str(e)}"
+                error_message = f"❌ Query processing error: {str(e)}"
                 print(traceback.format_exc())
-                await websocket.send_text(error_message)
+                await self.send(error_message)
+            finally:
+                self.current = None
+
+    def cancel(self, reason: str = "cancelled by the client") -> bool:
+        """Cancels the query being answered; returns False if there was none."""
+        if self.current is None:
+            return False
+        self.current.cancel(reason)
+        return True
+
+    def cancel_all(self) -> None:
+        self.cancel("connection closed")
+        for task in self.tasks:
+            task.cancel()
+
+
+async def websocket_handler(websocket: WebSocket):
+    """WebSocket for real-time Kubernetes AI chatbot."""
+    await websocket.accept()
+    client_id = f"ws-{websocket.client.host if websocket.client else 'unknown'}-{id(websocket):x}"
+    outbox = asyncio.Queue(maxsize=int(os.getenv("KUBESAGE_WS_SEND_BUFFER", "16")))
+    sender = asyncio.create_task(_send_messages(websocket, outbox))
+    send = outbox.put
+    # Reconnecting with ?session=<id>, to any replica, continues the conversation
+    session_id = websocket.query_params.get("session", "")[:128] or uuid.uuid4().hex
+    await send(f"🔹 Kubernetes Chat Assistant Started! Using OPENROUTER_API_KEY from environment. "
+               f"Session: {session_id}")
+    if "session" in websocket.query_params:
+        # Only clients that manage sessions (?session=<id>, or an empty ?session= for a new one) get the frame
+        await send(json.dumps({"type": "session", "session_id": session_id}))
+    framed = FramedQueries(send, client_id, session_id, websocket.headers.get(PROFILE_HEADER))
+    include_timings = websocket.query_params.get("include_timings", "").lower() in ("1", "true", "yes")
+    text = TextQueries(websocket, send, client_id, session_id, include_timings)
+
+    try:
+        # Queries run as tasks, so "cancel" and "exit" are read while they run
+        while True:
+            message = await websocket.receive_text()
+
+            frame = parse_frame(message)
+            if frame is not None:
+                await framed.handle(frame)
                 continue
 
-        try:
-            response = process_query(query)
-            await websocket.send_text(str(response.get('output')))
-        except Exception as e:
-            error_message = f"❌ Query processing error: {str(e)}"
-            print(traceback.format_exc())
-            await websocket.send_text(error_message)
-
-    await websocket.close()
\ No newline at end of file
+            if message.lower() == "exit":
+                # Stop paying for answers nobody will read
+                framed.cancel(reason="client exited")
+                text.cancel("client exited")
+                await send("❌ Closing connection.")
+                break
+
+            if message.lower() == "cancel":
+                if not text.cancel():
+                    await send("❌ No query in progress.")
+                continue
+
+            # "cancel <id>" of a framed query in progress; other text starting with "cancel" is a question
+            if message.lower().startswith("cancel ") and message[len("cancel "):].strip() in framed.tokens:
+                await framed.handle({"type": "cancel", "id": message[len("cancel "):].strip()})
+                continue
+
+            text.submit(message)
+
+        await outbox.join()
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        framed.cancel_all()
+        text.cancel_all()
+        sender.cancel()
@@ -0,0 +1,142 @@
+"""
+Tests for cooperative cancellation and time budgets of agent runs.
+"""
+import threading
+import time
+import pytest
+from src import cancellation, k8s_clusters
+from src.cancellation import (
+    CancellationHandler, CancellationToken, DeadlineExceeded, RunCancelled, aborting, bounded_request_timeout, budget,
+    cancellable, cancellation_stats, check_cancelled, iteration_budget, time_left
+)
+from src.k8s_clusters import fan_out
+from src.llm_scheduler import LLMScheduler
+
+KEY = ("openrouter", "openai/gpt-4o")
+
+
+class TestCancellation:
+    """Tests for src.cancellation."""
+
+    def test_runs_stop_at_their_next_check(self):
+        token = CancellationToken("q1")
+        handler = CancellationHandler()
+        with cancellable(token):
+            check_cancelled()
+            handler.on_tool_start({}, "pods")
+            token.cancel("client disconnected")
+            with pytest.raises(RunCancelled, match="client disconnected"):
+                handler.on_tool_start({}, "pods")
+        # Outside the run nothing is checked
+        check_cancelled()
+        handler.on_llm_start({}, ["prompt"])
+
+    def test_in_flight_operations_are_aborted(self):
+        token = CancellationToken()
+        aborted = threading.Event()
+
+        def read_body():
+            with aborting(aborted.set, "test_reads_aborted"):
+                if not aborted.wait(2):
+                    return "body"
+                raise ConnectionError("connection closed")
+
+        with cancellable(token):
+            threading.Timer(0.05, token.cancel).start()
+            with pytest.raises(RunCancelled):
+                read_body()
+        assert cancellation_stats()["test_reads_aborted"] >= 1
+
+        # Errors of runs that were not cancelled are raised as they are
+        with cancellable(CancellationToken()), pytest.raises(ConnectionError):
+            with aborting(lambda: None, "test_reads_aborted"):
+                raise ConnectionError("reset by peer")
+
+    def test_streams_are_closed_between_chunks(self):
+        token = CancellationToken()
+        closed = []
+
+        def chunks():
+            try:
+                for i in range(10):
+                    if i == 2:
+                        token.cancel()
+                    yield i
+            finally:
+                closed.append(True)
+
+        with pytest.raises(RunCancelled):
+            assert list(token.guard(chunks())) == [0, 1]
+        assert closed == [True]
+
+    def test_cancelled_calls_leave_the_scheduler_queue(self):
+        scheduler = LLMScheduler(rate_per_minute=0, max_concurrency=1)
+        scheduler.acquire(KEY)
+        token = CancellationToken()
+        errors = []
+
+        def wait_for_slot():
+            with cancellable(token):
+                try:
+                    scheduler.acquire(KEY)
+                except RunCancelled as e:
+                    errors.append(e)
+
+        thread = threading.Thread(target=wait_for_slot)
+        thread.start()
+        time.sleep(0.05)
+        assert scheduler.stats()["openrouter/openai/gpt-4o"]["queued"] == 1
+        token.cancel()
+        thread.join(2)
+        assert len(errors) == 1
+        assert scheduler.stats()["openrouter/openai/gpt-4o"] == {"in_flight": 1, "queued": 0, "cancelled": 1}
+
+    def test_stats_count_active_and_cancelled_runs(self, monkeypatch):
+        monkeypatch.setattr(cancellation, "_stats", cancellation.Counter())
+        token = CancellationToken()
+        with cancellable(token):
+            token.cancel()
+            assert cancellation_stats()["active_runs"] >= 1
+            assert cancellation_stats()["cancelling"] >= 1
+        assert cancellation_stats()["runs"] == 1
+        assert cancellation_stats()["runs_cancelled"] == 1
+
+    def test_nested_budgets_only_shorten(self, monkeypatch):
+        monkeypatch.setenv("KUBESAGE_QUERY_TIMEOUT_SECONDS", "120")
+        monkeypatch.setenv("KUBESAGE_MAX_ITERATIONS", "15")
+        assert time_left() is None and iteration_budget() is None
+        with budget():
+            assert 119 < time_left() <= 120 and iteration_budget() == 15
+        with budget(10, 5):
+            with budget():
+                assert 9 < time_left() <= 10 and iteration_budget() == 5
+            with budget(60, 8):
+                assert time_left() <= 10 and iteration_budget() == 5
+            with budget(1, 2):
+                assert time_left() <= 1 and iteration_budget() == 2
+
+    def test_deadline_bounds_llm_waits_and_cluster_calls(self, monkeypatch):
+        scheduler = LLMScheduler(rate_per_minute=0, max_concurrency=1)
+        scheduler.acquire(KEY)
+        start = time.monotonic()
+        with budget(0.1):
+            with pytest.raises(DeadlineExceeded):
+                scheduler.acquire(KEY)
+            with pytest.raises(DeadlineExceeded):
+                CancellationHandler().on_chat_model_start({}, [])
+        assert time.monotonic() - start < 1
+        assert scheduler.stats()["openrouter/openai/gpt-4o"]["queued"] == 0
+
+        monkeypatch.setattr(k8s_clusters, "get_api_client", lambda cluster: None)
+        start = time.monotonic()
+        with budget(0.1):
+            _, errors = fan_out(lambda api_client: time.sleep(1), ["a"], timeout=30)
+        assert time.monotonic() - start < 0.5
+        assert errors["a"].startswith("timed out after 0.")
+
+    def test_kubernetes_request_timeouts_are_clipped_to_the_deadline(self):
+        assert bounded_request_timeout(None, 5) == 5
+        assert bounded_request_timeout(30, 5) == 5
+        assert bounded_request_timeout(2, 5) == 2
+        assert bounded_request_timeout((10, 330), 5) == (5, 5)
+        assert bounded_request_timeout((1, None), 5) == (1, 5)
@@ -0,0 +1,142 @@
+"""
+Tests for cluster snapshots shared between worker processes.
+"""
+import json
+import os
+import time
+from types import SimpleNamespace
+import pytest
+from src import cluster_snapshot
+from src.cluster_snapshot import (
+    ALLOWED_TRANSFORMS, SnapshotSource, collect_once, collector_status, ensure_private_dir, publish, read_snapshot,
+    resolve_transform, transform_name
+)
+from src.rbac_index import slim_rbac_object
+from src.resource_graph import SOURCES, slim_pod
+
+
+def pod(name, labels):
+    return {"metadata": {"name": name, "namespace": "shop", "uid": name, "labels": labels},
+            "spec": {"nodeName": "node-1"}, "status": {"phase": "Running"}}
+
+
+class FakeInformer:
+    """Stands in for a synced informer."""
+
+    def __init__(self, transform, objects=()):
+        self.transform = transform
+        self.version = 0
+        self.store = {}
+        self.replace(objects)
+
+    def replace(self, objects):
+        self.store = {("shop", o["metadata"]["name"]): self.transform(o) for o in objects}
+        self.version += 1
+
+    def snapshot(self):
+        return self.version, dict(self.store)
+
+    def wait_synced(self, timeout=None):
+        return True
+
+
+def api_client(host="https://cluster-a"):
+    return SimpleNamespace(configuration=SimpleNamespace(host=host))
+
+
+@pytest.fixture
+def shared_dir(tmp_path, monkeypatch):
+    """Turns on snapshot sharing without starting the collector election."""
+    monkeypatch.setenv("KUBESAGE_SNAPSHOT_DIR", str(tmp_path))
+    monkeypatch.setattr(cluster_snapshot, "_sources", {})
+    monkeypatch.setattr(cluster_snapshot, "start_snapshot_sharing", lambda: True)
+    return tmp_path
+
+
+class TestClusterSnapshot:
+    """Tests for src.cluster_snapshot."""
+
+    def test_published_snapshot_is_read_back_with_shared_values(self, tmp_path):
+        informer = FakeInformer(slim_pod, [pod("a", {"app": "web"}), pod("b", {"app": "web"})])
+        file = str(tmp_path / "pods.snapshot")
+        publish(informer, file)
+
+        source = SnapshotSource(file, "/api/v1/pods", api_client())
+        a, b = sorted(source.items(), key=lambda p: p.metadata.name)
+        assert a == informer.store[("shop", "a")]
+        assert source.get("shop", "b") == b
+        assert a.metadata.labels is b.metadata.labels
+
+        version = source.version
+        time.sleep(0.01)
+        informer.replace([pod("c", {"app": "api"})])
+        publish(informer, file)
+        assert source.version != version
+        assert [p.metadata.name for p in source.items()] == ["c"]
+
+    def test_transforms_are_referenced_by_name(self):
+        assert resolve_transform(transform_name(slim_pod)) is slim_pod
+        assert resolve_transform(transform_name(None)) is None
+
+    def test_only_allowed_transforms_are_resolved(self):
+        transforms = [transform for _, transform in SOURCES.values()] + [slim_rbac_object]
+        assert {transform_name(t) for t in transforms} <= ALLOWED_TRANSFORMS
+        with pytest.raises(ValueError, match="not allowed"):
+            resolve_transform("os:system")
+
+    def test_snapshots_only_hold_data(self, tmp_path):
+        informer = FakeInformer(slim_rbac_object, [{"metadata": {"name": "a"}, "rules": [{"$t": ["x"]}]}])
+        file = str(tmp_path / "roles.snapshot")
+        publish(informer, file)
+        assert read_snapshot(file)[1] == informer.store
+
+        (tmp_path / "evil.snapshot").write_text('[[["shop", "a"], {"$r": "system", "v": ["id"]}]]')
+        with pytest.raises(ValueError, match="unknown record type"):
+            read_snapshot(str(tmp_path / "evil.snapshot"))
+
+    def test_shared_dir_must_be_private(self, tmp_path):
+        directory = tmp_path / "shared"
+        ensure_private_dir(str(directory))
+        assert os.stat(directory).st_mode & 0o077 == 0
+
+        os.chmod(directory, 0o777)
+        with pytest.raises(PermissionError, match="writable by other users"):
+            ensure_private_dir(str(directory))
+
+    def test_get_source_uses_the_informer_without_a_shared_dir(self, monkeypatch):
+        monkeypatch.delenv("KUBESAGE_SNAPSHOT_DIR", raising=False)
+        informer = FakeInformer(slim_pod)
+        monkeypatch.setattr(cluster_snapshot, "get_informer", lambda path, transform, client: informer)
+        assert cluster_snapshot.get_source("/api/v1/pods", slim_pod, api_client()) is informer
+
+    def test_workers_read_what_the_collector_publishes(self, shared_dir, monkeypatch):
+        source = cluster_snapshot.get_source("/api/v1/pods", slim_pod, api_client())
+        assert isinstance(source, SnapshotSource)
+        assert not source.wait_synced(0)
+
+        informer = FakeInformer(slim_pod, [pod("a", {"app": "web"})])
+        started = []
+
+        def get_informer(path, transform, client):
+            started.append((path, transform))
+            return informer
+
+        monkeypatch.setattr(cluster_snapshot, "get_informer", get_informer)
+        published = {}
+        collect_once(str(shared_dir), api_client(), published)
+        collect_once(str(shared_dir), api_client("https://cluster-b"), {})
+        assert started == [("/api/v1/pods", slim_pod)]
+        assert source.wait_synced(0)
+        assert [p.metadata.name for p in source.items()] == ["a"]
+
+        # Unchanged collections are not written again
+        mtime = os.stat(source.file).st_mtime_ns
+        collect_once(str(shared_dir), api_client(), published)
+        assert os.stat(source.file).st_mtime_ns == mtime
+
+    def test_stale_collector_status_means_no_collector(self, shared_dir):
+        status = {"pid": 1, "host": "https://cluster-a", "history": True, "updated": time.time()}
+        (shared_dir / cluster_snapshot.STATUS_FILE).write_text(json.dumps(status))
+        assert collector_status()["history"] is True
+        (shared_dir / cluster_snapshot.STATUS_FILE).write_text(json.dumps({**status, "updated": time.time() - 3600}))
+        assert collector_status() is None
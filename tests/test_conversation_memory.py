@@ -0,0 +1,64 @@
+"""
+Tests for the conversation_memory module.
+"""
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import get_buffer_string
+from src.conversation_memory import OMITTED, create_memory, memory_state, restore_memory, strip_tool_output
+from src.session_store import decode, encode
+
+
+class TestConversationMemory:
+    """Tests for the token-bounded summarizing memory."""
+
+    def test_strip_tool_output_drops_large_fenced_dumps(self):
+        dump = "```json\n" + '{"name": "web-1"},\n' * 100 + "```"
+        text = f"The pods are:\n{dump}\nLooks fine."
+        assert strip_tool_output(text) == f"The pods are:\n{OMITTED}\nLooks fine."
+
+    def test_strip_tool_output_keeps_short_fenced_blocks(self):
+        text = "Apply this fix:\n```yaml\nspec:\n  replicas: 3\n```\nThen retry."
+        assert strip_tool_output(text) == text
+
+    def test_recent_turns_stay_within_budget(self):
+        llm = FakeListChatModel(responses=["summary one", "summary two", "summary three"])
+        memory = create_memory(llm, max_tokens=100)
+
+        for turn in range(10):
+            memory.save_context({"input": f"question {turn} " + "x" * 100}, {"output": f"answer {turn} " + "y" * 100})
+
+        assert sum(memory.count_tokens(m) for m in memory.chat_memory.messages) <= 100
+        assert memory.moving_summary_buffer.startswith("summary")
+        history = get_buffer_string(memory.load_memory_variables({})["chat_history"])
+        assert "answer 9" in history
+        assert "question 0" not in history
+
+    def test_failed_summary_keeps_the_turns(self):
+        class FailingLLM(FakeListChatModel):
+            def _call(self, *args, **kwargs):
+                raise ConnectionError("LLM unreachable")
+
+        memory = create_memory(FailingLLM(responses=[""]), max_tokens=100)
+        for turn in range(3):
+            memory.save_context({"input": f"question {turn} " + "x" * 100}, {"output": f"answer {turn} " + "y" * 100})
+
+        messages = memory.chat_memory.messages
+        assert memory.moving_summary_buffer == ""
+        assert [m.type for m in messages] == ["human", "ai"] * 3
+        assert messages[0].content.startswith("question 0")
+
+    def test_tool_output_is_not_stored(self):
+        memory = create_memory(FakeListChatModel(responses=["summary"]), max_tokens=1000)
+        dump = "```\n" + "pod web-1 Running\n" * 100 + "```"
+        memory.save_context({"input": "list pods"}, {"output": f"Here they are:\n{dump}"})
+        assert "web-1" not in get_buffer_string(memory.load_memory_variables({})["chat_history"])
+
+    def test_state_round_trips_through_the_session_store_encoding(self):
+        llm = FakeListChatModel(responses=["summary"])
+        memory = create_memory(llm, max_tokens=1000)
+        memory.moving_summary_buffer = "earlier: node-1 was NotReady"
+        memory.save_context({"input": "why is web failing?"}, {"output": "The image tag does not exist."})
+
+        restored = restore_memory(llm, decode(encode(memory_state(memory))), max_tokens=1000)
+        assert restored.moving_summary_buffer == memory.moving_summary_buffer
+        assert restored.chat_memory.messages == memory.chat_memory.messages
+        assert restore_memory(llm, None).chat_memory.messages == []
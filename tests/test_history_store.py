@@ -0,0 +1,91 @@
+"""
+Tests for the history_store module.
+"""
+import pytest
+from src.history_store import HistoryStore, diff_objects, start_history_recording
+
+
+def pod(name, ready, restarts=0, namespace="shop"):
+    return {"metadata": {"name": name, "namespace": namespace, "uid": "u1"}, "ready": ready, "restarts": restarts}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return HistoryStore(str(tmp_path / "history.db"), retention_hours=24, compact_after_hours=1)
+
+
+class TestHistoryStore:
+    """Tests for recording and querying cluster history."""
+
+    def test_recording_is_opt_in(self, monkeypatch):
+        monkeypatch.delenv("KUBESAGE_HISTORY_ENABLED", raising=False)
+        assert start_history_recording() is None
+        monkeypatch.setenv("KUBESAGE_HISTORY_ENABLED", "no")
+        assert start_history_recording() is None
+
+    def test_diff_objects(self):
+        old = {"metadata": {"uid": "1", "labels": {"v": "1"}}, "images": ["web:1"], "ready": 2}
+        new = {"metadata": {"uid": "2", "labels": {"v": "2"}}, "images": ["web:2"], "ready": 2}
+
+        assert diff_objects(old, new) == {"metadata.labels.v": ["1", "2"], "images": [["web:1"], ["web:2"]]}
+
+    def test_changes_in_window(self, store):
+        store.record_change("Pod", "ADDED", None, pod("web-1", True), ts=1000)
+        store.record_change("Pod", "MODIFIED", pod("web-1", True), pod("web-1", False, 3), ts=2000)
+        store.record_change("Deployment", "MODIFIED", {"metadata": {"name": "web", "namespace": "shop"}, "images": ["a"]},
+                            {"metadata": {"name": "web", "namespace": "shop"}, "images": ["b"]}, ts=1900)
+        store.record_change("Pod", "DELETED", pod("db-0", True, namespace="data"), None, ts=2100)
+        store.flush()
+
+        result = store.changes(since=1500, until=2050)
+        assert result["total"] == 2
+        assert [c["kind"] for c in result["changes"]] == ["Pod", "Deployment"]
+        assert result["changes"][0]["fields"] == {"ready": [True, False], "restarts": [0, 3]}
+
+        pods = store.changes(since=0, until=3000, kind="Pod", namespace="shop")
+        assert pods["summary"] == {"Pod": {"ADDED": 1, "MODIFIED": 1}}
+
+    def test_unchanged_modification_is_skipped(self, store):
+        store.record_change("Pod", "MODIFIED", pod("web-1", True), {**pod("web-1", True), "metadata": {
+            "name": "web-1", "namespace": "shop", "uid": "other"}}, ts=1000)
+        assert store.flush() == 0
+
+    def test_trends_rank_by_growth(self, store):
+        for minute in range(5):
+            store.record_samples("Pod", [
+                ("shop", "leaky", 0.1, (100 + 50 * minute) * 2 ** 20),
+                ("shop", "steady", 0.5, 200 * 2 ** 20),
+            ], ts=1000 + 60 * minute)
+        store.flush()
+
+        trends = store.trends("Pod", since=0, until=2000)
+
+        assert [t["name"] for t in trends] == ["leaky", "steady"]
+        assert trends[0]["memory_mi"]["first"] == 100
+        assert trends[0]["memory_mi"]["last"] == 300
+        assert trends[0]["samples"] == 5
+        steady = store.trends("Pod", since=0, until=2000, name="steady")
+        assert [t["name"] for t in steady] == ["steady"]
+        assert steady[0]["cpu_m"]["avg"] == 500
+
+    def test_compaction_and_retention(self, store):
+        now = 100 * 3600
+        # Two samples in one old 10-minute bucket, one recent sample, one past retention
+        store.record_samples("Node", [(None, "node-1", 1.0, 1.0)], ts=now - 2 * 3600 - 100)
+        store.record_samples("Node", [(None, "node-1", 3.0, 3.0)], ts=now - 2 * 3600 - 50)
+        store.record_samples("Node", [(None, "node-1", 5.0, 5.0)], ts=now - 60)
+        store.record_samples("Node", [(None, "node-1", 9.0, 9.0)], ts=now - 30 * 3600)
+        store.record_change("Node", "ADDED", None, {"metadata": {"name": "node-1"}}, ts=now - 30 * 3600)
+        store.flush()
+
+        store.maintain(now)
+
+        trends = store.trends("Node", since=0, until=now)
+        assert trends[0]["samples"] == 2
+        assert trends[0]["cpu_m"]["first"] == 2000
+        assert trends[0]["cpu_m"]["last"] == 5000
+        assert store.changes(since=0, until=now)["total"] == 0
+
+        # Compacting again leaves the compacted bucket as it is
+        store.maintain(now)
+        assert store.trends("Node", since=0, until=now)[0]["samples"] == 2
@@ -0,0 +1,96 @@
+"""
+Tests for the jobs module.
+"""
+import asyncio
+import threading
+import time
+import pytest
+from langchain_core.tools import Tool
+from src.jobs import FAILED, SUCCEEDED, JobManager, JobProgressHandler, JobQueueFull
+
+
+def wait_until_finished(job, timeout=2.0):
+    deadline = time.time() + timeout
+    while job.finished_at is None and time.time() < deadline:
+        time.sleep(0.01)
+
+
+class TestJobs:
+    """Tests for the background job manager."""
+
+    def test_job_result_and_events(self):
+        manager = JobManager(workers=1)
+        job = manager.submit(lambda job: {"output": "done"}, description="check pods")
+        wait_until_finished(job)
+
+        assert job.status == SUCCEEDED
+        assert job.result == {"output": "done"}
+        assert [event["type"] for event in job.events] == ["queued", "running", "succeeded"]
+        assert manager.get(job.id) is job
+
+    def test_failed_job_keeps_error(self):
+        manager = JobManager(workers=1)
+
+        def fail(job):
+            raise RuntimeError("cluster unreachable")
+
+        job = manager.submit(fail)
+        wait_until_finished(job)
+
+        assert job.status == FAILED
+        assert job.error == "cluster unreachable"
+        assert job.events[-1] == {"type": "failed", "time": job.events[-1]["time"], "error": "cluster unreachable"}
+
+    def test_pending_jobs_are_bounded(self):
+        manager = JobManager(workers=1, max_pending=2)
+        release = threading.Event()
+        manager.submit(lambda job: release.wait(2))
+        manager.submit(lambda job: release.wait(2))
+
+        with pytest.raises(JobQueueFull):
+            manager.submit(lambda job: None)
+        release.set()
+
+    def test_finished_jobs_expire(self):
+        manager = JobManager(workers=1, ttl=0.05)
+        job = manager.submit(lambda job: None)
+        wait_until_finished(job)
+        time.sleep(0.1)
+
+        assert manager.get(job.id) is None
+
+    def test_wait_for_events_returns_new_events(self):
+        manager = JobManager(workers=1)
+        job = manager.submit(lambda job: time.sleep(0.1))
+
+        events = job.wait_for_events(0, timeout=1)
+        assert events[0]["type"] == "queued"
+        wait_until_finished(job)
+        assert [e["type"] for e in job.wait_for_events(1, timeout=1)] == ["running", "succeeded"]
+
+    def test_next_events_wakes_on_new_events(self):
+        manager = JobManager(workers=1)
+        release = threading.Event()
+        job = manager.submit(lambda job: release.wait(2))
+
+        async def follow():
+            cursor = len(await job.next_events(0, timeout=1))
+            assert await job.next_events(5, timeout=0.01) == []
+            threading.Timer(0.05, release.set).start()
+            events = []
+            while not events or events[-1]["type"] != SUCCEEDED:
+                events += await job.next_events(cursor + len(events), timeout=1)
+            return events
+
+        assert [e["type"] for e in asyncio.run(follow())][-1] == SUCCEEDED
+        assert job._waiters == []
+
+    def test_progress_handler_records_tool_calls(self):
+        manager = JobManager(workers=1)
+        tool = Tool(name="get_all_pods_with_usage", description="Lists pods.", func=lambda _: "pods")
+
+        job = manager.submit(lambda job: tool.invoke("", config={"callbacks": [JobProgressHandler(job)]}))
+        wait_until_finished(job)
+
+        assert [(e["type"], e.get("tool")) for e in job.events[2:4]] == [
+            ("tool_start", "get_all_pods_with_usage"), ("tool_end", "get_all_pods_with_usage")]
@@ -0,0 +1,67 @@
+"""
+Tests for the k8s_clusters module.
+"""
+import time
+import pytest
+from src import k8s_clusters
+from src.k8s_clusters import fan_out, resolve_clusters
+from src.k8s_utils import collect
+
+CONTEXTS = [{"name": "prod-eu"}, {"name": "prod-us"}, {"name": "staging"}]
+
+
+@pytest.fixture
+def kubeconfig(monkeypatch):
+    monkeypatch.delenv("KUBERNETES_SERVICE_HOST", raising=False)
+    monkeypatch.delenv("KUBESAGE_CLUSTERS", raising=False)
+    monkeypatch.setattr(k8s_clusters.config, "list_kube_config_contexts", lambda: (CONTEXTS, CONTEXTS[2]))
+    # API clients are stood in for by the cluster name
+    monkeypatch.setattr(k8s_clusters, "get_api_client", lambda cluster: cluster)
+
+
+class TestClusters:
+    """Tests for cluster selection and concurrent fan-out."""
+
+    def test_current_context_is_the_default(self, kubeconfig):
+        assert k8s_clusters.configured_clusters() == ["staging"]
+
+    def test_configured_selection(self, kubeconfig, monkeypatch):
+        monkeypatch.setenv("KUBESAGE_CLUSTERS", "all")
+        assert resolve_clusters("all") == ["prod-eu", "prod-us", "staging"]
+        assert resolve_clusters("prod-us, staging") == ["prod-us", "staging"]
+        with pytest.raises(ValueError, match="Unknown cluster"):
+            resolve_clusters("dev")
+
+    def test_fan_out_runs_clusters_concurrently(self, kubeconfig):
+        def slow(cluster):
+            time.sleep(0.2)
+            if cluster == "prod-us":
+                raise RuntimeError("connection refused")
+            return cluster.upper()
+
+        start = time.perf_counter()
+        results, errors = fan_out(slow, ["prod-eu", "prod-us", "staging"])
+
+        assert time.perf_counter() - start < 0.5
+        assert results == {"prod-eu": "PROD-EU", "staging": "STAGING"}
+        assert errors == {"prod-us": "connection refused"}
+
+    def test_fan_out_reports_slow_clusters(self, kubeconfig):
+        results, errors = fan_out(lambda c: time.sleep(1 if c == "staging" else 0) or c, ["prod-eu", "staging"],
+                                  timeout=0.2)
+        assert results == {"prod-eu": "prod-eu"}
+        assert "timed out" in errors["staging"]
+
+    def test_collect_labels_items_with_their_cluster(self, kubeconfig, monkeypatch):
+        monkeypatch.setenv("KUBESAGE_CLUSTERS", "all")
+
+        def fetch(cluster):
+            if cluster == "staging":
+                raise RuntimeError("forbidden")
+            return [{"name": "crashing", "status": "CrashLoopBackOff"}]
+
+        result = collect("pods", fetch, "all")
+
+        assert result["status"] == "success"
+        assert [pod["cluster"] for pod in result["pods"]] == ["prod-eu", "prod-us"]
+        assert result["cluster_errors"] == {"staging": "forbidden"}
@@ -207,3 +207,50 @@ class TestK8sDepthUtilsIntegration:
             assert "status" in result
             if result["status"] == "error":
                 assert "message" in result
+
+
+class TestObjectSerialization:
+    """Tests for the object export helpers."""
+
+    def make_object(self):
+        return {
+            "apiVersion": "v1",
+            "kind": "Pod",
+            "metadata": {
+                "name": "web",
+                "resourceVersion": "42",
+                "managedFields": [{"manager": "kubectl"}],
+                "annotations": {"kubectl.kubernetes.io/last-applied-configuration": "{...}"},
+            },
+            "spec": {"containers": [{"name": "web", "image": "nginx"}]},
+        }
+
+    def test_strip_noise_fields(self):
+        from src.k8s_depth_utils import strip_noise_fields
+        obj = strip_noise_fields(self.make_object())
+        assert "managedFields" not in obj["metadata"]
+        assert "annotations" not in obj["metadata"]
+
+    def test_serialize_object_formats(self):
+        import json
+        import yaml
+        from src.k8s_depth_utils import serialize_object
+        obj = self.make_object()
+        assert yaml.safe_load(serialize_object(obj, "yaml")) == obj
+        compact = serialize_object(obj, "json")
+        assert json.loads(compact) == obj
+        assert ", " not in compact
+
+    def test_serialization_is_cached_by_resource_version(self):
+        from src.k8s_depth_utils import _cached_serialization
+        key = ("pod", "default", "cached-web", "42", "yaml", True)
+        first = _cached_serialization(key, self.make_object(), "yaml", True)
+        changed = self.make_object()
+        changed["spec"]["containers"][0]["image"] = "httpd"
+        assert _cached_serialization(key, changed, "yaml", True) == first
+        newer_key = ("pod", "default", "cached-web", "43", "yaml", True)
+        assert "httpd" in _cached_serialization(newer_key, changed, "yaml", True)
+
+    def test_unsupported_output_format(self, skip_if_no_k8s):
+        result = get_kubernetes_object_yaml("pod", "test", "default", output_format="xml")
+        assert result["status"] == "error"
@@ -0,0 +1,114 @@
+"""
+Tests for the k8s_discovery module.
+"""
+import io
+import json
+import urllib3
+import pytest
+from src.k8s_discovery import DiscoveryCache, ResourceInfo
+
+
+def aggregated_document(items):
+    return {"kind": "APIGroupDiscoveryList", "items": items}
+
+
+CORE_AGGREGATED = aggregated_document([{
+    "metadata": {"name": ""},
+    "versions": [{"version": "v1", "resources": [
+        {"resource": "pods", "singularResource": "pod", "responseKind": {"kind": "Pod"},
+         "scope": "Namespaced", "shortNames": ["po"], "verbs": ["get", "list"]},
+        {"resource": "nodes", "singularResource": "node", "responseKind": {"kind": "Node"},
+         "scope": "Cluster", "shortNames": ["no"], "verbs": ["get", "list"]},
+    ]}],
+}])
+
+GROUPS_AGGREGATED = aggregated_document([{
+    "metadata": {"name": "argoproj.io"},
+    "versions": [
+        {"version": "v1alpha1", "resources": [
+            {"resource": "rollouts", "singularResource": "rollout", "responseKind": {"kind": "Rollout"},
+             "scope": "Namespaced", "shortNames": ["ro"], "verbs": ["get", "list", "watch"]},
+        ]},
+    ],
+}])
+
+
+class FakeApiClient:
+    """Serves canned JSON documents by path."""
+
+    class configuration:
+        host = "https://fake-cluster:6443"
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.requests = []
+
+    def call_api(self, path, method, header_params=None, **kwargs):
+        self.requests.append(path)
+        body = json.dumps(self.documents[path]).encode()
+        return urllib3.HTTPResponse(body=io.BytesIO(body), status=200, preload_content=False,
+                                    headers={"Content-Length": str(len(body))})
+
+
+@pytest.fixture
+def aggregated_client():
+    return FakeApiClient({"/api": CORE_AGGREGATED, "/apis": GROUPS_AGGREGATED})
+
+
+class TestDiscovery:
+    """Tests for cached discovery and name resolution."""
+
+    def test_resolves_kinds_plurals_and_short_names(self, aggregated_client, tmp_path):
+        discovery = DiscoveryCache(aggregated_client, str(tmp_path / "d.json"), refresh_interval=0)
+        for name in ("pod", "Pods", "po", "Pod"):
+            assert discovery.resolve(name).plural == "pods"
+        rollout = discovery.resolve("rollouts.argoproj.io")
+        assert rollout.kind == "Rollout"
+        assert discovery.resolve("ro") is rollout
+        assert rollout.object_path("canary", "prod") == "/apis/argoproj.io/v1alpha1/namespaces/prod/rollouts/canary"
+        assert discovery.resolve("node").object_path("n1") == "/api/v1/nodes/n1"
+        assert aggregated_client.requests == ["/api", "/apis"]
+
+    def test_lookups_do_not_hit_the_api(self, aggregated_client, tmp_path):
+        discovery = DiscoveryCache(aggregated_client, str(tmp_path / "d.json"), refresh_interval=0)
+        discovery.resolve("pod")
+        for _ in range(10):
+            discovery.resolve("rollout")
+        assert len(aggregated_client.requests) == 2
+
+    def test_unknown_name_refresh_is_rate_limited(self, aggregated_client, tmp_path):
+        discovery = DiscoveryCache(aggregated_client, str(tmp_path / "d.json"), refresh_interval=0)
+        assert discovery.resolve("certificate") is None
+        assert discovery.resolve("certificate") is None
+        assert len(aggregated_client.requests) == 2
+
+    def test_document_is_reused_from_disk(self, aggregated_client, tmp_path):
+        path = str(tmp_path / "d.json")
+        DiscoveryCache(aggregated_client, path, refresh_interval=0).resolve("pod")
+
+        offline = FakeApiClient({})
+        assert DiscoveryCache(offline, path, refresh_interval=0).resolve("rollout").group == "argoproj.io"
+        assert offline.requests == []
+
+    def test_falls_back_to_legacy_discovery(self, tmp_path):
+        legacy = FakeApiClient({
+            "/api": {"kind": "APIVersions", "versions": ["v1"]},
+            "/apis": {"kind": "APIGroupList", "groups": [
+                {"name": "apps", "preferredVersion": {"groupVersion": "apps/v1", "version": "v1"}},
+            ]},
+            "/api/v1": {"resources": [
+                {"name": "pods", "singularName": "pod", "namespaced": True, "kind": "Pod", "verbs": ["get"]},
+                {"name": "pods/log", "namespaced": True, "kind": "Pod", "verbs": ["get"]},
+            ]},
+            "/apis/apps/v1": {"resources": [
+                {"name": "deployments", "singularName": "deployment", "namespaced": True, "kind": "Deployment",
+                 "shortNames": ["deploy"], "verbs": ["get", "list"]},
+            ]},
+        })
+        discovery = DiscoveryCache(legacy, str(tmp_path / "d.json"), refresh_interval=0)
+        assert discovery.resolve("deploy").collection_path("default") == "/apis/apps/v1/namespaces/default/deployments"
+        assert len(discovery.resources()) == 2
+
+    def test_resource_info_round_trips(self):
+        info = ResourceInfo("cert-manager.io", "v1", "Certificate", "certificates", "certificate", ["cert"], True)
+        assert ResourceInfo(**info.to_dict()).names() == info.names()
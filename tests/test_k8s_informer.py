@@ -0,0 +1,114 @@
+"""
+Tests for the k8s_informer module.
+"""
+import io
+import json
+import urllib3
+from src.k8s_informer import Informer
+
+
+def response(body: bytes):
+    return urllib3.HTTPResponse(body=io.BytesIO(body), status=200, preload_content=False)
+
+
+def obj(name, namespace="default", resource_version="1", **fields):
+    return {"metadata": {"name": name, "namespace": namespace, "resourceVersion": resource_version}, **fields}
+
+
+class FakeApiClient:
+    """Serves a list document, then one canned watch stream per watch request."""
+
+    class configuration:
+        host = "https://fake-cluster:6443"
+
+    def __init__(self, items, watches):
+        self.items = items
+        self.watches = list(watches)
+        self.requests = []
+
+    def call_api(self, path, method, query_params=None, **kwargs):
+        params = dict(query_params or [])
+        self.requests.append(params)
+        if params.get("watch") == "true":
+            events = self.watches.pop(0) if self.watches else []
+            return response(b"".join(json.dumps(event).encode() + b"\n" for event in events))
+        return response(json.dumps({"metadata": {"resourceVersion": "10"}, "items": self.items}).encode())
+
+
+class TestInformer:
+    """Tests for list-and-watch caching."""
+
+    def test_list_then_apply_watch_events(self):
+        api_client = FakeApiClient([obj("a"), obj("b")], [[
+            {"type": "MODIFIED", "object": obj("a", resource_version="11", spec={"x": 1})},
+            {"type": "DELETED", "object": obj("b", resource_version="12")},
+            {"type": "ADDED", "object": obj("c", namespace="other", resource_version="13")},
+        ]])
+        informer = Informer(api_client, "/api/v1/pods")
+
+        informer._list()
+        assert informer.wait_synced(0)
+        assert informer._resource_version == "10"
+        informer._watch()
+
+        assert informer.get("default", "a")["spec"] == {"x": 1}
+        assert informer.get("default", "b") is None
+        assert informer.get("other", "c") is not None
+        assert informer._resource_version == "13"
+        assert api_client.requests[1]["resourceVersion"] == "10"
+
+    def test_version_changes_with_store(self):
+        api_client = FakeApiClient([obj("a")], [[
+            {"type": "BOOKMARK", "object": {"metadata": {"resourceVersion": "20"}}},
+        ]])
+        informer = Informer(api_client, "/api/v1/pods")
+
+        informer._list()
+        version = informer.version
+        informer._watch()
+
+        # Bookmarks advance the resume point without changing any object
+        assert informer.version == version
+        assert informer._resource_version == "20"
+
+    def test_expired_watch_relists(self):
+        api_client = FakeApiClient([obj("a")], [[
+            {"type": "ERROR", "object": {"kind": "Status", "code": 410, "message": "too old resource version"}},
+        ]])
+        informer = Informer(api_client, "/api/v1/pods")
+
+        informer._list()
+        informer._watch()
+
+        assert informer._resource_version is None
+
+    def test_transform_applies_to_listed_and_watched_objects(self):
+        api_client = FakeApiClient([obj("a", spec={"big": "x"})], [[
+            {"type": "ADDED", "object": obj("b", spec={"big": "y"})},
+        ]])
+        informer = Informer(api_client, "/api/v1/pods", transform=lambda o: {"name": o["metadata"]["name"]})
+
+        informer._list()
+        informer._watch()
+
+        assert sorted(item["name"] for item in informer.items()) == ["a", "b"]
+
+    def test_listeners_see_changes_and_relist_differences(self):
+        api_client = FakeApiClient([obj("a"), obj("b")], [[
+            {"type": "MODIFIED", "object": obj("a", resource_version="11", spec={"x": 1})},
+            # Same transformed object: no change to report
+            {"type": "MODIFIED", "object": obj("a", resource_version="11", spec={"x": 1})},
+        ]])
+        informer = Informer(api_client, "/api/v1/pods", transform=lambda o: {
+            "metadata": {"name": o["metadata"]["name"]}, "spec": o.get("spec")})
+        events = []
+        informer.add_listener(lambda event_type, old, new: events.append((event_type, (new or old)["metadata"]["name"])))
+
+        informer._list()
+        informer._watch()
+        assert events == [("MODIFIED", "a")]
+
+        # A relist after the watch expired reports what changed in between
+        api_client.items = [obj("a", spec={"x": 1}), obj("c")]
+        informer._list()
+        assert sorted(events[1:]) == [("ADDED", "c"), ("DELETED", "b")]
@@ -0,0 +1,56 @@
+"""
+Tests for the k8s_records module.
+"""
+from src.k8s_records import ObjectMeta, PodRecord, pairs, shared, to_plain
+from src.resource_graph import slim_pod
+
+
+def pod_json(name, labels, owner_uid="rs-1"):
+    return {
+        "metadata": {"name": name, "namespace": "shop", "uid": f"uid-{name}", "labels": labels,
+                     "ownerReferences": [{"kind": "ReplicaSet", "name": "web-1", "uid": owner_uid}]},
+        "spec": {"nodeName": "node-1", "containers": [{"ports": [{"name": "http"}]}]},
+        "status": {"phase": "Running", "conditions": [{"type": "Ready", "status": "True"}]},
+    }
+
+
+class TestRecords:
+    """Tests for compact object records."""
+
+    def test_equality_and_hash_by_value(self):
+        a = slim_pod(pod_json("web-a", {"app": "web"}))
+        b = slim_pod(pod_json("web-a", {"app": "web"}))
+
+        assert a == b
+        assert hash(a) == hash(b)
+        assert a != slim_pod(pod_json("web-a", {"app": "api"}))
+
+    def test_repeated_values_are_shared(self):
+        a = slim_pod(pod_json("web-a", {"app": "web", "tier": "front"}))
+        b = slim_pod(pod_json("web-b", {"tier": "front", "app": "web"}))
+
+        assert a.metadata.labels is b.metadata.labels
+        assert a.metadata.owners is b.metadata.owners
+        assert a.ports is b.ports
+        assert a.node is b.node
+
+    def test_records_have_no_instance_dict(self):
+        record = slim_pod(pod_json("web-a", {"app": "web"}))
+        assert not hasattr(record, "__dict__")
+        assert not hasattr(record.metadata, "__dict__")
+
+    def test_to_plain(self):
+        record = slim_pod(pod_json("web-a", {"app": "web"}))
+        plain = to_plain(record)
+
+        assert plain["metadata"]["labels"] == {"app": "web"}
+        assert plain["metadata"]["owners"] == [{"kind": "ReplicaSet", "name": "web-1", "uid": "rs-1"}]
+        assert plain["ports"] == ["http"]
+        assert plain["ready"] is True
+
+    def test_helpers(self):
+        assert pairs({"b": "2", "a": "1"}) == (("a", "1"), ("b", "2"))
+        assert pairs(None) == ()
+        assert shared(("x", "y")) is shared(("x", "y"))
+        meta = ObjectMeta("n", None, None, (), ())
+        assert PodRecord(meta, None, (), (), None, False, 0, None).metadata is meta
@@ -2,9 +2,11 @@
 Integration tests for k8s_utils module.
 """
 import pytest
+from src import k8s_utils
 from src.k8s_utils import (
     get_all_pods_with_usage, get_all_services, get_all_deployments,
-    get_all_nodes, get_all_endpoints, get_cluster_events, get_all_namespaces
+    get_all_nodes, get_all_endpoints, get_cluster_events, get_all_namespaces,
+    analyze_node_capacity, parse_quantity
 )
 
 
@@ -109,3 +111,143 @@ class TestK8sUtilsIntegration:
             assert "status" in result
             if result["status"] == "error":
                 assert "message" in result
+
+
+@pytest.fixture
+def fake_lists(monkeypatch):
+    """Serves canned list items by path instead of calling the API server."""
+    documents = {}
+    monkeypatch.setattr(k8s_utils, "load_kube_config", lambda: None)
+    monkeypatch.setattr(k8s_utils, "list_items", lambda path, api_client=None: documents[path])
+    return documents
+
+
+class TestRawJsonProjection:
+    """Tests for the raw-JSON list path and its field projection."""
+
+    def test_pods_are_joined_with_metrics(self, fake_lists):
+        fake_lists["/api/v1/pods"] = [
+            {"metadata": {"name": "web", "namespace": "default"},
+             "spec": {"nodeName": "node-1"}, "status": {"phase": "Running"}},
+            {"metadata": {"name": "pending", "namespace": "default"}, "spec": {}, "status": {"phase": "Pending"}},
+        ]
+        fake_lists["/apis/metrics.k8s.io/v1beta1/pods"] = [
+            {"metadata": {"name": "web"}, "containers": [{"usage": {"cpu": "5m", "memory": "10Mi"}}]},
+        ]
+
+        pods = get_all_pods_with_usage()["pods"]
+
+        assert pods[0] == {"name": "web", "namespace": "default", "status": "Running",
+                           "node": "node-1", "cpu": "5m", "memory": "10Mi"}
+        assert pods[1]["node"] is None
+        assert pods[1]["cpu"] == "N/A"
+
+    def test_nodes_services_and_events(self, fake_lists):
+        fake_lists["/api/v1/nodes"] = [{"metadata": {"name": "node-1"}, "status": {
+            "conditions": [{"type": "MemoryPressure"}, {"type": "Ready"}], "capacity": {"cpu": "4"}}}]
+        fake_lists["/api/v1/services"] = [{"metadata": {"name": "web", "namespace": "default"},
+                                           "spec": {"type": "ClusterIP", "ports": [{"port": 80, "protocol": "TCP"}]}}]
+        fake_lists["/api/v1/events"] = [{"type": "Normal", "message": f"event {i}", "involvedObject": {"kind": "Pod"}}
+                                        for i in range(15)]
+
+        assert get_all_nodes()["nodes"] == [{"name": "node-1", "status": "Ready", "capacity": {"cpu": "4"}}]
+        assert get_all_services()["services"][0]["ports"] == [{"port": 80, "protocol": "TCP"}]
+        events = get_cluster_events()["events"]
+        assert len(events) == 10
+        assert events[-1] == {"type": "Normal", "message": "event 14", "involved_object": "Pod"}
+
+    def test_endpoints_without_subsets_are_skipped(self, fake_lists):
+        fake_lists["/api/v1/endpoints"] = [
+            {"metadata": {"name": "empty", "namespace": "default"}},
+            {"metadata": {"name": "web", "namespace": "default"},
+             "subsets": [{"addresses": [{"ip": "10.0.0.1"}], "ports": [{"port": 8080}]}]},
+        ]
+
+        assert get_all_endpoints()["endpoints"] == [
+            {"name": "web", "namespace": "default", "addresses": ["10.0.0.1"], "ports": [8080]}]
+
+
+def container(requests=None, limits=None):
+    return {"resources": {"requests": requests or {}, "limits": limits or {}}}
+
+
+def node(name, cpu="4", memory="8Gi", conditions=None, unschedulable=False):
+    return {"metadata": {"name": name}, "spec": {"unschedulable": unschedulable},
+            "status": {"allocatable": {"cpu": cpu, "memory": memory, "pods": "110"},
+                       "conditions": conditions or [{"type": "Ready", "status": "True"}]}}
+
+
+def scheduled_pod(node_name, containers, phase="Running", init_containers=None):
+    return {"metadata": {"name": "p", "namespace": "default"}, "status": {"phase": phase},
+            "spec": {"nodeName": node_name, "containers": containers, "initContainers": init_containers or []}}
+
+
+class TestNodeCapacity:
+    """Tests for the bulk node capacity analysis."""
+
+    def test_parse_quantity(self):
+        assert parse_quantity("250m") == 0.25
+        assert parse_quantity("2") == 2.0
+        assert parse_quantity("1Gi") == 2 ** 30
+        assert parse_quantity("1.5M") == 1.5e6
+        assert parse_quantity("2e3") == 2000.0
+        assert parse_quantity("100n") == pytest.approx(1e-7)
+        with pytest.raises(ValueError):
+            parse_quantity("1Xi")
+
+    def test_requests_limits_and_usage_are_joined(self, fake_lists):
+        fake_lists["/api/v1/nodes"] = [node("busy"), node("idle")]
+        fake_lists["/apis/metrics.k8s.io/v1beta1/nodes"] = [
+            {"metadata": {"name": "busy"}, "usage": {"cpu": "3", "memory": "2Gi"}},
+            {"metadata": {"name": "idle"}, "usage": {"cpu": "100m", "memory": "1Gi"}},
+        ]
+        fake_lists["/api/v1/pods"] = [
+            scheduled_pod("busy", [container({"cpu": "1", "memory": "1Gi"}, {"cpu": "4", "memory": "4Gi"}),
+                                   container({"cpu": "1"}, {"cpu": "2"})]),
+            # Init containers count when larger than the app containers
+            scheduled_pod("idle", [container({"cpu": "100m"})], init_containers=[container({"cpu": "500m"})]),
+            # Finished pods no longer hold their requests
+            scheduled_pod("idle", [container({"cpu": "4"})], phase="Succeeded"),
+        ]
+
+        result = analyze_node_capacity()
+
+        assert result["status"] == "success"
+        busy, idle = result["hot_nodes"]
+        assert busy["name"] == "busy"
+        assert busy["cpu_requests_pct"] == 50.0
+        assert busy["cpu_limits_pct"] == 150.0
+        assert busy["cpu_usage_pct"] == 75.0
+        assert busy["pods"] == 1
+        assert idle["cpu_requests_pct"] == 12.5
+        assert idle["pods"] == 1
+        assert [row["name"] for row in result["overcommitted_nodes"]] == ["busy"]
+        assert result["summary"]["metrics_available"]
+
+    def test_conditions_and_missing_metrics(self, fake_lists, monkeypatch):
+        fake_lists["/api/v1/nodes"] = [
+            node("ok"),
+            node("pressured", conditions=[{"type": "MemoryPressure", "status": "True", "reason": "LowMemory"},
+                                          {"type": "Ready", "status": "True"}]),
+            node("down", conditions=[{"type": "Ready", "status": "Unknown", "reason": "NodeStatusUnknown"}]),
+        ]
+        fake_lists["/api/v1/pods"] = [scheduled_pod("ok", [container({"memory": "6Gi"})])]
+        # No metrics-server: the metrics path is not served
+        served = k8s_utils.list_items
+
+        def list_without_metrics(path, api_client=None):
+            if "metrics" in path:
+                raise RuntimeError("404 Not Found")
+            return served(path, api_client)
+
+        monkeypatch.setattr(k8s_utils, "list_items", list_without_metrics)
+
+        result = analyze_node_capacity(top=1)
+
+        assert [row["name"] for row in result["hot_nodes"]] == ["ok"]
+        assert result["hot_nodes"][0]["memory_usage_pct"] is None
+        assert not result["summary"]["metrics_available"]
+        problems = {row["name"]: row for row in result["node_problems"]}
+        assert set(problems) == {"pressured", "down"}
+        assert problems["pressured"]["problems"][0]["type"] == "MemoryPressure"
+        assert not problems["down"]["ready"]
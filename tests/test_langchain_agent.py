@@ -2,7 +2,8 @@
 Integration tests for langchain_agent module.
 """
 import pytest
-from src.langchain_agent import init_llm_and_executor, process_query
+from src.langchain_agent import build_system_prompt, init_llm_and_executor, process_query
+from src.langchain_tools import all_tools, deep_dive_tools
 
 
 class TestLangchainAgentIntegration:
@@ -150,3 +151,217 @@ class TestLangchainAgentIntegration:
                 os.environ["OPENAI_API_KEY"] = original_key
             elif "OPENAI_API_KEY" in os.environ:
                 del os.environ["OPENAI_API_KEY"]
+
+    def test_system_prompt_does_not_repeat_tool_descriptions(self):
+        """Test that the generated prompt leaves tool descriptions to the function definitions."""
+        prompt = build_system_prompt(all_tools)
+        for tool in all_tools:
+            assert tool.description not in prompt
+            assert tool.name not in prompt
+
+    def test_system_prompt_omits_missing_categories(self):
+        """Test that only the categories of the selected tools are described."""
+        prompt = build_system_prompt(deep_dive_tools)
+        assert "- **Deep Dive Tools**" in prompt
+        assert "- **Broad Insights Tools**" not in prompt
+
+    def test_system_prompt_lists_clusters_when_several(self):
+        """Test that configured clusters are named only in multi-cluster setups."""
+        assert "Clusters" not in build_system_prompt(all_tools, ["prod"])
+        prompt = build_system_prompt(all_tools, ["prod-eu", "prod-us"])
+        assert "prod-eu, prod-us" in prompt
+
+    def test_sessions_keep_separate_histories(self, monkeypatch):
+        """Test that each session's history is loaded from and saved to the session store."""
+        from langchain_core.language_models.fake_chat_models import FakeListChatModel
+        from src import langchain_agent, session_store
+
+        seen = []
+
+        class FakeExecutor:
+            def model_copy(self, update=None):
+                return self
+
+            def invoke(self, inputs, config=None):
+                seen.append([m.content for m in inputs.get("chat_history", [])])
+                return {"output": f"answer to {inputs['input']}"}
+
+        monkeypatch.setattr(session_store, "_store", session_store.MemorySessionStore())
+        monkeypatch.setattr(langchain_agent, "llm", FakeListChatModel(responses=["summary"]))
+        monkeypatch.setattr(langchain_agent, "ensure_initialized", lambda model_name: None)
+        monkeypatch.setattr(langchain_agent, "executor_for_query", lambda query: FakeExecutor())
+
+        process_query("first", session_id="a")
+        process_query("second", session_id="a")
+        process_query("other", session_id="b")
+        process_query("batch item", use_memory=False)
+        assert seen == [[], ["first", "answer to first"], [], []]
+        assert session_store.load_state("a", "memory")["messages"][-1] == ["ai", "answer to second"]
+
+    def test_concurrent_queries_of_a_session_keep_every_turn(self, monkeypatch):
+        """Test that queries running at the same time on one session both add their turns."""
+        import threading
+        from langchain_core.language_models.fake_chat_models import FakeListChatModel
+        from src import langchain_agent, session_store
+
+        both_started = threading.Barrier(2, timeout=2)
+
+        class FakeExecutor:
+            def model_copy(self, update=None):
+                return self
+
+            def invoke(self, inputs, config=None):
+                both_started.wait()
+                return {"output": f"answer to {inputs['input']}"}
+
+        monkeypatch.setattr(session_store, "_store", session_store.MemorySessionStore())
+        monkeypatch.setattr(langchain_agent, "llm", FakeListChatModel(responses=["summary"]))
+        monkeypatch.setattr(langchain_agent, "ensure_initialized", lambda model_name: None)
+        monkeypatch.setattr(langchain_agent, "executor_for_query", lambda query: FakeExecutor())
+
+        threads = [threading.Thread(target=process_query, args=(query,), kwargs={"session_id": "a"})
+                   for query in ("pods", "nodes")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        messages = [text for _, text in session_store.load_state("a", "memory")["messages"]]
+        assert sorted(messages) == ["answer to nodes", "answer to pods", "nodes", "pods"]
+
+    def test_history_is_kept_when_the_summary_runs_out_of_time(self, monkeypatch):
+        """Test that turns the summary could not absorb at the deadline stay in the saved history."""
+        from langchain_core.language_models.fake_chat_models import FakeListChatModel
+        from src import langchain_agent, session_store
+        from src.cancellation import DeadlineExceeded, budget
+
+        class OutOfTimeLLM(FakeListChatModel):
+            def _call(self, *args, **kwargs):
+                raise DeadlineExceeded("⏱️ The query ran out of time")
+
+        class FakeExecutor:
+            def model_copy(self, update=None):
+                return self
+
+            def invoke(self, inputs, config=None):
+                return {"output": "answer " + "y" * 400}
+
+        monkeypatch.setenv("KUBESAGE_MEMORY_MAX_TOKENS", "150")
+        monkeypatch.setattr(session_store, "_store", session_store.MemorySessionStore())
+        monkeypatch.setattr(langchain_agent, "llm", OutOfTimeLLM(responses=[""]))
+        monkeypatch.setattr(langchain_agent, "ensure_initialized", lambda model_name: None)
+        monkeypatch.setattr(langchain_agent, "executor_for_query", lambda query: FakeExecutor())
+
+        for turn in range(2):
+            with budget(5):
+                assert process_query(f"question {turn}", session_id="a")["output"].startswith("answer")
+
+        state = session_store.load_state("a", "memory")
+        assert state["summary"] == ""
+        assert [kind for kind, _ in state["messages"]] == ["human", "ai", "human", "ai"]
+        assert state["messages"][0][1] == "question 0"
+
+    @pytest.mark.parametrize("stop", ["iterations", "deadline"])
+    def test_exhausted_budget_gives_a_best_effort_answer(self, monkeypatch, stop):
+        import time
+        import uuid
+        from langchain_core.language_models import FakeListChatModel
+        from src import langchain_agent
+        from src.cancellation import budget, check_deadline
+
+        limits = {}
+
+        class FakeExecutor:
+            def model_copy(self, update=None):
+                limits.update(update)
+                return self
+
+            def invoke(self, inputs, config=None):
+                recorder = config["callbacks"][-1]
+                run_id = uuid.uuid4()
+                recorder.on_tool_start({"name": "get_all_pods_with_usage"}, "{}", run_id=run_id)
+                recorder.on_tool_end("web-1 CrashLoopBackOff", run_id=run_id)
+                if stop == "iterations":
+                    return {"output": langchain_agent.STOPPED_OUTPUT}
+                time.sleep(limits["max_execution_time"])
+                check_deadline()
+
+        monkeypatch.setattr(langchain_agent, "llm", FakeListChatModel(responses=["web-1 is crash looping"]))
+        monkeypatch.setattr(langchain_agent, "ensure_initialized", lambda model_name: None)
+        monkeypatch.setattr(langchain_agent, "executor_for_query", lambda query: FakeExecutor())
+        monkeypatch.setattr(langchain_agent, "MIN_ANSWER_SECONDS", 0.05)
+
+        with budget(0.5, 3):
+            response = process_query("why is web down?", use_memory=False)
+        assert response["output"] == "⏱️ web-1 is crash looping"
+        assert limits["max_iterations"] == 3
+        assert 0.3 < limits["max_execution_time"] < 0.5
+
+        # Without time left for the LLM, the findings are returned as they are
+        monkeypatch.setattr(langchain_agent, "MIN_ANSWER_SECONDS", 1.0)
+        with budget(0.5):
+            response = process_query("why is web down?", use_memory=False)
+        assert "get_all_pods_with_usage({}):\nweb-1 CrashLoopBackOff" in response["output"]
+
+    def test_only_timeouts_are_taken_for_an_exhausted_budget(self, monkeypatch):
+        import time
+        import httpx
+        from openai import APITimeoutError
+        from src import langchain_agent
+        from src.cancellation import budget
+
+        errors = []
+
+        class FakeExecutor:
+            def model_copy(self, update=None):
+                self.limit = update["max_execution_time"]
+                return self
+
+            def invoke(self, inputs, config=None):
+                time.sleep(self.limit)
+                raise errors.pop()
+
+        monkeypatch.setattr(langchain_agent, "ensure_initialized", lambda model_name: None)
+        monkeypatch.setattr(langchain_agent, "executor_for_query", lambda query: FakeExecutor())
+        monkeypatch.setattr(langchain_agent, "MIN_ANSWER_SECONDS", 1.0)
+
+        errors.append(APITimeoutError(httpx.Request("POST", "https://llm.test")))
+        with budget(0.3):
+            assert process_query("why is web down?", use_memory=False)["output"].startswith("⏱️")
+
+        errors.append(ValueError("bad tool arguments"))
+        with budget(0.3), pytest.raises(ValueError, match="bad tool arguments"):
+            process_query("why is web down?", use_memory=False)
+
+    def test_lmstudio_agent_uses_react_text_actions(self, monkeypatch):
+        """Test that LM Studio models call tools through ReAct text, without native tool calling."""
+        from langchain_core.language_models import FakeListChatModel
+        from langchain_core.tools import StructuredTool
+        from src import langchain_agent
+
+        calls = []
+
+        def get_pod_logs(namespace: str, pod_name: str) -> dict:
+            """Fetches the last log lines of a pod."""
+            calls.append((namespace, pod_name))
+            return {"logs": ["OOMKilled"]}
+
+        monkeypatch.setenv("LLM_PROVIDER", "lmstudio")
+        monkeypatch.delenv("KUBESAGE_AGENT_STYLE", raising=False)
+        monkeypatch.delenv("KUBESAGE_LLM_BACKENDS", raising=False)
+        fake_llm = FakeListChatModel(responses=[
+            'Thought: read the logs\nAction:\n```\n{"action": "get_pod_logs", '
+            '"action_input": {"namespace": "shop", "pod_name": "web-1"}}\n```',
+            'Thought: done\nAction:\n```\n{"action": "Final Answer", "action_input": "web-1 runs out of memory"}\n```',
+        ])
+        monkeypatch.setattr(langchain_agent, "llm", fake_llm)
+        tool = StructuredTool.from_function(get_pod_logs)
+
+        assert langchain_agent.agent_style() == "react"
+        executor = langchain_agent._build_executor([tool])
+        assert "FORMATTING RULES" in executor.agent.runnable.steps[1].messages[0].prompt.template
+        assert executor.invoke({"input": "why does web-1 restart?"})["output"] == "web-1 runs out of memory"
+        assert calls == [("shop", "web-1")]
+
+        monkeypatch.setenv("LLM_PROVIDER", "openrouter")
+        assert langchain_agent.agent_style() == "tool_calling"
@@ -2,8 +2,9 @@
 Integration tests for langchain_tools module.
 """
 import pytest
-import json
-from src.langchain_tools import broad_insights_tools, deep_dive_tools, parse_params
+from src.langchain_tools import (
+    all_tools, broad_insights_tools, classify_query, deep_dive_tools, select_tools
+)
 
 
 class TestLangchainToolsIntegration:
@@ -31,8 +32,8 @@ class TestLangchainToolsIntegration:
         """Test execution of broad insights tools."""
         for tool in broad_insights_tools:
             try:
-                # Execute tool with dummy input
-                result = tool.func("dummy_input")
+                # Execute tool without arguments
+                result = tool.invoke({})
                 
                 # Should return a dictionary with status
                 assert isinstance(result, dict)
@@ -46,20 +47,20 @@ class TestLangchainToolsIntegration:
         """Test execution of deep dive tools with valid parameters."""
         # Test tools that require parameters
         param_tools = [
-            ("Describe Pod with Restart Count", {"namespace": test_namespace, "pod_name": "test-pod"}),
-            ("Get Pod Logs", {"namespace": test_namespace, "pod_name": "test-pod"}),
-            ("Describe Service", {"namespace": test_namespace, "service_name": "kubernetes"}),
-            ("Describe Deployment", {"namespace": test_namespace, "deployment_name": "test-deployment"}),
-            ("Get Node Status & Capacity", {"node_name": "test-node"}),
-            ("Check Pod Affinity & Anti-Affinity", {"namespace": test_namespace, "pod_name": "test-pod"})
+            ("describe_pod_with_restart_count", {"namespace": test_namespace, "pod_name": "test-pod"}),
+            ("get_pod_logs", {"namespace": test_namespace, "pod_name": "test-pod"}),
+            ("describe_service", {"namespace": test_namespace, "service_name": "kubernetes"}),
+            ("describe_deployment", {"namespace": test_namespace, "deployment_name": "test-deployment"}),
+            ("get_node_status_and_capacity", {"node_name": "test-node"}),
+            ("check_pod_affinity", {"namespace": test_namespace, "pod_name": "test-pod"})
         ]
         
         for tool_name, params in param_tools:
             tool = next((t for t in deep_dive_tools if t.name == tool_name), None)
             if tool:
                 try:
-                    # Execute tool with JSON parameters
-                    result = tool.func(json.dumps(params))
+                    # Execute tool with typed arguments
+                    result = tool.invoke(params)
                     
                     # Should return a dictionary with status
                     assert isinstance(result, dict)
@@ -72,18 +73,18 @@ class TestLangchainToolsIntegration:
     def test_deep_dive_tools_without_params(self, skip_if_no_k8s):
         """Test execution of deep dive tools that don't require parameters."""
         no_param_tools = [
-            "Check RBAC Events & Role Bindings",
-            "Get Persistent Volumes & Claims",
-            "Get Running Jobs & CronJobs",
-            "Get Ingress Resources & Annotations"
+            "get_rbac_events_and_role_bindings",
+            "get_persistent_volumes_and_claims",
+            "get_running_jobs_and_cronjobs",
+            "get_ingress_resources"
         ]
         
         for tool_name in no_param_tools:
             tool = next((t for t in deep_dive_tools if t.name == tool_name), None)
             if tool:
                 try:
-                    # Execute tool with dummy input
-                    result = tool.func("dummy_input")
+                    # Execute tool without arguments
+                    result = tool.invoke({})
                     
                     # Should return a dictionary with status
                     assert isinstance(result, dict)
@@ -93,28 +94,26 @@ class TestLangchainToolsIntegration:
                     # If there's an error, it should be handled gracefully
                     assert "error" in str(e).lower() or "connection" in str(e).lower()
 
-    def test_parse_params_with_dict(self):
-        """Test parse_params function with dictionary input."""
-        test_dict = {"namespace": "default", "pod_name": "test-pod"}
-        result = parse_params(test_dict)
-        assert result == test_dict
-
-    def test_parse_params_with_json_string(self):
-        """Test parse_params function with JSON string input."""
-        test_dict = {"namespace": "default", "pod_name": "test-pod"}
-        json_string = json.dumps(test_dict)
-        result = parse_params(json_string)
-        assert result == test_dict
-
-    def test_parse_params_with_invalid_json(self):
-        """Test parse_params function with invalid JSON."""
-        with pytest.raises(ValueError):
-            parse_params("invalid json string")
-
-    def test_parse_params_with_non_dict_json(self):
-        """Test parse_params function with non-dictionary JSON."""
-        with pytest.raises(ValueError):
-            parse_params(json.dumps(["not", "a", "dict"]))
+    def test_tools_have_typed_arguments(self):
+        """Test that deep dive tools declare their arguments with a schema."""
+        tool = next(t for t in deep_dive_tools if t.name == "describe_pod_with_restart_count")
+        assert set(tool.args) == {"namespace", "pod_name"}
+
+        yaml_tool = next(t for t in deep_dive_tools if t.name == "get_kubernetes_object_yaml")
+        assert yaml_tool.args["namespace"]["default"] == "default"
+
+    def test_invalid_arguments_are_rejected_before_dispatch(self):
+        """Test that malformed arguments are reported without calling Kubernetes."""
+        tool = next(t for t in deep_dive_tools if t.name == "get_pod_logs")
+        result = tool.invoke({"namespace": "default"})
+        assert "Invalid tool arguments" in result
+        assert "pod_name" in result
+
+    def test_tool_names_are_valid_function_names(self):
+        """Test that tool names are accepted as OpenAI function names."""
+        import re
+        for tool in all_tools:
+            assert re.fullmatch(r"[a-zA-Z0-9_-]+", tool.name)
 
     def test_tool_names_are_unique(self):
         """Test that all tool names are unique."""
@@ -132,8 +131,70 @@ class TestLangchainToolsIntegration:
     def test_integration_with_kubernetes_functions(self, skip_if_no_k8s):
         """Test that tools properly integrate with underlying Kubernetes functions."""
         # Test a few key tools to ensure they call the right functions
-        pod_tool = next((t for t in broad_insights_tools if "Pods" in t.name), None)
+        pod_tool = next((t for t in broad_insights_tools if "pods" in t.name), None)
         if pod_tool:
-            result = pod_tool.func("dummy")
+            result = pod_tool.invoke({})
             assert isinstance(result, dict)
             assert "status" in result
+
+    def test_every_tool_has_a_category(self):
+        """Test that every registered tool is tagged with at least one category."""
+        for tool in all_tools:
+            assert tool.tags
+
+    def test_classify_query(self):
+        """Test keyword-based query classification."""
+        assert classify_query("Why is my pod crashing?") == {"workloads"}
+        assert "networking" in classify_query("Service returns 503 through the ingress")
+        assert "rbac" in classify_query("Who can delete secrets in prod?")
+        assert classify_query("hello") == set()
+
+    def test_classify_query_matches_whole_words(self):
+        """Test that keywords do not match inside unrelated words."""
+        assert classify_query("Users cannot login to the catalog") == set()
+        assert classify_query("It works on localhost") == set()
+        assert classify_query("Show me the logs") == {"workloads"}
+        assert classify_query("Which pv?") == {"storage"}
+        assert classify_query("list every pv") == {"storage"}
+        assert classify_query("Pod is in CrashLoopBackOff") == {"workloads"}
+        assert classify_query("Check the rolebindings") == {"rbac"}
+
+    def test_select_tools_prunes_by_category(self):
+        """Test that only relevant tools plus core tools are selected."""
+        names = {tool.name for tool in select_tools("Which PVC is unbound?")}
+        assert "get_persistent_volumes_and_claims" in names
+        assert "get_cluster_events" in names
+        assert "get_pod_logs" not in names
+
+    def test_select_tools_falls_back_to_all_tools(self, monkeypatch):
+        """Test that unclassified queries get every tool."""
+        monkeypatch.setenv("KUBESAGE_HISTORY_ENABLED", "true")
+        assert len(select_tools("hello")) == len(all_tools)
+
+    def test_history_tools_are_offered_only_while_recording(self, monkeypatch):
+        """Test that the history tools are left out when cluster history is not recorded."""
+        from src import langchain_tools
+
+        monkeypatch.setattr(langchain_tools, "history_available", lambda: False)
+        assert "get_recent_changes" not in {tool.name for tool in select_tools("what changed?")}
+        assert "get_usage_trends" not in {tool.name for tool in select_tools("hello")}
+
+        monkeypatch.setattr(langchain_tools, "history_available", lambda: True)
+        assert "get_recent_changes" in {tool.name for tool in select_tools("what changed?")}
+
+    def test_history_tools_report_disabled_recording(self, monkeypatch):
+        """Test that the history tools say recording is off without creating a history database."""
+        from types import SimpleNamespace
+        from src import k8s_depth_utils
+
+        def no_store(api_client):
+            raise AssertionError("the history store must not be created")
+
+        monkeypatch.delenv("KUBESAGE_HISTORY_ENABLED", raising=False)
+        monkeypatch.setattr(k8s_depth_utils, "load_kube_config", lambda: None)
+        monkeypatch.setattr(k8s_depth_utils.client, "ApiClient",
+                            lambda: SimpleNamespace(configuration=SimpleNamespace(host="https://cluster-x")))
+        monkeypatch.setattr(k8s_depth_utils, "get_history_store", no_store)
+        for result in (k8s_depth_utils.get_recent_changes(), k8s_depth_utils.get_usage_trends()):
+            assert result["status"] == "error"
+            assert "KUBESAGE_HISTORY_ENABLED" in result["message"]
@@ -0,0 +1,154 @@
+"""
+Tests for the llm_router module.
+"""
+import time
+import httpx
+import pytest
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import tool
+from openai import APITimeoutError, BadRequestError
+from src.cancellation import DeadlineExceeded, RunCancelled, budget
+from src.llm_router import Backend, RoutedChatModel, create_router
+
+
+class FakeLLM:
+    """Stands in for a ScheduledChatOpenAI backend."""
+
+    def __init__(self, name, reply="ok", delay=0.0, error=None):
+        self.model_name = name
+        self.scheduler_key = ("fake", name)
+        self.reply = reply
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def _generate(self, messages, stop=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    def _stream(self, messages, stop=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        for word in self.reply.split():
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " "))
+
+
+def router(*llms, hedge_after_ms=0.0):
+    return RoutedChatModel(backends=[Backend(llm.model_name, llm) for llm in llms], hedge_after_ms=hedge_after_ms)
+
+
+class TestLLMRouter:
+    """Tests for backend selection, failover and hedging."""
+
+    def test_failed_backend_fails_over(self):
+        primary = FakeLLM("openrouter", error=ConnectionError("connection reset"))
+        local = FakeLLM("lmstudio", reply="from local")
+        model = router(primary, local)
+
+        result = model._generate([HumanMessage("hi")])
+
+        assert result.generations[0].message.content == "from local"
+        assert result.llm_output["backend"] == "lmstudio"
+        assert model.stats()["openrouter"]["error_rate"] == 1.0
+
+    def test_unhealthy_and_slow_backends_are_ranked_last(self):
+        fast, slow = FakeLLM("fast"), FakeLLM("slow")
+        model = router(slow, fast)
+        model.backends[0].record(True, 900)
+        model.backends[1].record(True, 100)
+        assert [b.name for b in model.ranked_backends()] == ["fast", "slow"]
+
+        model.backends[1].record(False)
+        model.backends[1].record(False)
+        assert [b.name for b in model.ranked_backends()] == ["slow", "fast"]
+
+    def test_request_errors_are_not_retried_elsewhere(self):
+        response = httpx.Response(400, request=httpx.Request("POST", "https://llm.test"))
+        primary = FakeLLM("openrouter", error=BadRequestError("context too long", response=response, body=None))
+        local = FakeLLM("lmstudio")
+
+        with pytest.raises(BadRequestError):
+            router(primary, local)._generate([HumanMessage("hi")])
+        assert local.calls == 0
+
+    def test_cancelled_runs_do_not_count_against_backends(self):
+        primary = FakeLLM("openrouter", error=RunCancelled("client disconnected"))
+        local = FakeLLM("lmstudio", reply="from local")
+        model = router(primary, local, hedge_after_ms=10)
+
+        with pytest.raises(RunCancelled):
+            model._generate([HumanMessage("hi")])
+        with pytest.raises(RunCancelled):
+            list(model._stream([HumanMessage("hi")]))
+        assert model.stats()["openrouter"]["error_rate"] == 0.0
+        assert model.stats()["openrouter"]["calls"] == 0
+        assert local.calls == 0
+
+    def test_runs_out_of_time_without_failing_over(self):
+        request = httpx.Request("POST", "https://llm.test")
+        for error in (DeadlineExceeded("out of time"), APITimeoutError(request)):
+            primary = FakeLLM("a", delay=0.06, error=error)
+            secondary = FakeLLM("b")
+            model = router(primary, secondary)
+            with budget(0.05), pytest.raises(type(error)):
+                model._generate([HumanMessage("hi")])
+            with budget(0.05), pytest.raises(type(error)):
+                list(model._stream([HumanMessage("hi")]))
+            assert secondary.calls == 0
+            assert model.stats()["a"]["error_rate"] == 0.0
+
+        # A timeout with time left in the run is a slow backend
+        model = router(FakeLLM("a", error=APITimeoutError(request)), FakeLLM("b", reply="from b"))
+        with budget(5):
+            assert model._generate([HumanMessage("hi")]).llm_output["backend"] == "b"
+        assert model.stats()["a"]["error_rate"] == 1.0
+
+    def test_stream_fails_over_before_first_token(self):
+        model = router(FakeLLM("openrouter", error=TimeoutError("timeout")), FakeLLM("lmstudio", reply="pods look fine"))
+        chunks = list(model.stream("hi"))
+        assert "".join(chunk.content for chunk in chunks) == "pods look fine "
+
+    def test_hedged_stream_takes_the_first_answer(self):
+        slow = FakeLLM("openrouter", reply="slow answer", delay=0.5)
+        fast = FakeLLM("lmstudio", reply="fast answer")
+        model = router(slow, fast, hedge_after_ms=50)
+
+        start = time.perf_counter()
+        text = "".join(chunk.content for chunk in model.stream("hi"))
+
+        assert text == "fast answer "
+        assert time.perf_counter() - start < 0.4
+        assert slow.calls == 1
+
+    def test_no_hedge_when_primary_answers_in_time(self):
+        primary, secondary = FakeLLM("openrouter", reply="primary"), FakeLLM("lmstudio")
+        model = router(primary, secondary, hedge_after_ms=200)
+        assert "".join(chunk.content for chunk in model.stream("hi")) == "primary "
+        assert secondary.calls == 0
+
+    def test_create_router_from_specs(self, monkeypatch):
+        monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+        monkeypatch.setenv("KUBESAGE_LLM_VLLM_MODEL", "qwen2.5")
+        model = create_router("openai/gpt-4o", ["openrouter", "lmstudio", "vllm=http://vllm:8000/v1"])
+
+        assert [b.name for b in model.backends] == ["openrouter", "lmstudio", "vllm"]
+        assert model.backends[2].llm.model_name == "qwen2.5"
+        assert model.backends[2].llm.openai_api_base == "http://vllm:8000/v1"
+
+        @tool
+        def get_all_pods() -> str:
+            """Lists pods."""
+            return ""
+
+        bound = model.bind_tools([get_all_pods])
+        assert bound.kwargs["tools"][0]["function"]["name"] == "get_all_pods"
+
+    def test_unknown_backend_is_rejected(self):
+        with pytest.raises(ValueError, match="Unknown LLM backend"):
+            create_router("openai/gpt-4o", ["carrier-pigeon"])
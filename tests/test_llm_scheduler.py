@@ -0,0 +1,155 @@
+"""
+Tests for the llm_scheduler module.
+"""
+import contextvars
+import threading
+import time
+import httpx
+import pytest
+from openai import APIConnectionError, APITimeoutError, AuthenticationError, InternalServerError, RateLimitError
+from src.llm_scheduler import BACKGROUND, INTERACTIVE, LLMScheduler, retry_delay, scheduling
+
+KEY = ("openrouter", "openai/gpt-4o")
+
+
+def api_error(error_class, status: int, headers: dict = None):
+    response = httpx.Response(status, headers=headers or {}, request=httpx.Request("POST", "https://llm.test"))
+    return error_class("error", response=response, body=None)
+
+
+def admit_in_order(scheduler, callers):
+    """Queues (priority, client) callers behind a held slot and returns the order they are admitted in."""
+    order = []
+    scheduler.acquire(KEY)
+    threads = []
+    for priority, client_id in callers:
+        def run(priority=priority, client_id=client_id):
+            scheduler.acquire(KEY, priority, client_id)
+            order.append(client_id)
+            scheduler.release(KEY)
+        thread = threading.Thread(target=run)
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.02)
+    scheduler.release(KEY)
+    for thread in threads:
+        thread.join(2)
+    return order
+
+
+class TestLLMScheduler:
+    """Tests for rate limiting, fair queuing and retries of LLM calls."""
+
+    def test_clients_are_served_round_robin(self):
+        scheduler = LLMScheduler(rate_per_minute=0, max_concurrency=1)
+        callers = [(INTERACTIVE, "a"), (INTERACTIVE, "a"), (INTERACTIVE, "a"), (INTERACTIVE, "b")]
+        assert admit_in_order(scheduler, callers) == ["a", "b", "a", "a"]
+
+    def test_interactive_calls_go_before_background(self):
+        scheduler = LLMScheduler(rate_per_minute=0, max_concurrency=1)
+        callers = [(BACKGROUND, "batch"), (BACKGROUND, "batch"), (INTERACTIVE, "ws")]
+        assert admit_in_order(scheduler, callers) == ["ws", "batch", "batch"]
+
+    def test_token_bucket_spaces_out_requests(self):
+        scheduler = LLMScheduler(rate_per_minute=600, burst=1, max_concurrency=4)
+        start = time.perf_counter()
+        for _ in range(3):
+            scheduler.call(KEY, lambda: None)
+        assert time.perf_counter() - start >= 0.18
+
+    def test_rate_limited_calls_are_retried_after_retry_after(self):
+        scheduler = LLMScheduler(rate_per_minute=0, max_retries=3)
+        attempts = []
+
+        def flaky():
+            attempts.append(time.perf_counter())
+            if len(attempts) < 2:
+                raise api_error(RateLimitError, 429, {"retry-after": "0.1"})
+            return "ok"
+
+        assert scheduler.call(KEY, flaky) == "ok"
+        assert attempts[1] - attempts[0] >= 0.1
+        assert scheduler.stats()["openrouter/openai/gpt-4o"] == {"in_flight": 0, "queued": 0, "cancelled": 0}
+
+    def test_other_errors_are_not_retried(self):
+        scheduler = LLMScheduler(rate_per_minute=0)
+        attempts = []
+
+        def unauthorized():
+            attempts.append(1)
+            raise api_error(AuthenticationError, 401)
+
+        with pytest.raises(AuthenticationError):
+            scheduler.call(KEY, unauthorized)
+        assert attempts == [1]
+
+    def test_streams_retry_only_before_first_chunk(self):
+        scheduler = LLMScheduler(rate_per_minute=0, max_retries=2)
+        attempts = []
+
+        def stream():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise api_error(RateLimitError, 429, {"retry-after-ms": "10"})
+            yield "a"
+            yield "b"
+
+        assert list(scheduler.stream(KEY, stream)) == ["a", "b"]
+        assert len(attempts) == 2
+
+    def test_retry_delay(self):
+        assert retry_delay(api_error(RateLimitError, 429, {"retry-after": "3"}), 0) == 3.0
+        assert retry_delay(api_error(RateLimitError, 429, {"retry-after-ms": "250"}), 0) == 0.25
+        assert 0.5 <= retry_delay(api_error(RateLimitError, 429), 1) <= 2
+        assert retry_delay(ValueError("bad"), 0) is None
+        assert retry_delay(api_error(AuthenticationError, 401), 0) is None
+        assert 0.5 <= retry_delay(api_error(InternalServerError, 502), 1) <= 2
+        request = httpx.Request("POST", "https://llm.test")
+        assert retry_delay(APITimeoutError(request), 0) is not None
+        assert retry_delay(APIConnectionError(request=request), 0) is not None
+
+    def test_transient_errors_are_retried_without_pausing_the_lane(self, monkeypatch):
+        monkeypatch.setattr("src.llm_scheduler.retry_delay", lambda error, attempt: 0.05)
+        scheduler = LLMScheduler(rate_per_minute=0, max_retries=3)
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise APITimeoutError(httpx.Request("POST", "https://llm.test"))
+            if len(attempts) == 2:
+                assert scheduler.paused_for(KEY) == 0
+                raise api_error(InternalServerError, 500)
+            return "ok"
+
+        assert scheduler.call(KEY, flaky) == "ok"
+        assert len(attempts) == 3
+
+        def unreachable():
+            attempts.append(1)
+            raise APIConnectionError(request=httpx.Request("POST", "https://llm.test"))
+
+        attempts.clear()
+        with pytest.raises(APIConnectionError):
+            scheduler.call(KEY, unreachable)
+        assert len(attempts) == 3
+
+    def test_requests_per_minute_are_unlimited_by_default(self, monkeypatch):
+        monkeypatch.delenv("KUBESAGE_LLM_RPM", raising=False)
+        scheduler = LLMScheduler(burst=1)
+        start = time.perf_counter()
+        for _ in range(5):
+            scheduler.call(KEY, lambda: None)
+        assert time.perf_counter() - start < 0.1
+
+    def test_scheduling_context_sets_defaults(self):
+        scheduler = LLMScheduler(rate_per_minute=0, max_concurrency=1)
+        scheduler.acquire(KEY)
+        with scheduling(BACKGROUND, "job-1"):
+            context = contextvars.copy_context()
+            thread = threading.Thread(target=context.run, args=(lambda: scheduler.call(KEY, lambda: None),))
+            thread.start()
+            time.sleep(0.05)
+            assert scheduler._lanes[KEY].waiting[BACKGROUND].keys() == {"job-1"}
+        scheduler.release(KEY)
+        thread.join(2)
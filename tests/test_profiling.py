@@ -0,0 +1,59 @@
+"""
+Tests for the profiling module.
+"""
+import os
+import time
+from src import rest_api_handler
+from src.profiling import format_top_functions, profiling_allowed, run_profiled
+
+
+def busy_wait(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+    return "done"
+
+
+class TestProfiling:
+    """Tests for the on-demand sampling profiler."""
+
+    def test_profiling_disabled_by_default(self, monkeypatch):
+        monkeypatch.delenv("KUBESAGE_PROFILING_ENABLED", raising=False)
+        assert not profiling_allowed("anything")
+
+    def test_profiling_token_must_match(self, monkeypatch):
+        monkeypatch.setenv("KUBESAGE_PROFILING_ENABLED", "true")
+        monkeypatch.setenv("KUBESAGE_PROFILING_TOKEN", "secret")
+        assert profiling_allowed("secret")
+        assert not profiling_allowed("wrong")
+        assert not profiling_allowed(None)
+
+    def test_profiling_without_token(self, monkeypatch):
+        monkeypatch.setenv("KUBESAGE_PROFILING_ENABLED", "true")
+        monkeypatch.delenv("KUBESAGE_PROFILING_TOKEN", raising=False)
+        assert profiling_allowed("1")
+
+    def test_run_profiled_reports_hot_function(self, monkeypatch):
+        monkeypatch.delenv("KUBESAGE_PROFILE_DIR", raising=False)
+        result, report = run_profiled("test", busy_wait, 0.2)
+
+        assert result == "done"
+        assert report["samples"] > 0
+        assert any("busy_wait" in row["function"] for row in report["top_functions"])
+        assert "busy_wait" in report["flamegraph"]
+        assert "busy_wait" in format_top_functions(report)
+
+    def test_run_profiled_stores_report(self, monkeypatch, tmp_path):
+        monkeypatch.setenv("KUBESAGE_PROFILE_DIR", str(tmp_path))
+        _, report = run_profiled("test", busy_wait, 0.05)
+
+        assert "flamegraph" not in report
+        assert os.path.exists(report["flamegraph_path"])
+        assert os.path.exists(report["report_path"])
+
+    def test_unprofiled_query_has_no_profile(self, monkeypatch):
+        monkeypatch.setattr(rest_api_handler, "process_query", lambda query, *args, **kwargs: {"output": "ok"})
+        response = rest_api_handler.process_kubernetes_query(rest_api_handler.QueryRequest(query="list pods"))
+        assert response.status == "success"
+        assert response.output == "ok"
+        assert response.profile is None
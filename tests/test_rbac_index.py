@@ -0,0 +1,140 @@
+"""
+Tests for the rbac_index module.
+"""
+from src.rbac_index import RbacIndex, effective_subjects, rule_allows, slim_rbac_object
+
+
+class FakeSource:
+    """Stands in for an informer: a list of objects and a change counter."""
+
+    def __init__(self, objects):
+        self.objects = [slim_rbac_object(o) for o in objects]
+        self.version = 1
+
+    def items(self):
+        return list(self.objects)
+
+    def add(self, obj):
+        self.objects.append(slim_rbac_object(obj))
+        self.version += 1
+
+
+def meta(name, namespace=None):
+    return {"name": name, "namespace": namespace}
+
+
+def rule(verbs, resources, groups=("",), names=None):
+    result = {"verbs": list(verbs), "resources": list(resources), "apiGroups": list(groups)}
+    if names:
+        result["resourceNames"] = list(names)
+    return result
+
+
+def build_index():
+    sources = {
+        "roles": FakeSource([
+            {"metadata": meta("secret-admin", "prod"), "rules": [rule(["*"], ["secrets"])]},
+        ]),
+        "cluster_roles": FakeSource([
+            {"metadata": meta("pod-reader"), "rules": [rule(["get", "list"], ["pods", "pods/log"])]},
+            {"metadata": meta("cluster-admin"), "rules": [rule(["*"], ["*"], ["*"]),
+                                                          {"verbs": ["*"], "nonResourceURLs": ["*"]}]},
+            {"metadata": meta("one-config"), "rules": [rule(["get"], ["configmaps"], names=["app-config"])]},
+        ]),
+        "role_bindings": FakeSource([
+            {"metadata": meta("ci-secrets", "prod"), "roleRef": {"kind": "Role", "name": "secret-admin"},
+             "subjects": [{"kind": "ServiceAccount", "name": "deployer"}]},
+            {"metadata": meta("readers", "dev"), "roleRef": {"kind": "ClusterRole", "name": "pod-reader"},
+             "subjects": [{"kind": "User", "name": "alice"}]},
+            {"metadata": meta("config", "dev"), "roleRef": {"kind": "ClusterRole", "name": "one-config"},
+             "subjects": [{"kind": "Group", "name": "system:serviceaccounts:dev"}]},
+        ]),
+        "cluster_role_bindings": FakeSource([
+            {"metadata": meta("admins"), "roleRef": {"kind": "ClusterRole", "name": "cluster-admin"},
+             "subjects": [{"kind": "Group", "name": "ops"}]},
+        ]),
+    }
+    return RbacIndex(sources), sources
+
+
+class TestRuleMatching:
+    """Tests for PolicyRule evaluation."""
+
+    def test_verbs_resources_and_wildcards(self):
+        assert rule_allows(rule(["get"], ["pods"]), "get", "pods")
+        assert not rule_allows(rule(["get"], ["pods"]), "delete", "pods")
+        assert rule_allows(rule(["*"], ["*"]), "delete", "secrets")
+        assert not rule_allows(rule(["get"], ["pods"]), "get", "pods/log")
+        assert rule_allows(rule(["get"], ["pods/*"]), "get", "pods/exec")
+
+    def test_api_group(self):
+        assert rule_allows(rule(["get"], ["deployments"], ["apps"]), "get", "deployments", "apps")
+        assert not rule_allows(rule(["get"], ["deployments"], ["extensions"]), "get", "deployments", "apps")
+
+    def test_resource_names(self):
+        limited = rule(["get"], ["configmaps"], names=["app-config"])
+        assert rule_allows(limited, "get", "configmaps", name="app-config")
+        assert not rule_allows(limited, "get", "configmaps", name="other")
+        assert rule_allows(limited, "get", "configmaps")
+
+    def test_service_account_subjects(self):
+        subjects = effective_subjects("serviceaccount", "deployer", "prod")
+        assert ("ServiceAccount", "prod", "deployer") in subjects
+        assert ("User", "", "system:serviceaccount:prod:deployer") in subjects
+        assert ("Group", "", "system:serviceaccounts:prod") in subjects
+        assert effective_subjects("User", "system:serviceaccount:prod:deployer") == subjects
+
+
+class TestRbacIndex:
+    """Tests for indexed access checks."""
+
+    def test_role_binding_is_limited_to_its_namespace(self):
+        index, _ = build_index()
+        deployer = effective_subjects("ServiceAccount", "deployer", "prod")
+
+        grants = index.can(deployer, "delete", "secrets", "prod")
+        assert [g.binding for g in grants] == ["RoleBinding prod/ci-secrets"]
+        assert index.can(deployer, "delete", "secrets", "dev") == []
+
+    def test_cluster_role_binding_applies_everywhere(self):
+        index, _ = build_index()
+        ops = effective_subjects("Group", "ops")
+
+        assert index.can(ops, "delete", "nodes", None)
+        assert index.can(ops, "create", "deployments", "prod", api_group="apps")
+
+    def test_subresources(self):
+        index, _ = build_index()
+        alice = effective_subjects("User", "alice")
+
+        assert index.can(alice, "get", "pods/log", "dev")
+        assert not index.can(alice, "create", "pods/exec", "dev")
+
+    def test_group_membership_of_service_accounts(self):
+        index, _ = build_index()
+        grants = index.can(effective_subjects("ServiceAccount", "web", "dev"), "get", "configmaps", "dev")
+        assert grants and grants[0].rule["resourceNames"] == ["app-config"]
+
+    def test_who_can(self):
+        index, _ = build_index()
+
+        subjects = {g.subject for g in index.who_can("delete", "secrets", "prod")}
+        assert subjects == {("ServiceAccount", "prod", "deployer"), ("Group", "", "ops")}
+
+        subjects = {g.subject for g in index.who_can("delete", "secrets", "dev")}
+        assert subjects == {("Group", "", "ops")}
+
+        subjects = {g.subject for g in index.who_can("list", "pods")}
+        assert ("User", "", "alice") in subjects
+
+    def test_rebuilds_when_sources_change(self):
+        index, sources = build_index()
+        bob = effective_subjects("User", "bob")
+        assert index.can(bob, "get", "pods", "dev") == []
+
+        sources["role_bindings"].add({
+            "metadata": meta("bob-reads", "dev"), "roleRef": {"kind": "ClusterRole", "name": "pod-reader"},
+            "subjects": [{"kind": "User", "name": "bob"}],
+        })
+
+        assert index.can(bob, "get", "pods", "dev")
@@ -0,0 +1,179 @@
+"""
+Tests for the resource_graph module.
+"""
+import pytest
+from src.resource_graph import ResourceGraph, SOURCES, normalize_kind
+
+
+class FakeSource:
+    """Stands in for an informer: transformed objects and a change counter."""
+
+    def __init__(self, transform, objects=()):
+        self.transform = transform
+        self.objects = [transform(o) for o in objects]
+        self.version = 1
+
+    def items(self):
+        return list(self.objects)
+
+    def replace(self, objects):
+        self.objects = [self.transform(o) for o in objects]
+        self.version += 1
+
+
+class FakeInformer(FakeSource):
+    """Stands in for an informer that reports every change to its listeners."""
+
+    def __init__(self, transform, objects=()):
+        super().__init__(transform, objects)
+        self.listeners = []
+        self.listed = 0
+
+    def items(self):
+        self.listed += 1
+        return super().items()
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def change(self, old=None, new=None):
+        old, new = (self.transform(o) if o else None for o in (old, new))
+        self.objects = [o for o in self.objects if o != old] + ([new] if new else [])
+        for listener in self.listeners:
+            listener("MODIFIED" if old and new else "ADDED" if new else "DELETED", old, new)
+
+
+def meta(name, uid, labels=None, owner=None, namespace="shop"):
+    metadata = {"name": name, "namespace": namespace, "uid": uid, "labels": labels or {}}
+    if owner:
+        metadata["ownerReferences"] = [{"kind": owner[0], "name": owner[1], "uid": owner[2]}]
+    return metadata
+
+
+def pod(name, uid, labels, owner, ready=True, claims=(), reason=None):
+    waiting = {"state": {"waiting": {"reason": reason}}} if reason else {"state": {"running": {}}}
+    return {
+        "metadata": meta(name, uid, labels, owner),
+        "spec": {"nodeName": "node-1", "containers": [{"ports": [{"name": "http", "containerPort": 8080}]}],
+                 "volumes": [{"persistentVolumeClaim": {"claimName": c}} for c in claims]},
+        "status": {"phase": "Running", "conditions": [{"type": "Ready", "status": str(ready)}],
+                   "containerStatuses": [{"restartCount": 0 if ready else 7, **waiting}]},
+    }
+
+
+def build_graph(pods=None, source_class=None):
+    objects = {
+        "Deployment": [{"metadata": meta("web", "d1"), "spec": {"replicas": 2},
+                        "status": {"readyReplicas": 1, "availableReplicas": 1}}],
+        "ReplicaSet": [{"metadata": meta("web-1", "rs1", owner=("Deployment", "web", "d1")),
+                        "spec": {"replicas": 2}, "status": {"readyReplicas": 1}}],
+        "Pod": pods if pods is not None else [
+            pod("web-1-a", "p1", {"app": "web"}, ("ReplicaSet", "web-1", "rs1"), claims=["data"]),
+            pod("web-1-b", "p2", {"app": "web"}, ("ReplicaSet", "web-1", "rs1"), ready=False, reason="CrashLoopBackOff"),
+            pod("db-0", "p3", {"app": "db"}, None),
+        ],
+        "Service": [
+            {"metadata": meta("web", "s1"), "spec": {"type": "ClusterIP", "selector": {"app": "web"},
+                                                      "ports": [{"port": 80, "targetPort": "http"}]}},
+            {"metadata": meta("orphan", "s2"), "spec": {"selector": {"app": "gone"}, "ports": [{"port": 80}]}},
+        ],
+        "Endpoints": [{"metadata": meta("web", "e1"), "subsets": [{
+            "addresses": [{"ip": "10.0.0.1", "targetRef": {"name": "web-1-a"}}],
+            "notReadyAddresses": [{"ip": "10.0.0.2", "targetRef": {"name": "web-1-b"}}],
+        }]}],
+        "PersistentVolumeClaim": [{"metadata": meta("data", "c1"), "spec": {"volumeName": "pv-1"},
+                                   "status": {"phase": "Bound"}}],
+        "PersistentVolume": [{"metadata": meta("pv-1", "v1", namespace=None),
+                              "spec": {"claimRef": {"namespace": "shop", "name": "data"},
+                                       "capacity": {"storage": "10Gi"}},
+                              "status": {"phase": "Bound"}}],
+    }
+    sources = {kind: (source_class or FakeSource)(transform, objects.get(kind, []))
+               for kind, (_, transform) in SOURCES.items()}
+    return ResourceGraph(sources), sources
+
+
+class TestResourceGraph:
+    """Tests for relationship queries."""
+
+    def test_service_chain(self):
+        graph, _ = build_graph()
+
+        result = graph.query("Service", "shop", "web")
+
+        assert [p["name"] for p in result["pods"]] == ["web-1-a", "web-1-b"]
+        assert result["pods"][0]["owners"] == ["ReplicaSet/web-1", "Deployment/web"]
+        assert {w["ref"] for w in result["workloads"]} == {"ReplicaSet/web-1", "Deployment/web"}
+        service = result["services"][0]
+        assert service["ready_endpoints"] == ["web-1-a"]
+        assert service["not_ready_endpoints"] == ["web-1-b"]
+        assert result["volumes"][0]["volume"] == "pv-1"
+        assert result["volumes"][0]["capacity"] == "10Gi"
+        assert any("web-1-b is not ready" in f and "CrashLoopBackOff" in f for f in result["findings"])
+        assert any("1/2 ready replicas" in f for f in result["findings"])
+
+    def test_deployment_chain_includes_services(self):
+        graph, _ = build_graph()
+
+        result = graph.query("Deployment", "shop", "web")
+
+        assert len(result["pods"]) == 2
+        assert [s["name"] for s in result["services"]] == ["web"]
+
+    def test_selector_without_pods(self):
+        graph, _ = build_graph()
+
+        result = graph.query("Service", "shop", "orphan")
+
+        assert result["pods"] == []
+        assert any("matches no pods" in f for f in result["findings"])
+        assert any("no ready endpoints" in f for f in result["findings"])
+
+    def test_volume_to_pods(self):
+        graph, _ = build_graph()
+
+        result = graph.query("PersistentVolume", None, "pv-1")
+
+        assert [p["name"] for p in result["pods"]] == ["web-1-a"]
+        assert result["volumes"][0]["used_by"] == ["web-1-a"]
+
+    def test_rebuilds_when_sources_change(self):
+        graph, sources = build_graph()
+        assert len(graph.query("Service", "shop", "web")["pods"]) == 2
+
+        sources["Pod"].replace([pod("web-1-a", "p1", {"app": "web"}, ("ReplicaSet", "web-1", "rs1"))])
+
+        assert len(graph.query("Service", "shop", "web")["pods"]) == 1
+
+    def test_informer_changes_update_the_indexes_in_place(self):
+        graph, sources = build_graph(source_class=FakeInformer)
+        assert len(graph.query("Service", "shop", "web")["pods"]) == 2
+
+        crashing = pod("web-1-b", "p2", {"app": "web"}, ("ReplicaSet", "web-1", "rs1"), ready=False,
+                       reason="CrashLoopBackOff")
+        sources["Pod"].change(crashing, pod("web-1-b", "p2", {"app": "debug"}, None))
+        sources["Pod"].change(new=pod("web-2-a", "p4", {"app": "web"}, ("ReplicaSet", "web-1", "rs1")))
+        sources["Service"].change(new={"metadata": meta("web", "s3", namespace="other"),
+                                       "spec": {"selector": {"app": "web"}, "ports": [{"port": 80}]}})
+
+        result = graph.query("Deployment", "shop", "web")
+        assert [p["name"] for p in result["pods"]] == ["web-1-a", "web-2-a"]
+        assert [s["namespace"] for s in result["services"]] == ["shop"]
+        assert graph.query("Pod", "shop", "web-1-b")["workloads"] == []
+        assert all(source.listed == 1 for source in sources.values())
+
+        sources["Pod"].change(old=pod("web-2-a", "p4", {"app": "web"}, ("ReplicaSet", "web-1", "rs1")))
+        assert len(graph.query("Service", "shop", "web")["pods"]) == 1
+        with pytest.raises(KeyError):
+            graph.query("Pod", "shop", "web-2-a")
+
+    def test_unknown_object(self):
+        graph, _ = build_graph()
+        with pytest.raises(KeyError):
+            graph.query("Service", "shop", "missing")
+
+    def test_normalize_kind(self):
+        assert normalize_kind("svc") == "Service"
+        assert normalize_kind("Deployments") == "Deployment"
+        assert normalize_kind("pvc") == "PersistentVolumeClaim"
+        assert normalize_kind("configmap") is None
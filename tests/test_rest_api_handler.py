@@ -0,0 +1,240 @@
+"""
+Tests for the REST API handler.
+"""
+import asyncio
+import json
+import threading
+import time
+import pytest
+from fastapi import HTTPException
+from src import rest_api_handler
+from src.cancellation import DeadlineExceeded, RunCancelled, check_cancelled, iteration_budget, time_left
+from src.k8s_utils import list_items
+from src.jobs import FINISHED, JobManager
+from src.rest_api_handler import (
+    BatchQueryRequest, QueryRequest, get_job_result, get_job_status, process_kubernetes_batch,
+    rest_client_id, stream_job_events, submit_query_job
+)
+
+
+@pytest.fixture
+def fake_agent(monkeypatch):
+    """Replaces the agent with one that sleeps briefly and echoes the query."""
+    calls = []
+
+    def process_query(query, model_name, use_memory=True, callbacks=None, session_id=None):
+        calls.append((query, use_memory, threading.get_ident()))
+        time.sleep(0.2)
+        if query == "fail":
+            raise ValueError("bad query")
+        return {"output": query.upper()}
+
+    monkeypatch.setattr(rest_api_handler, "ensure_initialized", lambda model_name: None)
+    monkeypatch.setattr(rest_api_handler, "process_query", process_query)
+    return calls
+
+
+class TestBatchQueries:
+    """Tests for the batch query endpoint."""
+
+    def test_single_query_without_profile_or_timings(self, fake_agent):
+        response = rest_api_handler.process_kubernetes_query(QueryRequest(query="a"))
+        assert response.status == "success"
+        assert response.output == "A"
+        assert response.timings is None
+
+    def test_batch_runs_queries_concurrently(self, fake_agent):
+        batch = BatchQueryRequest(queries=[QueryRequest(query=q) for q in ("a", "b", "fail", "d")])
+
+        start = time.perf_counter()
+        response = asyncio.run(process_kubernetes_batch(batch))
+
+        assert time.perf_counter() - start < 0.6
+        assert [r.index for r in response.results] == [0, 1, 2, 3]
+        assert [r.output for r in response.results] == ["A", "B", None, "D"]
+        assert response.results[2].status_code == 400
+        assert response.status == "partial"
+        assert all(use_memory is False for _, use_memory, _ in fake_agent)
+
+    def test_concurrency_limit(self, fake_agent):
+        batch = BatchQueryRequest(queries=[QueryRequest(query=q) for q in "abcd"], max_concurrency=1)
+
+        start = time.perf_counter()
+        asyncio.run(process_kubernetes_batch(batch))
+
+        assert time.perf_counter() - start >= 0.8
+
+    def test_disconnected_client_cancels_the_query(self):
+        class Request:
+            method, url = "POST", type("URL", (), {"path": "/api/query"})
+
+            async def is_disconnected(self):
+                return True
+
+        def agent_loop():
+            for _ in range(500):
+                check_cancelled()
+                time.sleep(0.01)
+            return "finished"
+
+        start = time.perf_counter()
+        with pytest.raises(RunCancelled, match="client disconnected"):
+            asyncio.run(rest_api_handler.run_until_disconnected(Request(), agent_loop))
+        assert time.perf_counter() - start < 2
+        assert rest_api_handler._http_error(RunCancelled("x")).status_code == 499
+
+    def test_query_limits_apply_to_the_agent_run(self, monkeypatch):
+        seen = []
+
+        def process_query(query, model_name, use_memory=True, callbacks=None, session_id=None):
+            seen.append((round(time_left()), iteration_budget()))
+            return {"output": "ok"}
+
+        monkeypatch.setattr(rest_api_handler, "process_query", process_query)
+        rest_api_handler.process_kubernetes_query(QueryRequest(query="a", timeout_seconds=30, max_iterations=5))
+        assert seen == [(30, 5)]
+        with pytest.raises(ValueError):
+            QueryRequest(query="a", timeout_seconds=0)
+        assert rest_api_handler._http_error(DeadlineExceeded("x")).status_code == 504
+
+    def test_streamed_results_are_ndjson(self, fake_agent):
+        batch = BatchQueryRequest(queries=[QueryRequest(query=q) for q in "ab"], stream=True)
+
+        async def consume():
+            response = await process_kubernetes_batch(batch)
+            return [json.loads(chunk) async for chunk in response.body_iterator]
+
+        lines = asyncio.run(consume())
+        assert sorted(line["output"] for line in lines) == ["A", "B"]
+
+    def test_mixed_models_are_rejected(self, fake_agent):
+        batch = BatchQueryRequest(queries=[QueryRequest(query="a"), QueryRequest(query="b", model_name="other")])
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(process_kubernetes_batch(batch))
+        assert error.value.status_code == 400
+
+    def test_queries_share_list_results(self, monkeypatch, fake_agent):
+        requests = []
+
+        def fetch(api_client, path):
+            requests.append(path)
+            time.sleep(0.05)
+            return {"items": [{"metadata": {"name": "web"}}]}
+
+        monkeypatch.setattr(rest_api_handler, "process_query",
+                            lambda query, model_name, use_memory=True, callbacks=None, session_id=None: {"output": str(len(list_items(query)))})
+        monkeypatch.setattr("src.k8s_utils.k8s_json.get_json", fetch)
+        batch = BatchQueryRequest(queries=[QueryRequest(query="/api/v1/pods") for _ in range(4)])
+
+        response = asyncio.run(process_kubernetes_batch(batch))
+
+        assert [r.output for r in response.results] == ["1"] * 4
+        assert requests == ["/api/v1/pods"]
+
+
+@pytest.fixture
+def job_manager(monkeypatch):
+    manager = JobManager(workers=2)
+    monkeypatch.setattr(rest_api_handler, "get_job_manager", lambda: manager)
+    return manager
+
+
+def wait_for_job(manager, job_id, timeout=2.0):
+    """Blocks until the job has recorded its final event."""
+    job = manager.get(job_id)
+    deadline = time.monotonic() + timeout
+    cursor = 0
+    while time.monotonic() < deadline:
+        events = job.wait_for_events(cursor, deadline - time.monotonic())
+        cursor += len(events)
+        if events and events[-1]["type"] in FINISHED:
+            return job
+    raise AssertionError(f"job {job_id} did not finish within {timeout}s")
+
+
+class TestJobs:
+    """Tests for the background job endpoints."""
+
+    def test_submit_poll_and_fetch_result(self, fake_agent, job_manager):
+        submission = submit_query_job(QueryRequest(query="why is web crashing"))
+        assert submission.result_url == f"/api/jobs/{submission.job_id}/result"
+
+        with pytest.raises(HTTPException) as error:
+            get_job_result(submission.job_id)
+        assert error.value.status_code == 409
+
+        wait_for_job(job_manager, submission.job_id)
+        assert get_job_status(submission.job_id).status == "succeeded"
+        assert get_job_result(submission.job_id).output == "WHY IS WEB CRASHING"
+
+    def test_failed_job_reports_error(self, fake_agent, job_manager):
+        submission = submit_query_job(QueryRequest(query="fail"))
+        wait_for_job(job_manager, submission.job_id)
+
+        result = get_job_result(submission.job_id)
+        assert result.status == "error"
+        assert "bad query" in result.error
+
+    def test_jobs_get_the_job_budget(self, job_manager, monkeypatch):
+        budgets = []
+
+        def process_query(query, model_name, use_memory=True, callbacks=None, session_id=None):
+            budgets.append((time_left(), iteration_budget()))
+            return {"output": "done"}
+
+        monkeypatch.setattr(rest_api_handler, "ensure_initialized", lambda model_name: None)
+        monkeypatch.setattr(rest_api_handler, "process_query", process_query)
+        monkeypatch.setenv("KUBESAGE_JOB_TIMEOUT_SECONDS", "900")
+        monkeypatch.setenv("KUBESAGE_JOB_MAX_ITERATIONS", "40")
+
+        for request in (QueryRequest(query="a"), QueryRequest(query="b", timeout_seconds=2000, max_iterations=60)):
+            wait_for_job(job_manager, submit_query_job(request).job_id)
+        (default_time, default_iterations), (time_given, iterations_given) = budgets
+        assert 899 < default_time <= 900 and default_iterations == 40
+        assert 1999 < time_given <= 2000 and iterations_given == 60
+
+    def test_unknown_job(self, job_manager):
+        with pytest.raises(HTTPException) as error:
+            get_job_status("missing")
+        assert error.value.status_code == 404
+
+    def test_events_stream_until_job_finishes(self, fake_agent, job_manager):
+        submission = submit_query_job(QueryRequest(query="a"))
+
+        async def consume():
+            response = stream_job_events(submission.job_id)
+            return [chunk async for chunk in response.body_iterator]
+
+        chunks = asyncio.run(consume())
+        assert [c.split("\n")[1] for c in chunks] == ["event: queued", "event: running", "event: succeeded"]
+        assert chunks[-1].startswith("id: 2\n")
+
+    def test_event_streams_do_not_hold_threads(self, fake_agent, job_manager, monkeypatch):
+        async def no_threads(*args, **kwargs):
+            raise AssertionError("SSE clients must not wait in a thread")
+
+        monkeypatch.setattr(asyncio, "to_thread", no_threads)
+        submission = submit_query_job(QueryRequest(query="a"))
+
+        async def consume():
+            response = stream_job_events(submission.job_id)
+            return [chunk async for chunk in response.body_iterator]
+
+        assert asyncio.run(consume())[-1].split("\n")[1] == "event: succeeded"
+
+
+class TestClientIdentity:
+    """Tests for the client that REST queries are queued under."""
+
+    def test_rest_client_id_prefers_identity_then_session_then_forwarded_address(self):
+        from types import SimpleNamespace
+
+        def http_request(headers):
+            return SimpleNamespace(headers=headers, client=SimpleNamespace(host="10.0.0.1"))
+
+        anonymous = QueryRequest(query="q")
+        in_session = QueryRequest(query="q", session_id="s1")
+        assert rest_client_id(http_request({"x-forwarded-user": "alice"}), in_session) == "user-alice"
+        assert rest_client_id(http_request({"x-forwarded-for": "203.0.113.7, 10.0.0.1"}), in_session) == "session-s1"
+        assert rest_client_id(http_request({"x-forwarded-for": "203.0.113.7, 10.0.0.1"}), anonymous) == "203.0.113.7"
+        assert rest_client_id(http_request({}), anonymous) == "10.0.0.1"
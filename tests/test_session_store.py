@@ -0,0 +1,136 @@
+"""
+Tests for the session state backends.
+"""
+import socketserver
+import threading
+import time
+import pytest
+from src import session_store
+from src.session_store import (
+    MemorySessionStore, RedisError, RedisSessionStore, SessionListCache, SqliteSessionStore,
+    create_session_store, decode, encode
+)
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Serves GET, SET (with PX), DEL, AUTH and SELECT over the Redis protocol."""
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def handle(self):
+        server = self.server
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            name = args[0].upper()
+            server.commands.append(name)
+            if name == b"AUTH":
+                self.wfile.write(b"+OK\r\n" if args[-1] == b"secret" else b"-WRONGPASS invalid password\r\n")
+            elif name == b"SELECT":
+                self.wfile.write(b"+OK\r\n")
+            elif name == b"SET":
+                server.data[args[1]] = (args[2], time.time() + int(args[4]) / 1000)
+                self.wfile.write(b"+OK\r\n")
+            elif name == b"GET":
+                value, expires = server.data.get(args[1], (None, 0))
+                if value is None or expires <= time.time():
+                    self.wfile.write(b"$-1\r\n")
+                else:
+                    self.wfile.write(b"$%d\r\n%s\r\n" % (len(value), value))
+            elif name == b"DEL":
+                self.wfile.write(b":%d\r\n" % int(server.data.pop(args[1], None) is not None))
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+@pytest.fixture
+def redis_server():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeRedisHandler)
+    server.daemon_threads = True
+    server.data, server.commands = {}, []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestSessionStore:
+    """Tests for src.session_store."""
+
+    def test_large_values_are_compressed(self):
+        small = {"summary": "", "messages": [["human", "hi"]]}
+        large = {"messages": [["ai", "pod web-1 is Running " * 200]]}
+        assert decode(encode(small)) == small
+        assert decode(encode(large)) == large
+        assert encode(small)[:1] == b"j"
+        assert encode(large)[:1] == b"z"
+        assert len(encode(large)) < len(large["messages"][0][1]) / 10
+
+    @pytest.mark.parametrize("make_store", [
+        lambda tmp_path: MemorySessionStore(),
+        lambda tmp_path: SqliteSessionStore(str(tmp_path / "sessions.db")),
+    ])
+    def test_values_expire(self, tmp_path, make_store):
+        store = make_store(tmp_path)
+        store.set("s1:memory", b"jdata", 60)
+        store.set("s2:memory", b"jold", 0.05)
+        time.sleep(0.1)
+        assert store.get("s1:memory") == b"jdata"
+        assert store.get("s2:memory") is None
+        store.delete("s1:memory")
+        assert store.get("s1:memory") is None
+
+    def test_sqlite_store_is_shared_by_processes_using_the_file(self, tmp_path):
+        first = SqliteSessionStore(str(tmp_path / "sessions.db"))
+        second = SqliteSessionStore(str(tmp_path / "sessions.db"))
+        first.set("s1:memory", encode({"summary": "x"}), 60)
+        assert decode(second.get("s1:memory")) == {"summary": "x"}
+
+    def test_redis_store(self, redis_server):
+        host, port = redis_server.server_address
+        store = create_session_store(f"redis://:secret@{host}:{port}/2")
+        assert isinstance(store, RedisSessionStore)
+        store.set("s1:memory", b"j{}", 60)
+        assert store.get("s1:memory") == b"j{}"
+        assert store.get("missing") is None
+        store.delete("s1:memory")
+        assert store.get("s1:memory") is None
+        assert redis_server.commands[:3] == [b"AUTH", b"SELECT", b"SET"]
+        assert b"kubesage:session:s1:memory" not in redis_server.data
+
+        with pytest.raises(RedisError, match="WRONGPASS"):
+            RedisSessionStore(f"redis://:wrong@{host}:{port}").get("s1:memory")
+
+    def test_redis_store_reconnects(self, redis_server):
+        host, port = redis_server.server_address
+        store = RedisSessionStore(f"redis://{host}:{port}")
+        store.set("s1:memory", b"j1", 60)
+        store._sock.close()
+        assert store.get("s1:memory") == b"j1"
+
+    def test_unknown_backend_is_rejected(self):
+        with pytest.raises(ValueError, match="Unsupported"):
+            create_session_store("memcached://localhost")
+
+    def test_session_list_cache_reuses_lists_of_the_same_session(self, monkeypatch):
+        monkeypatch.setattr(session_store, "_store", MemorySessionStore())
+        fetches = []
+
+        def fetch():
+            fetches.append(1)
+            return [{"metadata": {"name": "web-1"}}]
+
+        first, other = SessionListCache("s1", 30), SessionListCache("s2", 30)
+        key = ("https://cluster-a", "/api/v1/pods")
+        assert first.get_or_fetch(key, fetch) == SessionListCache("s1", 30).get_or_fetch(key, fetch)
+        other.get_or_fetch(key, fetch)
+        assert len(fetches) == 2
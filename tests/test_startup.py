@@ -0,0 +1,72 @@
+"""
+Tests for lazy loading, warm-up and the startup report.
+"""
+import subprocess
+import sys
+import threading
+import pytest
+from src import startup
+
+
+@pytest.fixture
+def fresh_state(monkeypatch):
+    """Gives each test its own startup state."""
+    monkeypatch.setattr(startup, "_imports", {})
+    monkeypatch.setattr(startup, "_steps", {})
+    monkeypatch.setattr(startup, "_errors", {})
+    monkeypatch.setattr(startup, "_state", {"status": startup.STARTING, "http_ready": None,
+                                            "warm_up_started": None, "warm_up_finished": None})
+    monkeypatch.setattr(startup, "_warm", threading.Event())
+
+
+@pytest.fixture
+def slow_module(tmp_path, monkeypatch):
+    """A module that takes a moment to import."""
+    (tmp_path / "kubesage_slow_module.py").write_text("import time\ntime.sleep(0.05)\nVALUE = 42\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield "kubesage_slow_module"
+    sys.modules.pop("kubesage_slow_module", None)
+
+
+class TestStartup:
+    """Tests for src.startup."""
+
+    def test_load_times_first_import_only(self, fresh_state, slow_module):
+        assert startup.load(slow_module).VALUE == 42
+        assert startup.load(slow_module).VALUE == 42
+        report = startup.startup_report()
+        assert [i["module"] for i in report["imports"]] == [slow_module]
+        assert report["imports"][0]["seconds"] >= 0.05
+
+    def test_warm_up_runs_imports_and_steps_in_order(self, fresh_state, slow_module):
+        order = []
+        ok = startup.warm_up([
+            ("first", lambda: order.append(slow_module in sys.modules)),
+            slow_module,
+            ("second", lambda: order.append(slow_module in sys.modules)),
+        ])
+        report = startup.startup_report()
+        assert ok and order == [False, True]
+        assert report["status"] == startup.WARM
+        assert {s["step"] for s in report["steps"]} == {"first", "second"}
+        assert startup.wait_until_warm(0)
+
+    def test_failures_are_reported_without_stopping_warm_up(self, fresh_state, slow_module):
+        def broken():
+            raise RuntimeError("no cluster")
+
+        ok = startup.warm_up([("broken", broken), "kubesage_missing_module", slow_module])
+        report = startup.startup_report()
+        assert not ok
+        assert report["status"] == startup.FAILED
+        assert report["errors"]["broken"] == "no cluster"
+        assert "kubesage_missing_module" in report["errors"]
+        assert slow_module in sys.modules
+
+    def test_importing_the_app_does_not_load_heavy_subsystems(self):
+        heavy = ["langchain_openai", "langchain.agents", "openai", "kubernetes", "src.langchain_agent"]
+        loaded = subprocess.run(
+            [sys.executable, "-c", f"import sys, src.main; print([m for m in {heavy!r} if m in sys.modules])"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        assert loaded == "[]"
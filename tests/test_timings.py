@@ -0,0 +1,66 @@
+"""
+Tests for the timings module.
+"""
+from src import rest_api_handler
+from src.timings import build_timings
+from src.tracing import begin_span, collect_spans, start_span
+
+
+def finished_span(name, attributes=None, parent=None):
+    span = begin_span(name, attributes, parent=parent)
+    span.end()
+    return span
+
+
+class TestTimings:
+    """Tests for the per-request latency and token breakdown."""
+
+    def test_steps_pair_llm_calls_with_following_tools(self):
+        spans = []
+        with collect_spans(spans), start_span("root") as root:
+            finished_span("llm.call", {"gen_ai.usage.input_tokens": 900, "gen_ai.usage.output_tokens": 40})
+            tool = begin_span("tool Get All Pods", {"tool.name": "Get All Pods"})
+            finished_span("k8s GET", parent=tool)
+            finished_span("k8s GET", parent=tool)
+            tool.add_to_attribute("k8s.response.bytes", 2048)
+            tool.end()
+            finished_span("llm.call", {"gen_ai.usage.input_tokens": 1500, "gen_ai.usage.output_tokens": 120})
+            timings = build_timings(spans, root)
+
+        first, second = timings["steps"]
+        assert first["tool"] == "Get All Pods"
+        assert first["prompt_tokens"] == 900
+        assert first["k8s_bytes"] == 2048
+        assert first["k8s_requests"] == 2
+        assert second["tool"] is None
+        assert second["completion_tokens"] == 120
+
+        totals = timings["totals"]
+        assert totals["llm_calls"] == 2
+        assert totals["tool_calls"] == 1
+        assert totals["prompt_tokens"] == 2400
+        assert totals["completion_tokens"] == 160
+        assert totals["k8s_bytes"] == 2048
+        assert totals["wall_ms"] >= totals["tool_wall_ms"]
+
+    def test_tool_without_preceding_llm_call_gets_own_step(self):
+        spans = []
+        with collect_spans(spans), start_span("root") as root:
+            finished_span("tool Get All Nodes", {"tool.name": "Get All Nodes"})
+            timings = build_timings(spans, root)
+
+        assert timings["steps"][0]["tool"] == "Get All Nodes"
+        assert timings["steps"][0]["llm_latency_ms"] == 0.0
+
+    def test_no_spans_recorded_without_collector(self):
+        with start_span("root") as root:
+            pass
+        assert not root.is_recording
+
+    def test_rest_query_reports_timings_only_when_asked(self, monkeypatch):
+        monkeypatch.setattr(rest_api_handler, "process_query", lambda query, *args, **kwargs: {"output": "ok"})
+        plain = rest_api_handler.process_kubernetes_query(rest_api_handler.QueryRequest(query="list pods"))
+        assert plain.output == "ok" and plain.timings is None
+        timed = rest_api_handler.process_kubernetes_query(
+            rest_api_handler.QueryRequest(query="list pods", include_timings=True))
+        assert timed.timings.totals.llm_calls == 0
@@ -0,0 +1,111 @@
+"""
+Tests for the tracing module.
+"""
+import json
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.tools import Tool
+
+from src import tracing
+from src.tracing import (
+    FileExporter, TracingCallbackHandler, get_current_span, record_k8s_bytes,
+    set_exporter, start_span, NOOP_SPAN
+)
+
+
+class CollectingExporter:
+    """Keeps exported spans in memory."""
+
+    def __init__(self):
+        self.batches = []
+
+    def export(self, spans):
+        self.batches.append(list(spans))
+
+
+@pytest.fixture
+def exporter():
+    collecting = CollectingExporter()
+    set_exporter(collecting)
+    yield collecting
+    set_exporter(None)
+
+
+class TestTracing:
+    """Tests for span creation, export and LangChain instrumentation."""
+
+    def test_spans_are_noops_when_disabled(self):
+        set_exporter(None)
+        with start_span("disabled") as span:
+            assert span is NOOP_SPAN
+            assert get_current_span() is NOOP_SPAN
+
+    def test_nested_spans_share_trace_and_export_on_root_end(self, exporter):
+        with start_span("root", kind="server") as root:
+            with start_span("child") as child:
+                record_k8s_bytes(128)
+            assert exporter.batches == []
+
+        assert len(exporter.batches) == 1
+        spans = {s.name: s for s in exporter.batches[0]}
+        assert spans["child"].trace_id == root.trace_id
+        assert spans["child"].parent_span_id == root.span_id
+        assert spans["child"].attributes["k8s.response.bytes"] == 128
+        assert child.end_time_ns >= child.start_time_ns
+
+    def test_exception_marks_span_as_error(self, exporter):
+        with pytest.raises(RuntimeError):
+            with start_span("root"):
+                raise RuntimeError("boom")
+
+        span = exporter.batches[0][0]
+        assert span.status == "error"
+        assert span.to_otlp()["status"] == {"code": 2, "message": "boom"}
+
+    def test_file_exporter_writes_otlp_json_lines(self, tmp_path):
+        path = tmp_path / "traces.jsonl"
+        set_exporter(FileExporter(str(path)))
+        try:
+            with start_span("root", {"kubesage.query.size": 12}):
+                with start_span("child"):
+                    pass
+        finally:
+            set_exporter(None)
+
+        lines = [json.loads(line) for line in path.read_text().splitlines()]
+        assert [line["name"] for line in lines] == ["child", "root"]
+        assert lines[0]["parentSpanId"] == lines[1]["spanId"]
+        assert {"key": "kubesage.query.size", "value": {"intValue": "12"}} in lines[1]["attributes"]
+
+    def test_callback_handler_records_llm_and_tool_spans(self, exporter):
+        handler = TracingCallbackHandler()
+        llm = FakeListChatModel(responses=["pong"])
+
+        def tool_func(_):
+            record_k8s_bytes(512)
+            return "tool output"
+
+        tool = Tool(name="Get All Pods", description="Lists pods.", func=tool_func)
+
+        with start_span("root"):
+            llm.invoke("ping", config={"callbacks": [handler]})
+            tool.invoke("input", config={"callbacks": [handler]})
+
+        spans = {s.name: s for s in exporter.batches[0]}
+        root = spans["root"]
+        assert spans["llm.call"].parent_span_id == root.span_id
+        assert spans["llm.call"].attributes["gen_ai.prompt.size"] == len("ping")
+        tool_span = spans["tool Get All Pods"]
+        assert tool_span.parent_span_id == root.span_id
+        assert tool_span.attributes["tool.output.size"] == len("tool output")
+        assert tool_span.attributes["k8s.response.bytes"] == 512
+        assert "k8s.response.bytes" not in root.attributes
+
+    def test_unknown_exporter_is_rejected(self, monkeypatch):
+        monkeypatch.setenv("KUBESAGE_TRACE_EXPORTER", "carrier-pigeon")
+        monkeypatch.setattr(tracing, "_exporter_configured", False)
+        try:
+            with pytest.raises(ValueError, match="Unknown trace exporter"):
+                tracing.get_exporter()
+        finally:
+            set_exporter(None)
@@ -0,0 +1,200 @@
+"""
+Tests for the WebSocket handler.
+"""
+import asyncio
+import json
+import threading
+import time
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from src import websocket_handler
+from src.cancellation import check_cancelled, iteration_budget, time_left
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """An app serving the handler, with an agent that sleeps for the seconds given in the query."""
+    calls = []
+    running = []
+    peak = [0]
+    lock = threading.Lock()
+
+    def process_query(query, session_id=None, model_name=None):
+        with lock:
+            calls.append((query, session_id))
+            running.append(query)
+            peak[0] = max(peak[0], len(running))
+        try:
+            if query == "fail":
+                raise RuntimeError("boom")
+            # Sleeps in steps, stopping like the agent does when the query is cancelled
+            deadline = time.monotonic() + (float(query.split()[-1]) if query[-1].isdigit() else 0)
+            while time.monotonic() < deadline:
+                check_cancelled()
+                if time_left() == 0:
+                    return {"output": f"best effort answer to {query} in {iteration_budget()} steps"}
+                time.sleep(0.01)
+            return {"output": f"answer to {query}"}
+        finally:
+            with lock:
+                running.remove(query)
+
+    monkeypatch.setattr(websocket_handler, "process_query", process_query)
+    monkeypatch.setattr(websocket_handler, "init_llm_and_executor", lambda: None)
+    monkeypatch.setenv("KUBESAGE_WS_MAX_CONCURRENCY", "2")
+    monkeypatch.setenv("KUBESAGE_WS_MAX_QUEUED", "3")
+    app = FastAPI()
+    app.add_api_websocket_route("/ws", websocket_handler.websocket_handler)
+    test_client = TestClient(app)
+    test_client.calls, test_client.peak = calls, peak
+    return test_client
+
+
+def frames(ws, count):
+    """Reads messages until ``count`` frames with an id were received."""
+    received = []
+    while len(received) < count:
+        message = websocket_handler.parse_frame(ws.receive_text())
+        if message is not None and message["type"] in ("result", "error", "cancelled"):
+            received.append(message)
+    return received
+
+
+def query(request_id, text):
+    return json.dumps({"type": "query", "id": request_id, "query": text})
+
+
+class TestWebSocketHandler:
+    """Tests for plain-text and framed queries."""
+
+    def test_plain_text_queries_are_answered_in_order(self, client):
+        with client.websocket_connect("/ws?session=abc") as ws:
+            assert ws.receive_text().startswith("🔹")
+            assert json.loads(ws.receive_text()) == {"type": "session", "session_id": "abc"}
+            ws.send_text("list pods")
+            assert ws.receive_text().startswith("✅")
+            assert ws.receive_text() == "answer to list pods"
+            ws.send_text("exit")
+            assert ws.receive_text() == "❌ Closing connection."
+        assert client.calls == [("list pods", "abc")]
+
+    def test_session_frame_is_sent_on_request(self, client):
+        with client.websocket_connect("/ws?session=") as ws:
+            session_id = ws.receive_text().rsplit("Session: ", 1)[1]
+            assert json.loads(ws.receive_text()) == {"type": "session", "session_id": session_id}
+        with client.websocket_connect("/ws") as ws:
+            ws.receive_text()
+            ws.send_text("list pods")
+            assert ws.receive_text().startswith("✅")
+
+    def test_plain_text_timings_are_opt_in(self, client):
+        with client.websocket_connect("/ws?include_timings=true") as ws:
+            ws.send_text("list pods")
+            messages = [ws.receive_text() for _ in range(4)]
+        assert messages[0].startswith("🔹") and "Session: " in messages[0]
+        assert messages[2] == "answer to list pods"
+        assert json.loads(messages[3])["type"] == "timings"
+
+    def test_framed_results_interleave(self, client):
+        with client.websocket_connect("/ws") as ws:
+            ws.send_text(json.dumps({"type": "query", "id": "slow", "query": "wait 0.5", "include_timings": True}))
+            ws.send_text(query("fast", "wait 0"))
+            ws.send_text(query("bad", "fail"))
+            received = frames(ws, 3)
+        assert [f["id"] for f in received][-1] == "slow"
+        by_id = {f["id"]: f for f in received}
+        assert by_id["fast"]["type"] == "result" and by_id["fast"]["output"] == "answer to wait 0"
+        assert by_id["bad"] == {"type": "error", "id": "bad", "error": "❌ Query processing error: boom"}
+        assert "totals" in by_id["slow"]["timings"]
+        assert "timings" not in by_id["fast"]
+
+    def test_connection_limits(self, client):
+        with client.websocket_connect("/ws") as ws:
+            for i in range(4):
+                ws.send_text(query(f"q{i}", "wait 0.3"))
+            ws.send_text(query("q0", "wait 0"))
+            received = frames(ws, 5)
+        errors = [f for f in received if f["type"] == "error"]
+        assert {f["id"] for f in errors} == {"q3", "q0"}
+        assert "Too many queries" in next(f["error"] for f in errors if f["id"] == "q3")
+        assert sorted(f["id"] for f in received if f["type"] == "result") == ["q0", "q1", "q2"]
+        assert client.peak[0] == 2
+
+    def test_invalid_frames_are_rejected(self, client):
+        with client.websocket_connect("/ws") as ws:
+            ws.send_text(json.dumps({"type": "subscribe", "id": "x"}))
+            ws.send_text(json.dumps({"type": "query", "query": "no id"}))
+            ws.send_text(json.dumps({"type": "query", "id": "t", "query": "q", "timeout": "soon"}))
+            ws.send_text(json.dumps({"type": "query", "id": "i", "query": "q", "max_iterations": 0}))
+            received = frames(ws, 4)
+        assert "Unknown frame type" in received[0]["error"]
+        assert "needs a string id" in received[1]["error"]
+        assert "timeout must be" in received[2]["error"]
+        assert "max_iterations must be" in received[3]["error"]
+
+    def test_frames_carry_a_time_and_iteration_budget(self, client):
+        with client.websocket_connect("/ws") as ws:
+            started = time.monotonic()
+            ws.send_text(json.dumps({"type": "query", "id": "q1", "query": "wait 5", "timeout": 0.2,
+                                     "max_iterations": 4}))
+            received = frames(ws, 1)
+        assert time.monotonic() - started < 2
+        assert received[0]["output"] == "best effort answer to wait 5 in 4 steps"
+
+    def test_framed_queries_can_be_cancelled(self, client):
+        with client.websocket_connect("/ws") as ws:
+            ws.send_text(query("slow", "wait 5"))
+            ws.send_text(query("other", "wait 5"))
+            time.sleep(0.1)
+            started = time.monotonic()
+            ws.send_text(json.dumps({"type": "cancel", "id": "slow"}))
+            ws.send_text("cancel other")
+            ws.send_text(json.dumps({"type": "cancel", "id": "missing"}))
+            received = frames(ws, 3)
+        assert time.monotonic() - started < 2
+        assert {"type": "cancelled", "id": "slow"} in received
+        assert {"type": "cancelled", "id": "other"} in received
+        assert {"type": "error", "id": "missing", "error": "❌ No query missing in progress."} in received
+
+    def test_questions_starting_with_cancel_are_answered(self, client):
+        with client.websocket_connect("/ws") as ws:
+            ws.receive_text()
+            ws.send_text("cancel the stuck cronjob backup?")
+            assert ws.receive_text().startswith("✅")
+            assert ws.receive_text() == "answer to cancel the stuck cronjob backup?"
+
+    def test_exit_cancels_the_query_in_progress(self, client):
+        with client.websocket_connect("/ws") as ws:
+            ws.send_text("wait 5")
+            while not ws.receive_text().startswith("✅"):
+                pass
+            time.sleep(0.1)
+            started = time.monotonic()
+            ws.send_text("exit")
+            assert ws.receive_text() == "❌ Closing connection."
+        assert time.monotonic() - started < 2
+
+    def test_slow_reader_holds_back_new_queries(self, monkeypatch):
+        started = []
+
+        async def answer(client_id, text, profiling, session_id, *args, **kwargs):
+            started.append(text)
+            return "out", None, {}
+
+        monkeypatch.setattr(websocket_handler, "_answer", answer)
+
+        async def scenario():
+            outbox = asyncio.Queue(maxsize=1)
+            framed = websocket_handler.FramedQueries(outbox.put, "client", "session", max_concurrency=1)
+            for i in range(3):
+                await framed.handle({"type": "query", "id": f"q{i}", "query": f"q{i}"})
+            await asyncio.sleep(0.05)
+            # q0's result fills the buffer; q1 waits to send it while holding the only slot
+            assert started == ["q0", "q1"]
+            await outbox.get()
+            await asyncio.sleep(0.05)
+            assert started == ["q0", "q1", "q2"]
+            framed.cancel_all()
+
+        asyncio.run(scenario())